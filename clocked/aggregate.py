@@ -0,0 +1,140 @@
+""" Summary statistics for the timings sharing a name. """
+
+
+from clocked.histogram import Histogram
+
+
+class Aggregate(object):
+    """
+    Summary statistics for the timings sharing a name: the number of hits and
+    the total, min and max time spent, along with the cpu time when it was
+    captured and the number of items produced by generators.
+
+    Each time spent is also counted into a Histogram, from which percentiles
+    are estimated within 1% of the actual value.
+
+    Timings of sampled calls stand for sample_rate calls each, making the
+    counts and totals estimates.
+    """
+
+    __slots__ = ('hits', 'total_ms', 'min_ms', 'max_ms', 'cpu_ms', 'yields',
+                 'histogram', 'estimated')
+
+    def __init__(self):
+        self.hits = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+        self.cpu_ms = None
+        self.yields = None
+        self.histogram = Histogram()
+        self.estimated = False
+
+    def add(self, ms, cpu_ms=None, yields=None, sample_rate=1):
+        """
+        Adds a single timing to this aggregate.
+
+        :param float ms: the timing's duration in milliseconds
+        :param float cpu_ms: the timing's cpu time in milliseconds, if
+         captured
+        :param int yields: the number of items the timing produced, for
+         generators
+        :param int sample_rate: the number of calls the timing stands for,
+         when only 1 in sample_rate calls was timed
+        """
+        self.hits += sample_rate
+        self.total_ms += ms * sample_rate
+        self.histogram.record(int(ms * 1000000), sample_rate)
+
+        if self.min_ms is None or ms < self.min_ms:
+            self.min_ms = ms
+
+        if self.max_ms < ms:
+            self.max_ms = ms
+
+        if sample_rate != 1:
+            self.estimated = True
+            if cpu_ms is not None:
+                cpu_ms *= sample_rate
+            if yields is not None:
+                yields *= sample_rate
+
+        if cpu_ms is not None:
+            if self.cpu_ms is None:
+                self.cpu_ms = cpu_ms
+            else:
+                self.cpu_ms += cpu_ms
+
+        if yields is not None:
+            if self.yields is None:
+                self.yields = yields
+            else:
+                self.yields += yields
+
+    def merge(self, other):
+        """
+        Adds every timing summarized by another aggregate to this one.
+
+        :param Aggregate other: the aggregate to merge in
+        """
+        self.hits += other.hits
+        self.total_ms += other.total_ms
+        self.histogram.merge(other.histogram)
+        self.estimated = self.estimated or other.estimated
+
+        if other.min_ms is not None and (
+                self.min_ms is None or other.min_ms < self.min_ms):
+            self.min_ms = other.min_ms
+
+        if self.max_ms < other.max_ms:
+            self.max_ms = other.max_ms
+
+        if other.cpu_ms is not None:
+            if self.cpu_ms is None:
+                self.cpu_ms = other.cpu_ms
+            else:
+                self.cpu_ms += other.cpu_ms
+
+        if other.yields is not None:
+            if self.yields is None:
+                self.yields = other.yields
+            else:
+                self.yields += other.yields
+
+    def percentile_ms(self, percentile):
+        """
+        Estimates the time, in milliseconds, below which the given percentage
+        of the timings fall; None when there are no timings.
+
+        :param float percentile: the percentile, between 0 and 100
+        """
+        ns = self.histogram.quantile(percentile / 100.0)
+        if ns is None:
+            return None
+
+        return min(max(ns / 1000000.0, self.min_ms), self.max_ms)
+
+    @property
+    def ms_per_yield(self):
+        """
+        Gets the average time spent producing each item, for generators; None
+        when no items were produced.
+        """
+        if not self.yields:
+            return None
+
+        return self.total_ms / self.yields
+
+    @property
+    def off_cpu_percent(self):
+        """
+        Gets the percentage of the total time that was not spent on the cpu
+        (e.g. waiting on I/O); None when cpu time was not captured.
+        """
+        if self.cpu_ms is None:
+            return None
+
+        if self.total_ms <= 0.0:
+            return 0.0
+
+        return max(self.total_ms - self.cpu_ms, 0.0) * 100.0 / self.total_ms
@@ -0,0 +1,124 @@
+"""
+asyncio support for clocked: timing coroutine functions and async generators.
+
+Requires python 3.6+, and is only imported by clocked.decorators when
+available.
+"""
+
+
+import itertools
+from clocked.profiler import Profiler
+from clocked.suspendable import TimedResumptions
+
+
+def create_coroutine_wrapper(obj, name, exclude_suspended=False,
+                             sample_rate=1):
+    """
+    Wraps a coroutine function so that each call is timed from its first
+    resumption until it returns, as a single step.
+
+    :param func obj: the coroutine function to wrap
+    :param int name: the id of the step name
+    :param bool exclude_suspended: whether to leave out the time spent
+     suspended (awaiting)
+    :param int sample_rate: only time 1 in sample_rate calls
+    """
+    calls = itertools.count()
+
+    async def wrapper(*args, **kwargs):
+        if sample_rate != 1 and next(calls) % sample_rate:
+            return await obj(*args, **kwargs)
+
+        profiler = Profiler.current()
+        if profiler is None:
+            return await obj(*args, **kwargs)
+
+        return await TimedResumptions(
+            profiler.suspendable_step(name, exclude_suspended, sample_rate),
+            obj(*args, **kwargs).__await__()
+        )
+
+    return wrapper
+
+
+def create_async_generator_wrapper(obj, name, exclude_suspended=False,
+                                   sample_rate=1):
+    """
+    Wraps an async generator function so that each generator is timed from
+    its first resumption until it is exhausted, as a single step.
+
+    :param func obj: the async generator function to wrap
+    :param int name: the id of the step name
+    :param bool exclude_suspended: whether to leave out the time spent
+     suspended (awaiting, or waiting for the consumer to ask for more)
+    :param int sample_rate: only time 1 in sample_rate generators
+    """
+    calls = itertools.count()
+
+    def wrapper(*args, **kwargs):
+        if sample_rate != 1 and next(calls) % sample_rate:
+            return obj(*args, **kwargs)
+
+        profiler = Profiler.current()
+        if profiler is None:
+            return obj(*args, **kwargs)
+
+        return TimedAsyncGenerator(
+            profiler.suspendable_step(name, exclude_suspended, sample_rate),
+            obj(*args, **kwargs)
+        )
+
+    return wrapper
+
+
+class TimedAsyncGenerator(object):
+    """
+    Wraps an async generator, timing all of its resumptions as one step.
+    """
+
+    __slots__ = ('_step', '_agen')
+
+    def __init__(self, step, agen):
+        self._step = step
+        self._agen = agen
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return TimedResumptions(
+            self._step,
+            self._agen.__anext__(),
+            StopAsyncIteration
+        )
+
+    def asend(self, value):
+        """
+        Resumes the generator, sending it a value.
+
+        :param value: the value to send
+        """
+        return TimedResumptions(
+            self._step,
+            self._agen.asend(value),
+            StopAsyncIteration
+        )
+
+    def athrow(self, *args):
+        """
+        Resumes the generator, raising an exception inside of it.
+        """
+        return TimedResumptions(
+            self._step,
+            self._agen.athrow(*args),
+            StopAsyncIteration
+        )
+
+    def aclose(self):
+        """
+        Closes the generator, completing its step if it was started.
+        """
+        if not self._step.is_started or self._step.is_stopped:
+            return self._agen.aclose()
+
+        return TimedResumptions(self._step, self._agen.aclose())
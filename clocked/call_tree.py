@@ -0,0 +1,470 @@
+"""
+A calling context tree: steps merged by call path, each path keeping running
+counters instead of one Timing per call.
+"""
+
+
+from clocked import names
+from clocked.aggregate import Aggregate
+from clocked.histogram import _SUB_BUCKET_COUNT, _SUB_BUCKET_HALF, \
+    Histogram, SUB_BUCKET_BITS
+
+
+class CallPath(object):
+    """
+    Every call of a step with the same name under the same call path, merged
+    into a single node with running counters.
+
+    The counters are the number of hits along with the total, min and max
+    duration (including children), and the total, min, max and cpu time
+    spent in the step itself (excluding children), with a histogram of it,
+    from which the path's Aggregate is built when it is read. Calls that
+    exited with an exception are aggregated separately by exception type.
+    Sampled calls count as sample_rate calls each, making the counters
+    estimates.
+    """
+
+    __slots__ = ('name_id', 'parent_timing', 'children', 'children_by_id',
+                 'hits', 'total_ns', 'min_ns', 'max_ns', 'self_ns',
+                 'self_min_ns', 'self_max_ns', 'cpu_ns', 'yields',
+                 'histogram', 'error_aggregates', 'estimated')
+
+    def __init__(self, name_id, parent=None):
+        self.name_id = name_id
+        self.parent_timing = parent
+        self.children = None
+        self.children_by_id = dict()
+        self.hits = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        # the time spent in the step itself by the calls that did not raise
+        self.self_ns = 0
+        self.self_min_ns = None
+        self.self_max_ns = 0
+        self.cpu_ns = None
+        self.yields = None
+        self.histogram = Histogram()
+        self.error_aggregates = None
+        self.estimated = False
+
+    # exceptions are aggregated per type rather than kept on the path
+    exception = None
+
+    @property
+    def name(self):
+        """
+        Gets the name of the step called on this path.
+        """
+        return names.get_name(self.name_id)
+
+    @property
+    def has_children(self):
+        """
+        Gets a value indicating whether any steps were called under this path.
+        """
+        return self.children is not None and 0 < len(self.children)
+
+    @property
+    def duration_ns(self):
+        """
+        Gets the total duration, in nanoseconds, of every call on this path.
+        """
+        return self.total_ns
+
+    @property
+    def duration_milliseconds(self):
+        """
+        Gets the total duration, in milliseconds, of every call on this path.
+        """
+        return self.total_ns / 1000000.0
+
+    def get_child(self, name_id):
+        """
+        Gets the path for a step called from this one, creating it on the
+        first call.
+
+        :param int name_id: the id of the step's name
+        """
+        child = self.children_by_id.get(name_id)
+        if child is None:
+            child = CallPath(name_id, self)
+            if self.children is None:
+                self.children = []
+            self.children.append(child)
+            self.children_by_id[name_id] = child
+
+        return child
+
+    @property
+    def aggregate(self):
+        """
+        Gets the Aggregate of the time spent in the step itself by the calls
+        on this path that did not raise.
+
+        :rtype: Aggregate
+        """
+        aggregate = Aggregate()
+        aggregate.hits = self.hits
+        if self.error_aggregates is not None:
+            for i in self.error_aggregates.values():
+                aggregate.hits -= i.hits
+
+        aggregate.total_ms = self.self_ns / 1000000.0
+        if self.self_min_ns is not None:
+            aggregate.min_ms = self.self_min_ns / 1000000.0
+        aggregate.max_ms = self.self_max_ns / 1000000.0
+        if self.cpu_ns is not None:
+            aggregate.cpu_ms = self.cpu_ns / 1000000.0
+        aggregate.yields = self.yields
+        aggregate.histogram.merge(self.histogram)
+        aggregate.estimated = self.estimated
+        return aggregate
+
+    @aggregate.setter
+    def aggregate(self, aggregate):
+        """
+        Sets the counters of the time spent in the step itself from an
+        Aggregate, e.g. a restored one; the hits are the path's own.
+
+        :param Aggregate aggregate: the aggregate
+        """
+        self.self_ns = int(round(aggregate.total_ms * 1000000))
+        if aggregate.min_ms is None:
+            self.self_min_ns = None
+        else:
+            self.self_min_ns = int(round(aggregate.min_ms * 1000000))
+        self.self_max_ns = int(round(aggregate.max_ms * 1000000))
+        if aggregate.cpu_ms is None:
+            self.cpu_ns = None
+        else:
+            self.cpu_ns = int(round(aggregate.cpu_ms * 1000000))
+        self.yields = aggregate.yields
+        self.histogram = Histogram()
+        self.histogram.merge(aggregate.histogram)
+
+    @property
+    def exception_names(self):
+        """
+        Gets the names of the exceptions calls on this path exited with.
+        """
+        if self.error_aggregates is None:
+            return []
+
+        return sorted(i.__name__ for i in self.error_aggregates)
+
+    def merge(self, other):
+        """
+        Adds the counters of another path, e.g. the same call path of another
+        session, to this one's; the children are left to the caller.
+
+        Calls that exited with an exception are merged by the name of the
+        exception type, as types are not shared across processes.
+
+        :param CallPath other: the path to merge in
+        """
+        self.hits += other.hits
+        self.total_ns += other.total_ns
+        self.estimated = self.estimated or other.estimated
+        if other.min_ns is not None and (
+                self.min_ns is None or other.min_ns < self.min_ns):
+            self.min_ns = other.min_ns
+        if self.max_ns < other.max_ns:
+            self.max_ns = other.max_ns
+
+        self.self_ns += other.self_ns
+        if other.self_min_ns is not None and (
+                self.self_min_ns is None or
+                other.self_min_ns < self.self_min_ns):
+            self.self_min_ns = other.self_min_ns
+        if self.self_max_ns < other.self_max_ns:
+            self.self_max_ns = other.self_max_ns
+        if other.cpu_ns is not None:
+            if self.cpu_ns is None:
+                self.cpu_ns = other.cpu_ns
+            else:
+                self.cpu_ns += other.cpu_ns
+        if other.yields is not None:
+            if self.yields is None:
+                self.yields = other.yields
+            else:
+                self.yields += other.yields
+        self.histogram.merge(other.histogram)
+
+        if other.error_aggregates is None:
+            return
+
+        if self.error_aggregates is None:
+            self.error_aggregates = dict()
+
+        by_name = dict((i.__name__, i) for i in self.error_aggregates)
+        for exception, aggregate in other.error_aggregates.items():
+            exception = by_name.get(exception.__name__, exception)
+
+            merged = self.error_aggregates.get(exception)
+            if merged is None:
+                merged = self.error_aggregates[exception] = Aggregate()
+            merged.merge(aggregate)
+
+    def record(self, duration, child_ns, cpu_duration, child_cpu_ns,
+               exception=None, yields=None, sample_rate=1):
+        """
+        Adds a completed call to the counters.
+
+        :param int duration: the call's duration in nanoseconds
+        :param int child_ns: the nanoseconds spent in the call's children
+        :param int cpu_duration: the call's cpu time in nanoseconds, if
+         captured
+        :param int child_cpu_ns: the cpu nanoseconds spent in the call's
+         children
+        :param type exception: the type of the exception the call exited
+         with, if any
+        :param int yields: the number of items the call produced, for
+         generators
+        :param int sample_rate: the number of calls the call stands for, when
+         only 1 in sample_rate calls was timed
+        """
+        self.hits += sample_rate
+        self.total_ns += duration * sample_rate
+        if self.min_ns is None or duration < self.min_ns:
+            self.min_ns = duration
+        if self.max_ns < duration:
+            self.max_ns = duration
+
+        self_ns = duration - child_ns
+        if self_ns < 0:
+            self_ns = 0
+
+        if exception is not None:
+            self._record_error(
+                exception,
+                self_ns,
+                cpu_duration,
+                child_cpu_ns,
+                yields,
+                sample_rate
+            )
+            return
+
+        # the same as Aggregate.add, on the path's own counters
+        if self.self_min_ns is None or self_ns < self.self_min_ns:
+            self.self_min_ns = self_ns
+        if self.self_max_ns < self_ns:
+            self.self_max_ns = self_ns
+
+        # Histogram.record, inlined
+        if self_ns < _SUB_BUCKET_COUNT:
+            index = self_ns
+        else:
+            shift = self_ns.bit_length() - SUB_BUCKET_BITS
+            index = shift * _SUB_BUCKET_HALF + (self_ns >> shift)
+        histogram = self.histogram
+        counts = histogram.counts
+        counts[index] = counts.get(index, 0) + sample_rate
+        histogram.count += sample_rate
+
+        if sample_rate != 1:
+            self.estimated = True
+            self_ns *= sample_rate
+            if yields is not None:
+                yields *= sample_rate
+        self.self_ns += self_ns
+
+        if cpu_duration is not None:
+            cpu_ns = cpu_duration - child_cpu_ns
+            if cpu_ns < 0:
+                cpu_ns = 0
+            if self.cpu_ns is None:
+                self.cpu_ns = cpu_ns * sample_rate
+            else:
+                self.cpu_ns += cpu_ns * sample_rate
+
+        if yields is not None:
+            if self.yields is None:
+                self.yields = yields
+            else:
+                self.yields += yields
+
+    def _record_error(self, exception, self_ns, cpu_duration, child_cpu_ns,
+                      yields, sample_rate):
+        """
+        Adds a call that exited with an exception to the aggregate of its
+        exception type.
+        """
+        if sample_rate != 1:
+            self.estimated = True
+        if self.error_aggregates is None:
+            self.error_aggregates = dict()
+
+        aggregate = self.error_aggregates.get(exception)
+        if aggregate is None:
+            aggregate = self.error_aggregates[exception] = Aggregate()
+
+        if cpu_duration is None:
+            cpu_ms = None
+        else:
+            cpu_ms = max(cpu_duration - child_cpu_ns, 0) / 1000000.0
+
+        aggregate.add(self_ns / 1000000.0, cpu_ms, yields, sample_rate)
+
+
+def merge_paths(merged, other):
+    """
+    Adds the calls of a calling context tree to another, path by path.
+
+    :param CallPath merged: the root of the tree to add to
+    :param CallPath other: the root of the tree to add, for the same step
+    """
+    paths = [(other, merged)]
+    while 0 < len(paths):
+        path, merged = paths.pop()
+        merged.merge(path)
+
+        if path.has_children:
+            for child in path.children:
+                paths.append((child, merged.get_child(child.name_id)))
+
+
+def merge_timings(root, now_ns, sample_rate=1):
+    """
+    Merges a Timing hierarchy into a calling context tree, where the repeated
+    calls of a step under the same call path become a single CallPath.
+
+    :param Timing root: the root of the hierarchy
+    :param int now_ns: the session's elapsed nanoseconds, used as the end of
+     the timings still running
+    :param int sample_rate: the number of sessions the hierarchy stands for,
+     when only 1 in sample_rate sessions was profiled
+    :rtype: CallPath
+    """
+    merged = CallPath(root.name_id)
+    record_timings(merged, root, now_ns, sample_rate)
+    return merged
+
+
+def record_timings(path, timing, now_ns, sample_rate=1):
+    """
+    Records a timing and the timings under it into a calling context tree,
+    along with the calls pruned from under them (see min_save_ms).
+
+    :param CallPath path: the path to record the timing into
+    :param Timing timing: the timing
+    :param int now_ns: the session's elapsed nanoseconds, used as the end of
+     the timings still running
+    :param int sample_rate: the number of sessions the hierarchy stands for,
+     when only 1 in sample_rate sessions was profiled
+    """
+    timings = [(timing, path)]
+
+    while 0 < len(timings):
+        timing, path = timings.pop()
+
+        duration = timing.duration_ns
+        if duration is None:
+            duration = now_ns - timing.start_ns
+
+        # the children that stopped are counted already
+        child_ns = timing.child_ns
+        if timing.has_children:
+            for child in timing.children:
+                if child.duration_ns is None:
+                    child_ns += now_ns - child.start_ns
+
+                timings.append((child, path.get_child(child.name_id)))
+
+        path.record(
+            duration,
+            child_ns,
+            timing.cpu_duration_ns,
+            timing.child_cpu_ns,
+            timing.exception,
+            timing.yields,
+            timing.sample_rate * sample_rate
+        )
+
+        if timing.pruned is not None:
+            merge_paths(path, timing.pruned)
+
+
+class CallFrame(object):
+    """
+    A single running call on a CallPath. Frames only live while their call is
+    running, and record into their path when stopped.
+    """
+
+    __slots__ = ('profiler', 'node', 'parent_timing', 'start_ns',
+                 'cpu_start_ns', 'duration_ns', 'cpu_duration_ns',
+                 'child_ns', 'child_cpu_ns', 'exception', 'yields',
+                 'sample_rate')
+
+    def __init__(self, profiler, parent, node, sample_rate=1):
+        self.profiler = profiler
+        self.node = node
+        self.parent_timing = parent
+        self.sample_rate = sample_rate
+        profiler.head = self
+        self.duration_ns = None
+        self.cpu_duration_ns = None
+        self.child_ns = 0
+        self.child_cpu_ns = 0
+        self.exception = None
+        self.yields = None
+
+        cpu_clock = profiler.cpu_clock
+        self.cpu_start_ns = None if cpu_clock is None else cpu_clock()
+        self.start_ns = profiler.sw.elapsed_nanoseconds
+
+    @property
+    def name(self):
+        """
+        Gets the name of the step being called.
+        """
+        return self.node.name
+
+    def stop(self, exception=None):
+        """
+        Completes this call, records it into its path and sets the head up
+        one level.
+
+        :param type exception: the type of the exception the step exited
+         with, if any
+        :returns: whether this call stopped it, rather than an earlier one
+        """
+        profiler = self.profiler
+
+        # stopped exactly once, whether by its own thread or by stop_impl,
+        # and added to the parent's totals under the same lock, as children
+        # of the same parent may stop on several threads at once
+        lock = profiler.stop_lock
+        lock.acquire()
+        if self.duration_ns is not None:
+            lock.release()
+            return False
+
+        duration = self.duration_ns = \
+            profiler.sw.elapsed_nanoseconds - self.start_ns
+        cpu_duration = None
+        if self.cpu_start_ns is not None:
+            cpu_duration = self.cpu_duration_ns = profiler.cpu_clock() - \
+                self.cpu_start_ns
+
+        parent = self.parent_timing
+        if parent is not None:
+            parent.child_ns += duration
+            if cpu_duration is not None:
+                parent.child_cpu_ns += cpu_duration
+        lock.release()
+
+        self.exception = exception
+        profiler.head = parent
+        self.node.record(
+            duration,
+            self.child_ns,
+            cpu_duration,
+            self.child_cpu_ns,
+            exception,
+            self.yields,
+            self.sample_rate * profiler.sample_rate
+        )
+
+        return True
@@ -1,9 +1,38 @@
+import itertools
 import re
 import sys
-from clocked.profiler import Profiler
+from clocked import export, storage
+from clocked.snapshot import Snapshot
+from clocked.profiler import AggregateProfiler, Profiler
 from clocked.settings import Settings
 
 
+# the characters that make a name passed to Clocked.get a pattern
+_PATTERN_CHARACTERS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+
+class _Completed(object):
+    """
+    An awaitable that completes immediately with a value.
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        raise StopIteration(self.value)
+
+    next = __next__
+
+
 class Clocked(object):
     """
     An object to track timing information.
@@ -11,18 +40,184 @@ class Clocked(object):
     Based on MiniProfilerExtensions.cs
     """
 
+    # the percentiles shown by hotspot_report
+    PERCENTILES = (50, 95, 99, 99.9)
+
+    # counts the sessions initialized, to pick the ones that are sampled
+    _sessions = itertools.count()
+
+    # the patterns compiled by get, by pattern
+    _patterns = dict()
+    _MAX_PATTERNS = 256
+
     @classmethod
-    def initialize(cls, session_name):
+    def initialize(cls, session_name, sample_rate=1):
         """
         Initializes the underlying timer.
 
+        With a sample_rate of N only 1 in N sessions is profiled; the others
+        run without a profiler, so their steps are not timed at all and their
+        reports are empty. The reports of the sampled sessions scale their
+        counts and totals by N, as estimates for all sessions.
+
         :param str session_name: the name for this session
+        :param int sample_rate: only profile 1 in sample_rate sessions
+        """
+        if sample_rate < 1:
+            raise Exception('sample_rate must be at least 1')
+
+        Settings.ensure_profiler_provider()
+        if sample_rate != 1 and next(cls._sessions) % sample_rate:
+            Settings.profiler_provider.clear()
+            return
+
+        profiler = Settings.profiler_provider.start(session_name)
+        if sample_rate != 1:
+            profiler.sample_rate = sample_rate
+
+    @classmethod
+    def rotate(cls, reporter, session_name=None):
+        """
+        Swaps a fresh session in for the current one, and hands the current
+        one to a BackgroundReporter. Only freezing the session's clocks and
+        the swap happen on the caller's thread; closing the steps still
+        running (at the time the session was frozen), aggregating the
+        session and exporting it are left to the reporter's thread, so
+        rotating periodically (e.g. every few thousand requests, between
+        requests) adds no latency.
+
+        :param BackgroundReporter reporter: the reporter to hand the session
+         to
+        :param str session_name: the name of the fresh session, defaulting to
+         the current one's
+        :returns: the session handed to the reporter, if any
+        """
+        Settings.ensure_profiler_provider()
+        profiler = Settings.profiler_provider.get_current_profiler()
+        if profiler is None:
+            return None
+
+        if session_name is None:
+            session_name = profiler.name
+
+        # the cpu time of the steps still running can only be read here
+        profiler.freeze()
+        fresh = Settings.profiler_provider.start(session_name)
+        if profiler.sample_rate != 1:
+            fresh.sample_rate = profiler.sample_rate
+
+        reporter.submit(profiler)
+        return profiler
+
+    @classmethod
+    def save(cls, path):
+        """
+        Writes the current session to a file in a compact binary format, to
+        be loaded and reported on later with load.
+
+        :param str path: the file to write to
+        """
+        profiler = Profiler.current()
+        if profiler is None:
+            raise Exception('there is no session to save')
+
+        storage.save(profiler, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a session written by save and makes it the current session, so
+        that get and the reports work on it. Its timings are read from the
+        file as they are needed; no steps can be timed in a loaded session.
+
+        :param str path: the file to read
+        :rtype: StoredProfiler
+        """
+        profiler = storage.StoredProfiler(path)
+        cls.use(profiler)
+        return profiler
+
+    @classmethod
+    def snapshot(cls):
+        """
+        Takes a snapshot of the current session's calling context tree, which
+        pickles compactly to be sent to another process and merged there
+        with the snapshots of other sessions (see Snapshot.merge).
+
+        :rtype: Snapshot
+        """
+        profiler = Profiler.current()
+        if profiler is None:
+            raise Exception('there is no session to snapshot')
+
+        return Snapshot.take(profiler)
+
+    @classmethod
+    def use(cls, profiler):
+        """
+        Makes a loaded session or a (merged) snapshot the current session, so
+        that get and the reports work on it.
+
+        :param profiler: the session, e.g. a Snapshot
         """
         Settings.ensure_profiler_provider()
-        Settings.profiler_provider.start(session_name)
+        Settings.profiler_provider.set_current_profiler(profiler)
 
-    def __init__(self, name):
+    @classmethod
+    def export_chrome_trace(cls, path):
+        """
+        Writes the current session as Chrome Trace Event JSON, to be viewed
+        as a flame chart in chrome://tracing or Perfetto.
+
+        :param str path: the file to write to
+        """
+        profiler = Profiler.current()
+        if profiler is None:
+            raise Exception('there is no session to export')
+
+        with open(path, 'w') as f:
+            export.write_chrome_trace(profiler, f)
+
+    @classmethod
+    def export_speedscope(cls, path):
+        """
+        Writes the current session in the speedscope format, to be viewed as
+        a flame graph in speedscope.
+
+        :param str path: the file to write to
+        """
+        profiler = Profiler.current()
+        if profiler is None:
+            raise Exception('there is no session to export')
+
+        with open(path, 'w') as f:
+            export.write_speedscope(profiler, f)
+
+    @classmethod
+    def export_collapsed(cls, path):
+        """
+        Writes the current session as collapsed stacks weighted by self time
+        in microseconds, the input of flamegraph.pl and similar tools.
+
+        :param str path: the file to write to
+        """
+        profiler = Profiler.current()
+        if profiler is None:
+            raise Exception('there is no session to export')
+
+        with open(path, 'w') as f:
+            export.write_collapsed(profiler, f)
+
+    def __init__(self, name, min_save_ms=None):
+        """
+        :param str name: the name of the step
+        :param float min_save_ms: steps shorter than this many milliseconds
+         are left out of the hierarchy, though still counted in the
+         aggregates
+        """
         self._name = name
+        self._min_save_ms = min_save_ms
+        self._timing = None
         self.profiler = Profiler.current()
 
     def __enter__(self):
@@ -32,54 +227,150 @@ class Clocked(object):
         if self.profiler is None:
             return None
         else:
-            return self.profiler.step_impl(self._name)
+            self._timing = self.profiler.step_impl(
+                self._name,
+                self._min_save_ms
+            )
+            return self._timing
 
     # noinspection PyUnusedLocal
     def __exit__(self, _type, value, traceback):
         """
-        End profiling step timing.
+        End profiling step timing, recording the type of any exception raised
+        inside the `with` block.
 
         If there was an exception inside the `with` block, re-raise it.
         """
-        if self.profiler is not None:
-            self.profiler.head.stop()
+        if self._timing is not None:
+            self._timing.stop(_type)
 
         if _type:
             # re-raise any exceptions
             raise
 
+    def __aenter__(self):
+        """
+        Equivalent to Step, for use with `async with`.
+
+        Tasks that run concurrently only nest their steps independently when
+        the profiler provider keeps a head per task (ContextProfilerProvider).
+        """
+        return _Completed(self.__enter__())
+
+    # noinspection PyUnusedLocal
+    def __aexit__(self, _type, value, traceback):
+        """
+        End profiling step timing, recording the type of any exception raised
+        inside the `async with` block.
+        """
+        if self._timing is not None:
+            self._timing.stop(_type)
+
+        return _Completed(False)
+
     @classmethod
-    def get(cls, name):
+    def get(cls, name, exact=False):
         """
         Returns a generator for all timing information by name.
 
-        :param str name: the name to get
+        Plain names are looked up in the session's name index, and patterns
+        (regular expressions matching the whole name) are compiled once and
+        matched against each distinct name, rather than against every timing.
+
+        :param str name: the name, or pattern, to get
+        :param bool exact: whether to look the name up in the name index even
+         if it has pattern characters, e.g. the dots of the names of
+         decorated functions (module.function:line)
         """
         profiler = Profiler.current()
-        for timing in profiler.get_timing_hierarchy():
-            m = re.match('^' + name + '$', timing.name)
-            if m is None:
-                continue
+        if profiler is None:
+            return
+
+        if exact or _PATTERN_CHARACTERS.search(name) is None:
+            # a plain name, looked up in the profiler's name index
+            timings = profiler.get_timings(name)
+        else:
+            timings = profiler.find_timings(cls._compile(name))
 
+        for timing in timings:
             yield timing
 
     @classmethod
-    def verbose_report(cls, output_method=None):
+    def _compile(cls, name):
+        """
+        Compiles the pattern matching a whole step name, caching the
+        compiled patterns.
+
+        :param str name: the regular expression
+        """
+        pattern = cls._patterns.get(name)
+        if pattern is None:
+            if len(cls._patterns) >= cls._MAX_PATTERNS:
+                cls._patterns.clear()
+            pattern = cls._patterns[name] = re.compile('^' + name + '$')
+
+        return pattern
+
+    @classmethod
+    def verbose_report(cls, output_method=None, raw=False):
         """
         Prints a report of the timing information. This report is
         hierarchical with indentation being used to represent function nesting.
 
+        Repeated calls of a step under the same call path are merged into a
+        single line, carrying the total time along with the number of hits
+        and the min and max time per call:
+          name (total time, number of hits [min, max])
+
+        Lines scaled up from sampled calls or sessions are marked as
+        estimated.
+
         :param func output_method: a method that takes a string and manages
          where the output goes, defaulting to print
+        :param bool raw: print a line for every call instead; not available
+         for aggregate only sessions, which do not keep individual calls
         """
         if output_method is None:
             def p(x):
                 print(x)
             output_method = p
 
-        profiler = Profiler.current()
+        for line in cls.generate_verbose_report(raw):
+            output_method(line)
+
+    @classmethod
+    def generate_verbose_report(cls, raw=False, profiler=None):
+        """
+        Generates the lines of verbose_report one at a time, so that a large
+        report is never held in memory as a whole.
+
+        :param bool raw: generate a line for every call instead
+        :param profiler: the session to report on, defaulting to the current
+         one
+        :rtype: generator of str
+        """
+        if profiler is None:
+            profiler = Profiler.current()
+
+        header = 'All timing information:'
+
+        yield ''
+        yield header
+        yield '-' * len(header)
+
+        if profiler is None:
+            # not sampled
+            return
+
+        if not raw or isinstance(profiler, AggregateProfiler):
+            for line in cls._generate_verbose_report_merged(profiler):
+                yield line
+            return
+
+        timings = [(profiler.root, 0)]
+        while 0 < len(timings):
+            timing, depth = timings.pop()
 
-        def _print(timing, depth=0):
             if timing.duration_milliseconds is None:
                 dm = profiler.get_duration_milliseconds(
                     timing.start_milliseconds
@@ -87,93 +378,195 @@ class Clocked(object):
             else:
                 dm = timing.duration_milliseconds
 
-            output_method(depth * ' ' + '{} ({} ms)'.format(
+            if timing.exception is None:
+                line = '{} ({} ms)'
+            else:
+                line = '{} ({} ms, raised {})'
+
+            yield depth * ' ' + line.format(
                 timing.name,
-                round(dm, 1)
-            ))
+                round(dm, 1),
+                getattr(timing.exception, '__name__', None)
+            )
             if timing.has_children:
-                for child in timing.children:
-                    _print(child, depth + 1)
+                # reversed, so the children are popped in order
+                for child in reversed(timing.children):
+                    timings.append((child, depth + 1))
 
-        header = 'All timing information:'
+    @classmethod
+    def _generate_verbose_report_merged(cls, profiler):
+        paths = [(profiler.get_call_tree(), 0)]
+        while 0 < len(paths):
+            path, depth = paths.pop()
+
+            if path.hits == 0:
+                line = '{} (running'.format(path.name)
+            elif path.hits == 1:
+                line = '{} ({} ms'.format(
+                    path.name,
+                    round(path.duration_milliseconds, 1)
+                )
+            else:
+                line = '{} ({} ms, {} hits [{}, {}]'.format(
+                    path.name,
+                    round(path.duration_milliseconds, 1),
+                    path.hits,
+                    round(path.min_ns / 1000000.0, 1),
+                    round(path.max_ns / 1000000.0, 1)
+                )
 
-        output_method('')
-        output_method(header)
-        output_method('-' * len(header))
-        _print(profiler.root, 0)
+            if path.error_aggregates is not None:
+                line += ', raised ' + ', '.join(path.exception_names)
+            if path.estimated:
+                line += ', estimated'
+
+            yield depth * ' ' + line + ')'
+            if path.has_children:
+                # reversed, so the children are popped in order
+                for child in reversed(path.children):
+                    paths.append((child, depth + 1))
 
     @classmethod
-    def hotspot_report(cls, output_method=None, limit=None):
+    def hotspot_report(cls, output_method=None, limit=None, window=None):
         """
         Creates a hotspot report and sends it to a target output.
 
         The format of the output is:
-          name (total function time [min, max], number of hits)
+          name (total function time [min, max], number of hits, percentiles,
+          cpu time, off-cpu percentage)
 
         Where total function time is the aggregated total time of the function
         minus the aggregated total times of all functions beneath that are
-        being profiled.
+        being profiled. The percentiles (p50, p95, p99 and p99.9) are
+        estimated from a histogram of the function times. Cpu time is
+        aggregated the same way, and the off-cpu percentage is the share of
+        the total function time that was spent off the cpu (e.g. waiting on
+        I/O). Both are left out when cpu time was not captured. Generators
+        also report the number of items they produced and the average time
+        per item, and names scaled up from sampled calls or sessions are
+        marked as estimated.
 
         :param func output_method: a method that takes a string and manages
          where the output goes, defaulting to print
         :param int limit: used to limit the output to the top n culprits
+        :param float window: only report the last window seconds, when
+         Settings.rolling_window_seconds is set
         """
         if output_method is None:
             def p(x):
                 print(x)
             output_method = p
 
-        header = 'Hotspots:'
+        for line in cls.generate_hotspot_report(limit, window):
+            output_method(line)
 
-        output_method('')
-        output_method(header)
-        output_method('-' * len(header))
+    @classmethod
+    def generate_hotspot_report(cls, limit=None, window=None, profiler=None):
+        """
+        Generates the lines of hotspot_report one at a time.
+
+        :param int limit: used to limit the output to the top n culprits
+        :param float window: only report the last window seconds
+        :param profiler: the session to report on, defaulting to the current
+         one
+        :rtype: generator of str
+        """
+        header = 'Hotspots:'
 
-        for name, ms, min_ms, max_ms, hits in cls.generate_hotspots(limit):
-            output_method(
-                '{} ({} ms [{}, {}], {} hits)'.format(
-                    name, ms, min_ms, max_ms, hits
+        yield ''
+        yield header
+        yield '-' * len(header)
+
+        aggregates = cls.generate_aggregates(limit, window, profiler)
+        for name, aggregate in aggregates:
+            line = '{} ({} ms [{}, {}], {} hits, {}'.format(
+                name,
+                round(aggregate.total_ms, 1),
+                round(aggregate.min_ms, 1),
+                round(aggregate.max_ms, 1),
+                aggregate.hits,
+                ', '.join(
+                    'p{} {} ms'.format(
+                        percentile,
+                        round(aggregate.percentile_ms(percentile), 1)
+                    )
+                    for percentile in cls.PERCENTILES
                 )
             )
+            if aggregate.cpu_ms is not None:
+                line += ', {} ms cpu, {}% off-cpu'.format(
+                    round(aggregate.cpu_ms, 1),
+                    round(aggregate.off_cpu_percent, 1)
+                )
+            if aggregate.yields:
+                line += ', {} yields, {} ms per yield'.format(
+                    aggregate.yields,
+                    round(aggregate.ms_per_yield, 3)
+                )
+            if aggregate.estimated:
+                line += ', estimated'
+
+            yield line + ')'
 
     @classmethod
-    def generate_hotspots(cls, limit=None):
+    def generate_hotspots(cls, limit=None, window=None):
         """
         Generates hotspots in decreasing order of badness.
 
         :param int limit: used to limit the results to the top n culprits
+        :param float window: only aggregate the last window seconds
         :returns: generator for top hotspots
         :rtype: generator of (name, total ms, min ms, max ms, number of hits)
         """
-        aggregates = dict()
+        for name, aggregate in cls.generate_aggregates(limit, window):
+            yield (
+                name,
+                aggregate.total_ms,
+                aggregate.min_ms,
+                aggregate.max_ms,
+                aggregate.hits
+            )
 
-        def _agg(timing, depth=0):
-            dm = max(timing.duration_without_children_milliseconds(), 0.0)
+    @classmethod
+    def generate_aggregates(cls, limit=None, window=None, profiler=None):
+        """
+        Generates the aggregated timing information for each name in
+        decreasing order of badness.
 
-            if timing.name not in aggregates:
-                aggregates[timing.name] = (0.0, sys.maxint, 0.0, 0)
+        Timings that exited with an exception are aggregated separately, under
+        their name followed by the exception, e.g. "name [raised ValueError]".
 
-            tup = aggregates[timing.name]
-            aggregates[timing.name] = (
-                tup[0] + dm,
-                min(tup[1], dm),
-                max(tup[2], dm),
-                tup[3] + 1
-            )
-            if timing.has_children:
-                for child in timing.children:
-                    _agg(child, depth + 1)
-
-        profiler = Profiler.current()
+        With a window, only the steps that stopped during the last window
+        seconds are aggregated, from the session's rolling window (see
+        Settings.rolling_window_seconds).
 
-        _agg(profiler.root, 0)
+        :param int limit: used to limit the results to the top n culprits
+        :param float window: only aggregate the last window seconds
+        :param profiler: the session to aggregate, defaulting to the current
+         one
+        :returns: generator for top hotspots
+        :rtype: generator of (name, Aggregate)
+        """
+        if profiler is None:
+            profiler = Profiler.current()
+        if profiler is None:
+            return
+
+        if window is None:
+            aggregates = profiler.get_aggregates()
+        elif hasattr(profiler, 'get_window_aggregates'):
+            aggregates = profiler.get_window_aggregates(window)
+        else:
+            raise Exception(
+                'windows need Settings.rolling_window_seconds to be set'
+            )
 
-        tups = [i for i in aggregates.iteritems()]
-        tups.sort(key=lambda x: x[1][0], reverse=True)
+        tups = [i for i in aggregates.items()]
+        tups.sort(key=lambda x: x[1].total_ms, reverse=True)
 
-        maxi = limit if limit is not None else sys.maxint
+        maxi = limit if limit is not None else sys.maxsize
         for idx, tup in enumerate(tups):
             if idx >= maxi:
                 break
 
-            yield tup[0], tup[1][0], tup[1][1], tup[1][2], tup[1][3]
+            yield tup
@@ -2,21 +2,74 @@
 
 
 import inspect
-import new
-from clocked.profiler_provider import ProfilerProvider
+import itertools
+import logging
+import sys
+import types
+import weakref
+from clocked import names
+from clocked.profiler import Profiler
+from clocked.settings import Settings
+from clocked.suspendable import TimedGenerator
 
+try:
+    from clocked import aio
+except SyntaxError:
+    # python 2, no async support
+    aio = None
 
-def _create_function_wrapper(obj, name):
-    def wrapper(*args, **kwargs):
-        profiler = ProfilerProvider.get_current_profiler()
-        if profiler is None:
-            return obj(*args, **kwargs)
-        else:
-            profiler.step_impl(name)
-            ret = obj(*args, **kwargs)
-            profiler.head.stop()
-            return ret
 
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# functions decorated while clocked was disabled, mapped to their step name
+# id, original code, swapped-in code (None while disabled) and options
+_disabled = weakref.WeakKeyDictionary()
+
+# the constant standing for the timed wrapper in a compiled trampoline, which
+# is replaced by the wrapper itself, so the trampoline needs no globals
+_WRAPPER = '<clocked wrapper>'
+
+_TRAMPOLINE_SOURCE = """
+def factory():
+{assign}
+    {kind}def trampoline(*_clocked_args, **_clocked_kwargs):
+{reference}
+        _clocked_wrapper = {wrapper!r}
+{body}
+    return trampoline
+"""
+
+# the trampoline's body, calling the timed wrapper the same way the kind of
+# function it replaces is called, by kind
+_CALL = '_clocked_wrapper(*_clocked_args, **_clocked_kwargs)'
+_TRAMPOLINE_BODIES = {
+    'function': '        return {}'.format(_CALL),
+    'coroutine': '        return await {}'.format(_CALL),
+    'async generator': (
+        '        async for _clocked_item in {}:\n'
+        '            yield _clocked_item'.format(_CALL)
+    )
+}
+if sys.version_info < (3, 3):
+    # no yield from, so values sent in are not passed on
+    _TRAMPOLINE_BODIES['generator'] = (
+        '        for _clocked_item in {}:\n'
+        '            yield _clocked_item'.format(_CALL)
+    )
+else:
+    _TRAMPOLINE_BODIES['generator'] = \
+        '        return (yield from {})'.format(_CALL)
+
+
+def _copy_metadata(wrapper, obj):
+    """
+    Gives a wrapper the module, name, docstring and attributes of the
+    function it wraps.
+
+    :param func wrapper: the wrapper
+    :param func obj: the wrapped function
+    """
     wrapper.__module__ = obj.__module__
     wrapper.__name__ = obj.__name__
     wrapper.__doc__ = obj.__doc__
@@ -24,77 +77,408 @@ def _create_function_wrapper(obj, name):
     return wrapper
 
 
-def _create_method_wrapper(obj, name):
-    if obj.im_self is not None:
-        def wrapper(*args, **kwargs):
-            profiler = ProfilerProvider.get_current_profiler()
-            if profiler is None:
-                return obj.__func__(*args, **kwargs)
-            else:
-                profiler.step_impl(name)
-                ret = obj.__func__(*args, **kwargs)
-                profiler.head.stop()
-                return ret
-
-        wrapper.__module__ = obj.__func__.__module__
-        wrapper.__name__ = obj.__func__.__name__
-        wrapper.__doc__ = obj.__func__.__doc__
-        wrapper.__dict__.update(getattr(obj.__func__, '__dict__', {}))
-        wrapper = new.instancemethod(wrapper, obj.im_self)
+def _create_function_wrapper(obj, name, sample_rate=1, min_save_ms=None):
+    calls = itertools.count()
+
+    def wrapper(*args, **kwargs):
+        # calls that are not sampled only pay for counting
+        if sample_rate != 1 and next(calls) % sample_rate:
+            return obj(*args, **kwargs)
+
+        profiler = Profiler.current()
+        if profiler is None:
+            return obj(*args, **kwargs)
+        else:
+            timing = profiler.step_impl(
+                name,
+                min_save_ms,
+                sample_rate=sample_rate
+            )
+            try:
+                ret = obj(*args, **kwargs)
+            except BaseException:
+                timing.stop(sys.exc_info()[0])
+                raise
+            timing.stop()
+            return ret
+
+    return _copy_metadata(wrapper, obj)
+
+
+def _create_generator_wrapper(obj, name, sample_rate=1):
+    calls = itertools.count()
+
+    def wrapper(*args, **kwargs):
+        if sample_rate != 1 and next(calls) % sample_rate:
+            return obj(*args, **kwargs)
+
+        profiler = Profiler.current()
+        if profiler is None:
+            return obj(*args, **kwargs)
+        else:
+            # the time the consumer spends between items is never counted
+            return TimedGenerator(
+                profiler.suspendable_step(
+                    name,
+                    exclude_suspended=True,
+                    sample_rate=sample_rate
+                ),
+                obj(*args, **kwargs)
+            )
+
+    return _copy_metadata(wrapper, obj)
+
+
+def _create_wrapper(obj, name, exclude_suspended=False, sample_rate=1,
+                    min_save_ms=None):
+    """
+    Wraps a function so that its calls are timed, picking the wrapper that
+    matches the kind of function.
+
+    :param func obj: the function to wrap
+    :param int name: the id of the step name
+    :param bool exclude_suspended: for coroutine functions and async
+     generators, whether to leave out the time spent suspended
+    :param int sample_rate: only time 1 in sample_rate calls
+    :param float min_save_ms: for plain functions, leave the calls shorter
+     than this many milliseconds out of the hierarchy
+    """
+    if inspect.isgeneratorfunction(obj):
+        return _create_generator_wrapper(obj, name, sample_rate)
+
+    if aio is not None:
+        if inspect.iscoroutinefunction(obj):
+            wrapper = aio.create_coroutine_wrapper(
+                obj,
+                name,
+                exclude_suspended,
+                sample_rate
+            )
+        elif inspect.isasyncgenfunction(obj):
+            wrapper = aio.create_async_generator_wrapper(
+                obj,
+                name,
+                exclude_suspended,
+                sample_rate
+            )
+        else:
+            wrapper = None
+
+        if wrapper is not None:
+            return _copy_metadata(wrapper, obj)
+
+    return _create_function_wrapper(obj, name, sample_rate, min_save_ms)
+
+
+def _get_raw_attribute(cls, name):
+    """
+    Gets an attribute as it was declared on the class (or its bases), before
+    staticmethod/classmethod descriptors are applied.
+
+    :param type cls: the class to look in
+    :param str name: the attribute's name
+    """
+    for klass in inspect.getmro(cls):
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+
+    return None
+
+
+def _get_step_id(obj):
+    """
+    Gets the id of the step name for a decorated function, registering the
+    name once when decorating rather than on every call.
+
+    :param func obj: the decorated function
+    """
+    return names.get_id('{}.{}:{}'.format(
+        obj.__module__,
+        obj.__name__,
+        obj.__code__.co_firstlineno
+    ))
+
+
+def _get_class_members(cls):
+    """
+    Gets the functions declared on a class (directly or through staticmethod
+    and classmethod) as (attribute name, raw attribute, function, step name
+    id).
+
+    :param type cls: the class to look in
+    """
+    for name, _ in inspect.getmembers(cls):
+        raw = _get_raw_attribute(cls, name)
+        if isinstance(raw, (staticmethod, classmethod)):
+            method = raw.__func__
+        elif inspect.isfunction(raw):
+            method = raw
+        else:
+            continue
+
+        yield name, raw, method, names.get_id('{}.{}.{}:{}'.format(
+            cls.__module__,
+            cls.__name__,
+            method.__name__,
+            method.__code__.co_firstlineno
+        ))
+
+
+def _get_kind(function):
+    """
+    Gets the kind of a function, which its trampoline must be of too for
+    inspect (e.g. inspect.iscoroutinefunction) to tell the same.
+
+    :param func function: the function
+    """
+    if inspect.isgeneratorfunction(function):
+        return 'generator'
+
+    if aio is not None:
+        if inspect.iscoroutinefunction(function):
+            return 'coroutine'
+        if inspect.isasyncgenfunction(function):
+            return 'async generator'
+
+    return 'function'
+
+
+def _replace_constant(code, old, new):
+    """
+    Copies a code object, replacing one of its constants.
+
+    :param code: the code object
+    :param old: the constant to replace
+    :param new: the object to replace it with
+    """
+    consts = tuple(new if i == old else i for i in code.co_consts)
+    if hasattr(code, 'replace'):
+        return code.replace(co_consts=consts)
+
+    args = [code.co_argcount]
+    if hasattr(code, 'co_kwonlyargcount'):
+        args.append(code.co_kwonlyargcount)
+    args.extend([
+        code.co_nlocals,
+        code.co_stacksize,
+        code.co_flags,
+        code.co_code,
+        consts,
+        code.co_names,
+        code.co_varnames,
+        code.co_filename,
+        code.co_name,
+        code.co_firstlineno,
+        code.co_lnotab,
+        code.co_freevars,
+        code.co_cellvars
+    ])
+    return types.CodeType(*args)
+
+
+def _compile_trampoline(freevars, kind, wrapper):
+    """
+    Compiles the code of a function of the given kind that forwards its
+    calls to a timed wrapper, with the same free variables as the function
+    it will replace so that it can be swapped in. The wrapper is held as a
+    constant of the code, rather than looked up in the function's globals.
+
+    :param tuple freevars: the names of the replaced code's free variables
+    :param str kind: the kind of the replaced function (see _get_kind)
+    :param func wrapper: the timed wrapper
+    """
+    if freevars:
+        assign = '    {} = None'.format(' = '.join(freevars))
+        reference = '        {}'.format(', '.join(freevars))
     else:
-        def wrapper(*args, **kwargs):
-            profiler = ProfilerProvider.get_current_profiler()
-            if profiler is None:
-                return obj.__func__(*args, **kwargs)
-            else:
-                profiler.step_impl(name)
-                ret = obj.__func__(*args, **kwargs)
-                profiler.head.stop()
-                return ret
-
-        wrapper.__module__ = obj.__func__.__module__
-        wrapper.__name__ = obj.__func__.__name__
-        wrapper.__doc__ = obj.__func__.__doc__
-        wrapper.__dict__.update(getattr(obj.__func__, '__dict__', {}))
+        assign = '    pass'
+        reference = ''
 
-    return wrapper
+    namespace = dict()
+    exec(compile(
+        _TRAMPOLINE_SOURCE.format(
+            assign=assign,
+            kind='' if kind in ('function', 'generator') else 'async ',
+            reference=reference,
+            wrapper=_WRAPPER,
+            body=_TRAMPOLINE_BODIES[kind]
+        ),
+        '<clocked>',
+        'exec'
+    ), namespace)
+    return _replace_constant(
+        namespace['factory']().__code__,
+        _WRAPPER,
+        wrapper
+    )
+
+
+def enable():
+    """
+    Re-enables timing at runtime for every function decorated while clocked
+    was disabled, by swapping in code that forwards to a timed copy of the
+    function. The functions whose code cannot be swapped, e.g. as a free
+    variable clashes with the trampoline's own names, are left untimed with
+    a warning.
+    """
+    for function, entry in list(_disabled.items()):
+        name, code, swapped, exclude_suspended, sample_rate, \
+            min_save_ms = entry
+        if swapped is not None:
+            # already enabled
+            continue
+
+        original = types.FunctionType(
+            code,
+            function.__globals__,
+            function.__name__,
+            function.__defaults__,
+            function.__closure__
+        )
+        if hasattr(function, '__kwdefaults__'):
+            original.__kwdefaults__ = function.__kwdefaults__
+
+        trampoline = _compile_trampoline(
+            code.co_freevars,
+            _get_kind(function),
+            _create_wrapper(
+                original,
+                name,
+                exclude_suspended,
+                sample_rate,
+                min_save_ms
+            )
+        )
+        if trampoline.co_freevars != code.co_freevars:
+            logger.warning(
+                'cannot time %s, as its free variables %s clash with '
+                'clocked\'s own names',
+                names.get_name(name),
+                ', '.join(code.co_freevars)
+            )
+            continue
+
+        function.__code__ = trampoline
+        entry[2] = trampoline
+
+
+def disable():
+    """
+    Restores the original code of every function decorated while clocked was
+    disabled, undoing enable.
+    """
+    for function, entry in list(_disabled.items()):
+        if entry[2] is None:
+            continue
+
+        function.__code__ = entry[1]
+        entry[2] = None
 
 
-def clocked(obj):
+def clocked(obj=None, exclude_suspended=False, sample_rate=1,
+            min_save_ms=None):
     """
     Clocked decorator. Put this on a class or and individual function for it's
     timing information to be tracked.
+
+    Generators are timed across all of their resumptions as a single step,
+    leaving out the time spent between items, and count the items produced.
+
+    Coroutine functions and async generators are timed from their first
+    resumption until they complete, and can be passed options by decorating
+    with @clocked(exclude_suspended=True) to leave out the time spent
+    awaiting.
+
+    Hot functions can be sampled with @clocked(sample_rate=N), timing only 1
+    in N calls; the other calls skip the profiler and only pay for counting.
+    Reports scale the sampled calls back up and mark them as estimates.
+
+    Functions called many times can be kept out of the hierarchy with
+    @clocked(min_save_ms=N), dropping the calls shorter than N milliseconds
+    once they stop; their time still counts in the aggregates. This does not
+    apply to generators, coroutine functions and async generators.
+
+    When Settings.enabled is off at decoration time, the class or function is
+    returned unchanged so that it costs nothing to call. Timing can be turned
+    on later with Settings.enable(), for the methods a class defines itself;
+    the methods it inherits are timed as their own class's, if it was
+    decorated too.
+
+    :param bool exclude_suspended: whether to leave out the time coroutines
+     and async generators spend suspended
+    :param int sample_rate: only time 1 in sample_rate calls of each function
+    :param float min_save_ms: leave the calls of functions shorter than this
+     many milliseconds out of the hierarchy
     """
+    if obj is None:
+        def decorator(_obj):
+            return clocked(
+                _obj,
+                exclude_suspended=exclude_suspended,
+                sample_rate=sample_rate,
+                min_save_ms=min_save_ms
+            )
+        return decorator
+
+    if sample_rate < 1:
+        raise Exception('sample_rate must be at least 1')
 
     _is_class = inspect.isclass(obj)
     _is_func = inspect.isfunction(obj)
     if not _is_class and not _is_func:
         raise Exception('unsupported type {}'.format(type(obj)))
 
+    if not Settings.enabled:
+        if _is_func:
+            _disabled[obj] = [
+                _get_step_id(obj),
+                obj.__code__,
+                None,
+                exclude_suspended,
+                sample_rate,
+                min_save_ms
+            ]
+        else:
+            for name, _, method, step_id in _get_class_members(obj):
+                if name not in vars(obj):
+                    # inherited, so the function is shared with the base
+                    # class, whose code enable would swap under this
+                    # class's name
+                    continue
+
+                _disabled[method] = [
+                    step_id,
+                    method.__code__,
+                    None,
+                    exclude_suspended,
+                    sample_rate,
+                    min_save_ms
+                ]
+
+        return obj
+
     if _is_func:
-        return _create_function_wrapper(obj, '{}.{}:{}'.format(
-            obj.__module__,
-            obj.__name__,
-            obj.func_code.co_firstlineno
-        ))
+        return _create_wrapper(
+            obj,
+            _get_step_id(obj),
+            exclude_suspended,
+            sample_rate,
+            min_save_ms
+        )
     elif _is_class:
-        for name, method in inspect.getmembers(obj):
-            if inspect.isfunction(method):
-                wrapper = _create_function_wrapper(method, '{}.{}.{}:{}'.format(
-                    obj.__module__,
-                    obj.__name__,
-                    method.__name__,
-                    method.func_code.co_firstlineno
-                ))
-                staticmethod(wrapper)
-                setattr(obj, name, staticmethod(wrapper))
-            elif inspect.ismethod(method):
-                wrapper = _create_method_wrapper(method, '{}.{}.{}:{}'.format(
-                    obj.__module__,
-                    obj.__name__,
-                    method.__func__.__name__,
-                    method.func_code.co_firstlineno
-                ))
-                setattr(obj, name, wrapper)
+        for name, raw, method, step_id in _get_class_members(obj):
+            wrapper = _create_wrapper(
+                method,
+                step_id,
+                exclude_suspended,
+                sample_rate,
+                min_save_ms
+            )
+            if isinstance(raw, staticmethod):
+                wrapper = staticmethod(wrapper)
+            elif isinstance(raw, classmethod):
+                wrapper = classmethod(wrapper)
+
+            setattr(obj, name, wrapper)
 
     return obj
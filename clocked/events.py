@@ -0,0 +1,351 @@
+"""
+Recording of steps as compact events in per-thread buffers, from which the
+Timing hierarchy is rebuilt only when it is needed.
+"""
+
+
+import struct
+from array import array
+from clocked import names
+from clocked.stopwatch import frozen_clock
+from clocked.suspendable import SuspendableStep
+from clocked.timing import Timing
+
+
+# the kinds of events, kept in the low bits of each record's first value with
+# the sample rate of the step in the bits above
+ENTER = 0
+EXIT = 1
+RESUME = 2
+SUSPEND = 3
+FINISH = 4
+
+_KIND_BITS = 3
+_KIND_MASK = (1 << _KIND_BITS) - 1
+
+# the number of values in each record
+RECORD_SIZE = 4
+
+try:
+    array('q')
+    _TYPECODE = 'q'
+except ValueError:
+    # python 2, where long is the widest
+    _TYPECODE = 'l'
+
+# packs a record the way the buffers' arrays hold it; appending the bytes is
+# cheaper than extending an array with a tuple, which goes through a
+# generic iterator
+_pack = struct.Struct(_TYPECODE * RECORD_SIZE).pack
+
+
+class EventBuffer(object):
+    """
+    The events recorded by a single thread, as records of four integers: the
+    kind of event (and sample rate), its argument (a name id, an exception id
+    or the key of a suspendable step), the session's elapsed nanoseconds and
+    the thread's cpu nanoseconds (-1 when not captured).
+
+    Only its own thread appends to a buffer, so recording takes no lock. The
+    buffer keeps the session's clocks and its array's append bound, so that
+    recording an event takes no attribute chains. The
+    buffer also stands in for the Timing of the steps it records, so a step
+    is stopped by stopping the buffer, which closes the step entered last on
+    the thread. This assumes steps exit in the reverse order they entered on
+    a given thread, which asyncio tasks interleaving on the thread break, so
+    event recording is not available with a ContextProfilerProvider.
+    """
+
+    __slots__ = ('profiler', 'thread_name', 'records', 'depth', 'write',
+                 'clock', 'start_ns', 'cpu_clock')
+
+    def __init__(self, profiler, thread_name):
+        """
+        :param EventProfiler profiler: the profiler recording the events
+        :param str thread_name: the name of the thread recording the events
+        """
+        self.profiler = profiler
+        self.thread_name = thread_name
+        self.records = array(_TYPECODE)
+        # appends packed records; python 2 arrays only have fromstring
+        self.write = getattr(self.records, 'frombytes', None) or \
+            self.records.fromstring
+        self.depth = 0
+
+        sw = profiler.sw
+        self.start_ns = sw.start_time
+        if sw.stop_time is None:
+            self.clock = sw.clock
+        else:
+            self.clock = frozen_clock(sw.stop_time)
+        self.cpu_clock = profiler.cpu_clock
+
+    def freeze(self):
+        """
+        Stamps the events recorded from now on with the time the session was
+        frozen at.
+        """
+        self.clock = frozen_clock(self.profiler.sw.stop_time)
+
+    def record(self, kind, argument, sample_rate=1):
+        """
+        Appends an event, stamped with the current wall and cpu time.
+
+        :param int kind: the kind of event
+        :param int argument: the name id, exception id or step key
+        :param int sample_rate: the number of calls the step stands for
+        """
+        cpu_clock = self.cpu_clock
+        self.write(_pack(
+            (sample_rate << _KIND_BITS) | kind,
+            argument,
+            self.clock() - self.start_ns,
+            -1 if cpu_clock is None else cpu_clock()
+        ))
+
+    def stop(self, exception=None):
+        """
+        Records the exit of the step entered last on this thread.
+
+        :param type exception: the type of the exception the step exited
+         with, if any
+        """
+        if self.depth == 0:
+            return
+
+        self.depth -= 1
+        cpu_clock = self.cpu_clock
+        self.write(_pack(
+            EXIT,
+            0 if exception is None else self.profiler.get_exception_id(
+                exception
+            ),
+            self.clock() - self.start_ns,
+            -1 if cpu_clock is None else cpu_clock()
+        ))
+
+
+class EventSuspendableStep(SuspendableStep):
+    """
+    A SuspendableStep recorded as events: each resumption is recorded as a
+    RESUME and SUSPEND (or FINISH) pair in the buffer of the thread running
+    it, and the resumptions sharing the step's key are merged back into a
+    single Timing when the hierarchy is rebuilt.
+    """
+
+    __slots__ = ('key', 'started', 'stopped', 'exception', 'yields')
+
+    def __init__(self, profiler, name, exclude_suspended=False,
+                 sample_rate=1):
+        super(EventSuspendableStep, self).__init__(
+            profiler,
+            name,
+            exclude_suspended,
+            sample_rate
+        )
+        self.key = None
+        self.started = False
+        self.stopped = False
+        self.exception = None
+        self.yields = None
+
+    @property
+    def is_started(self):
+        """
+        Gets a value indicating whether this step was resumed at least once.
+        """
+        return self.started
+
+    @property
+    def is_stopped(self):
+        """
+        Gets a value indicating whether this step has completed.
+        """
+        return self.stopped
+
+    def count_yield(self):
+        """
+        Counts an item produced by this step.
+        """
+        if self.yields is None:
+            self.yields = 1
+        else:
+            self.yields += 1
+
+    def resume(self):
+        """
+        Records a resumption of this step.
+
+        :returns: the buffer the resumption was recorded in
+        """
+        profiler = self.profiler
+        if self.key is None:
+            self.key = profiler.register_step(self)
+            self.started = True
+
+        buffer = profiler.get_buffer()
+        buffer.record(RESUME, self.key, self.sample_rate)
+        return buffer
+
+    def suspend(self, saved):
+        """
+        Records the suspension of this step.
+
+        :param EventBuffer saved: the buffer returned by resume
+        """
+        saved.record(SUSPEND, self.key)
+
+    def stop(self, saved, exception=None):
+        """
+        Records the completion of this step.
+
+        :param EventBuffer saved: the buffer returned by resume
+        :param type exception: the type of the exception the step exited
+         with, if any
+        """
+        self.exception = exception
+        self.stopped = True
+        saved.record(FINISH, self.key)
+
+
+def _create_timing(profiler, parent, name, start_ns, cpu_start_ns,
+                   sample_rate):
+    """
+    Creates a Timing for a recorded step, without touching the profiler's
+    head or clocks.
+    """
+    timing = Timing.__new__(Timing)
+    timing.id = next(profiler.timing_ids)
+    timing.profiler = profiler
+    timing.parent_timing = None
+    timing.name_id = names.to_id(name)
+    timing.min_save_ms = None
+    timing.include_children_with_min_save = False
+    timing.children = None
+    timing.custom_timings = None
+    timing.duration_ns = None
+    timing.cpu_duration_ns = None
+    timing.exception = None
+    timing.yields = None
+    timing.sample_rate = sample_rate
+    timing.child_ns = 0
+    timing.child_cpu_ns = 0
+    timing.pruned = None
+    timing.start_ns = start_ns
+    timing.cpu_start_ns = None if cpu_start_ns < 0 else cpu_start_ns
+
+    profiler.name_index.setdefault(timing.name_id, []).append(timing)
+
+    parent.add_child(timing)
+    return timing
+
+
+def _add_to_parent(timing):
+    """
+    Adds the time of a recorded step that stopped to its parent's children's
+    time, the way Timing.stop does.
+    """
+    parent = timing.parent_timing
+    parent.child_ns += timing.duration_ns
+    if timing.cpu_duration_ns is not None:
+        parent.child_cpu_ns += timing.cpu_duration_ns
+
+
+def rebuild_timings(profiler, root, buffers):
+    """
+    Rebuilds the Timing hierarchy under root from the recorded events. Steps
+    that have not exited yet are left running. The steps at the top of each
+    thread are kept in profiler.tracks, by thread name.
+
+    :param EventProfiler profiler: the profiler the events were recorded by
+    :param Timing root: the session's root timing
+    :param list buffers: the EventBuffer of each thread
+    """
+    root.children = None
+    profiler.name_index = {root.name_id: [root]}
+    exceptions = profiler.exception_types
+    steps = profiler.steps
+    tracks = []
+
+    # the timing and running totals of each suspendable step, by key:
+    # [timing, resumed ns, resumed cpu ns, ns, cpu ns]
+    resumed = dict()
+
+    for buffer in buffers:
+        records = buffer.records
+        stack = [root]
+        top = []
+        tracks.append((buffer.thread_name, top))
+
+        for i in range(0, len(records), RECORD_SIZE):
+            code = records[i]
+            kind = code & _KIND_MASK
+            argument = records[i + 1]
+            ns = records[i + 2]
+            cpu_ns = records[i + 3]
+
+            if kind == ENTER:
+                timing = _create_timing(
+                    profiler,
+                    stack[-1],
+                    argument,
+                    ns,
+                    cpu_ns,
+                    code >> _KIND_BITS
+                )
+                if len(stack) == 1:
+                    top.append(timing)
+                stack.append(timing)
+            elif kind == EXIT:
+                if len(stack) == 1:
+                    continue
+
+                timing = stack.pop()
+                timing.duration_ns = ns - timing.start_ns
+                if timing.cpu_start_ns is not None:
+                    timing.cpu_duration_ns = cpu_ns - timing.cpu_start_ns
+                if argument != 0:
+                    timing.exception = exceptions[argument - 1]
+                _add_to_parent(timing)
+            elif kind == RESUME:
+                state = resumed.get(argument)
+                if state is None:
+                    timing = _create_timing(
+                        profiler,
+                        stack[-1],
+                        steps[argument].name,
+                        ns,
+                        cpu_ns,
+                        code >> _KIND_BITS
+                    )
+                    state = resumed[argument] = [timing, ns, cpu_ns, 0, 0]
+                    if len(stack) == 1:
+                        top.append(timing)
+                else:
+                    state[1] = ns
+                    state[2] = cpu_ns
+
+                stack.append(state[0])
+            else:
+                state = resumed[argument]
+                timing = state[0]
+                if stack[-1] is timing:
+                    stack.pop()
+
+                state[3] += ns - state[1]
+                state[4] += cpu_ns - state[2]
+                if kind == SUSPEND:
+                    continue
+
+                step = steps[argument]
+                if step.exclude_suspended:
+                    timing.duration_ns = state[3]
+                else:
+                    timing.duration_ns = ns - timing.start_ns
+                if timing.cpu_start_ns is not None:
+                    timing.cpu_duration_ns = state[4]
+                timing.exception = step.exception
+                timing.yields = step.yields
+                _add_to_parent(timing)
+
+    profiler.tracks = tracks
@@ -0,0 +1,250 @@
+"""
+Exporters writing a session's timings for flame graph viewers: the Chrome
+Trace Event format (chrome://tracing, Perfetto), the speedscope format and
+collapsed stacks (flamegraph.pl).
+
+They stream the hierarchy to a file as it is walked, so the memory they use
+grows with the depth of the hierarchy and the number of distinct names, not
+with the number of timings.
+"""
+
+
+import json
+from clocked import names
+
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+def _walk(timings):
+    """
+    Walks the hierarchies under some timings without recursing, keeping only
+    an iterator per level.
+
+    :param list timings: the timings at the top
+    :returns: (True, timing) when entering a timing, and (False, timing) when
+     leaving it after its children
+    """
+    iterators = [iter(timings)]
+    path = []
+
+    while 0 < len(iterators):
+        timing = next(iterators[-1], None)
+        if timing is None:
+            iterators.pop()
+            if 0 < len(path):
+                yield False, path.pop()
+            continue
+
+        yield True, timing
+        path.append(timing)
+        iterators.append(iter(timing.children or ()))
+
+
+def _end_ns(timing, now_ns):
+    """
+    Gets when a timing ended, or now for the timings still running.
+    """
+    if timing.duration_ns is None:
+        return now_ns
+
+    return timing.start_ns + timing.duration_ns
+
+
+class _Names(object):
+    """
+    Encodes each step name as a JSON string once.
+    """
+
+    __slots__ = ('encoded',)
+
+    def __init__(self):
+        self.encoded = dict()
+
+    def get(self, timing):
+        """
+        Gets the JSON string of a timing's name.
+
+        :param Timing timing: the timing
+        """
+        name_id = timing.name_id
+        encoded = self.encoded.get(name_id)
+        if encoded is None:
+            encoded = self.encoded[name_id] = json.dumps(timing.name)
+
+        return encoded
+
+
+def write_chrome_trace(profiler, f):
+    """
+    Writes a session as Chrome Trace Event JSON: a complete event per
+    timing, on a track per thread when the session tells its threads apart.
+
+    :param Profiler profiler: the session to write
+    :param f: the text file to write to
+    """
+    tracks = profiler.get_tracks()
+    now_ns = profiler.elapsed_nanoseconds
+    encoded = _Names()
+
+    f.write('{"traceEvents":[\n')
+    f.write(
+        '{{"name":"process_name","ph":"M","pid":1,"tid":0,'
+        '"args":{{"name":{}}}}}'.format(json.dumps(profiler.root.name))
+    )
+
+    for tid, (track, timings) in enumerate(tracks, 1):
+        f.write(
+            ',\n{{"name":"thread_name","ph":"M","pid":1,"tid":{},'
+            '"args":{{"name":{}}}}}'.format(tid, json.dumps(track))
+        )
+
+        for entering, timing in _walk(timings):
+            if not entering:
+                continue
+
+            if timing.exception is None:
+                args = ''
+            else:
+                args = ',"args":{{"raised":{}}}'.format(
+                    json.dumps(timing.exception.__name__)
+                )
+
+            f.write(
+                ',\n{{"name":{},"cat":"clocked","ph":"X","ts":{},"dur":{},'
+                '"pid":1,"tid":{}{}}}'.format(
+                    encoded.get(timing),
+                    timing.start_ns / 1000.0,
+                    (_end_ns(timing, now_ns) - timing.start_ns) / 1000.0,
+                    tid,
+                    args
+                )
+            )
+
+    f.write('\n],"displayTimeUnit":"ms"}\n')
+
+
+def write_speedscope(profiler, f):
+    """
+    Writes a session in the speedscope format: an evented profile per
+    thread when the session tells its threads apart.
+
+    Speedscope needs the steps of a profile to nest strictly, so steps that
+    overlap their siblings or outlast their parent (e.g. concurrent tasks
+    sharing a parent) are clipped.
+
+    :param Profiler profiler: the session to write
+    :param f: the text file to write to
+    """
+    tracks = profiler.get_tracks()
+    now_ns = profiler.elapsed_nanoseconds
+    frames = dict()
+
+    f.write(
+        '{{"$schema":{},"name":{},"exporter":"clocked","profiles":['.format(
+            json.dumps(SPEEDSCOPE_SCHEMA),
+            json.dumps(profiler.root.name)
+        )
+    )
+
+    for index, (track, timings) in enumerate(tracks):
+        if index:
+            f.write(',')
+        f.write(
+            '\n{{"type":"evented","name":{},"unit":"nanoseconds",'
+            '"events":['.format(json.dumps(track))
+        )
+
+        start = None
+        last = 0
+        # the clipped end of each timing being walked
+        ends = []
+        separator = ''
+        for entering, timing in _walk(timings):
+            if entering:
+                at = max(timing.start_ns, last)
+                end = _end_ns(timing, now_ns)
+                if 0 < len(ends):
+                    end = min(end, ends[-1])
+                ends.append(max(end, at))
+
+                if start is None:
+                    start = at
+                kind = 'O'
+            else:
+                at = ends.pop()
+                kind = 'C'
+
+            frame = frames.get(timing.name_id)
+            if frame is None:
+                frame = frames[timing.name_id] = len(frames)
+
+            f.write('{}\n{{"type":"{}","frame":{},"at":{}}}'.format(
+                separator,
+                kind,
+                frame,
+                at
+            ))
+            separator = ','
+            last = at
+
+        f.write('\n],"startValue":{},"endValue":{}}}'.format(
+            0 if start is None else start,
+            last
+        ))
+
+    f.write('\n],"shared":{"frames":[')
+    by_frame = sorted(frames.items(), key=lambda x: x[1])
+    f.write(','.join(
+        '\n{{"name":{}}}'.format(json.dumps(names.get_name(name_id)))
+        for name_id, _ in by_frame
+    ))
+    f.write('\n]}}\n')
+
+
+def _frame_name(name):
+    """
+    Gets a step name as a frame of a collapsed stack, where semicolons
+    separate the frames and a line ends with the stack's weight.
+    """
+    return name.replace(';', ':').replace('\n', ' ')
+
+
+def write_collapsed(profiler, f):
+    """
+    Writes a session as collapsed stacks, the input of flamegraph.pl: a
+    line per distinct call path, "a;b;c <self microseconds>", weighted by
+    the time spent in the last step itself, excluding its children.
+
+    The lines come from the session's calling context tree, where the calls
+    along identical paths are already merged, so the file grows with the
+    number of distinct paths rather than the number of calls. Paths with no
+    time of their own are left out.
+
+    :param Profiler profiler: the session to write
+    :param f: the text file to write to
+    """
+    frames = dict()
+    paths = [(profiler.get_call_tree(), None)]
+
+    while 0 < len(paths):
+        path, prefix = paths.pop()
+
+        frame = frames.get(path.name_id)
+        if frame is None:
+            frame = frames[path.name_id] = _frame_name(path.name)
+        stack = frame if prefix is None else prefix + ';' + frame
+
+        self_ms = path.aggregate.total_ms
+        if path.error_aggregates is not None:
+            for aggregate in path.error_aggregates.values():
+                self_ms += aggregate.total_ms
+
+        self_us = int(round(self_ms * 1000))
+        if 0 < self_us:
+            f.write('{} {}\n'.format(stack, self_us))
+
+        if path.has_children:
+            # reversed, so the children are popped in order
+            for child in reversed(path.children):
+                paths.append((child, stack))
@@ -0,0 +1,102 @@
+"""
+A mergeable log-linear histogram for estimating quantiles in bounded memory.
+"""
+
+
+import math
+
+
+# each power of two range is split into 2 ** (SUB_BUCKET_BITS - 1) buckets,
+# bounding the relative error of any quantile to 2 ** -(SUB_BUCKET_BITS - 1)
+SUB_BUCKET_BITS = 7
+_SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+_SUB_BUCKET_HALF = _SUB_BUCKET_COUNT >> 1
+
+
+def _bucket_index(value):
+    """
+    Gets the index of the bucket holding a non-negative integer.
+
+    :param int value: the value to bucket
+    """
+    if value < _SUB_BUCKET_COUNT:
+        return value
+
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * _SUB_BUCKET_HALF + (value >> shift)
+
+
+def _bucket_range(index):
+    """
+    Gets the lowest and highest values held by a bucket.
+
+    :param int index: the bucket's index
+    """
+    if index < _SUB_BUCKET_COUNT:
+        return index, index
+
+    shift = index // _SUB_BUCKET_HALF - 1
+    mantissa = index - shift * _SUB_BUCKET_HALF
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class Histogram(object):
+    """
+    Counts integer values (e.g. nanoseconds) into log-linear buckets, in the
+    manner of an HDR histogram: values below 128 are counted exactly, and
+    larger values into buckets no wider than 1/64th of their value.
+
+    Only buckets that were hit are stored, so memory is bounded by the range
+    of the values rather than their number, and histograms merge by adding
+    their counts.
+    """
+
+    __slots__ = ('counts', 'count')
+
+    def __init__(self):
+        self.counts = dict()
+        self.count = 0
+
+    def record(self, value, count=1):
+        """
+        Counts a value.
+
+        :param int value: the non-negative value to count
+        :param int count: the number of times to count it
+        """
+        index = _bucket_index(value)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + count
+        self.count += count
+
+    def merge(self, other):
+        """
+        Adds the counts of another histogram to this one.
+
+        :param Histogram other: the histogram to merge in
+        """
+        counts = self.counts
+        for index, count in other.counts.items():
+            counts[index] = counts.get(index, 0) + count
+        self.count += other.count
+
+    def quantile(self, q):
+        """
+        Estimates the value below which a fraction q of the counted values
+        fall; None when nothing was counted.
+
+        :param float q: the quantile, between 0 and 1
+        """
+        if self.count == 0:
+            return None
+
+        rank = max(int(math.ceil(q * self.count)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if rank <= seen:
+                low, high = _bucket_range(index)
+                return (low + high) / 2.0
+
+        low, high = _bucket_range(max(self.counts))
+        return (low + high) / 2.0
@@ -0,0 +1,66 @@
+"""
+A registry giving each step name a small integer id, so that steps are
+stored and aggregated by id and their names are only looked up to report.
+"""
+
+
+import threading
+
+
+_names = []
+_ids = dict()
+_lock = threading.Lock()
+
+
+def get_id(name):
+    """
+    Gets the id of a step name, registering the name the first time it is
+    seen. Names are never unregistered, so the registry grows with the number
+    of distinct names.
+
+    :param str name: the step name
+    :rtype: int
+    """
+    name_id = _ids.get(name)
+    if name_id is None:
+        with _lock:
+            name_id = _ids.get(name)
+            if name_id is None:
+                name_id = len(_names)
+                _names.append(name)
+                _ids[name] = name_id
+
+    return name_id
+
+
+def find_id(name):
+    """
+    Gets the id of a step name without registering it; None if the name was
+    never seen.
+
+    :param str name: the step name
+    """
+    return _ids.get(name)
+
+
+def to_id(name):
+    """
+    Gets the id of a step given either its name or its id.
+
+    :param name: the step name, or its id
+    :rtype: int
+    """
+    if isinstance(name, int):
+        return name
+
+    return get_id(name)
+
+
+def get_name(name_id):
+    """
+    Gets the step name registered under an id.
+
+    :param int name_id: the id of the step name
+    :rtype: str
+    """
+    return _names[name_id]
@@ -1,9 +1,122 @@
 """ Encapsulates logic for the profiler object. """
 
 
+import itertools
+import threading
+from clocked import cuuid, names
+from clocked.aggregate import Aggregate
+from clocked.call_tree import CallFrame, CallPath, merge_timings, \
+    record_timings
+from clocked.events import _KIND_BITS, _pack, EventBuffer, \
+    EventSuspendableStep, rebuild_timings
 from clocked.settings import Settings
+from clocked.stopwatch import frozen_clock, thread_time_ns
+from clocked.suspendable import SuspendableStep
 from clocked.timing import Timing
-import cuuid
+from clocked.window import RollingAggregates, WindowedCallFrame
+
+try:
+    import contextvars
+    _context_head = contextvars.ContextVar('clocked_head', default=None)
+except ImportError:
+    # python < 3.7
+    contextvars = None
+    _context_head = None
+
+
+def _error_name(name, exception):
+    """
+    Gets the name to aggregate the timings of a step that raised under.
+
+    :param str name: the name of the step
+    :param type exception: the type of the exception raised
+    """
+    return '{} [raised {}]'.format(name, exception.__name__)
+
+
+def _by_name(aggregates):
+    """
+    Looks up the names of aggregates keyed by name id, or by (name id,
+    exception type) for the timings that raised.
+
+    :param dict aggregates: the aggregates by key
+    :rtype: dict of name to Aggregate
+    """
+    result = dict()
+    for key, aggregate in aggregates.items():
+        if isinstance(key, tuple):
+            result[_error_name(names.get_name(key[0]), key[1])] = aggregate
+        else:
+            result[names.get_name(key)] = aggregate
+
+    return result
+
+
+def _add_timing(aggregates, timing, sample_rate=1):
+    """
+    Adds the time a timing spent in its step itself to the aggregates, keyed
+    by name id, or by (name id, exception type) when it raised.
+
+    :param dict aggregates: the aggregates by key
+    :param Timing timing: the timing to add
+    :param int sample_rate: the number of sessions the timing stands for
+    """
+    dm = max(timing.duration_without_children_milliseconds(), 0.0)
+    cm = timing.cpu_without_children_milliseconds()
+    if cm is not None:
+        cm = max(cm, 0.0)
+
+    if timing.exception is None:
+        key = timing.name_id
+    else:
+        key = (timing.name_id, timing.exception)
+
+    aggregate = aggregates.get(key)
+    if aggregate is None:
+        aggregate = aggregates[key] = Aggregate()
+
+    aggregate.add(
+        dm,
+        cm,
+        timing.yields,
+        timing.sample_rate * sample_rate
+    )
+
+
+def create_profiler(session_name, context=False):
+    """
+    Creates a Profiler for a new session, recording a Timing per step, only
+    aggregates (optionally in rolling windows) or events depending on
+    Settings.rolling_window_seconds, Settings.aggregate_only and
+    Settings.event_recording.
+
+    :param str session_name: the name of the session
+    :param bool context: whether the profiler keeps its head in a context
+     variable (see ContextProfiler), which event recording does not support
+    """
+    if Settings.rolling_window_seconds is not None:
+        if context:
+            return ContextWindowedProfiler(session_name)
+        return WindowedProfiler(session_name)
+
+    if Settings.aggregate_only:
+        if context:
+            return ContextAggregateProfiler(session_name)
+        return AggregateProfiler(session_name)
+
+    if Settings.event_recording:
+        if context:
+            # an exit closes the step entered last on its thread, which
+            # does not hold for tasks interleaving on the same thread
+            raise Exception(
+                'event_recording cannot be used with a context profiler '
+                'provider'
+            )
+        return EventProfiler(session_name)
+
+    if context:
+        return ContextProfiler(session_name)
+    return Profiler(session_name)
 
 
 class Profiler(object):
@@ -12,13 +125,43 @@ class Profiler(object):
     a call-graph, via step().
     """
 
+    # the number of sessions this one stands for, when only 1 in sample_rate
+    # sessions is profiled
+    sample_rate = 1
+
+    # whether the steps still running were closed by stop_impl
+    stopped = False
+
     def __init__(self, name):
         from datetime import datetime
         self.id = cuuid.uuid1()
+        self.name = name
+        # timing ids only need to be unique within their profiler
+        self.timing_ids = itertools.count()
+        # taken while a step checks whether it stopped already and stops,
+        # as the steps still running are also stopped by stop_impl, from the
+        # thread reporting on the session
+        self.stop_lock = threading.Lock()
         self.started = datetime.utcnow()
         self.sw = Settings.stopwatch_provider()
+        self.sw.start()
+        self.cpu_clock = thread_time_ns if Settings.capture_cpu_time else None
         self.head = None
+        # the timings of each step name, by name id, added as they stop
+        self.name_index = dict()
+        # the aggregates of the timings pruned by min_save_ms, by name id or
+        # by (name id, exception type)
+        self.pruned_aggregates = dict()
+        self._start_root(name)
+
+    def _start_root(self, name):
+        """
+        Creates the root of the hierarchy and makes it the head.
+
+        :param str name: the name of the session
+        """
         self.root = Timing(self, None, name)
+        self.root_head = self.root
 
     @property
     def root(self):
@@ -52,6 +195,18 @@ class Profiler(object):
                 timing.children[i].parent_timing = timing
                 timings.append(timing.children[i])
 
+        self.name_index = dict()
+        for timing in self.get_timing_hierarchy():
+            if timing.duration_ns is not None:
+                self.name_index.setdefault(timing.name_id, []).append(timing)
+
+    @property
+    def elapsed_nanoseconds(self):
+        """
+        Gets nanoseconds that have elapsed.
+        """
+        return self.sw.elapsed_nanoseconds
+
     @property
     def elapsed_milliseconds(self):
         """
@@ -109,7 +264,8 @@ class Profiler(object):
     def get_timing_hierarchy(self):
         """
         Walks the Timing hierarchy contained in this profiler, starting with
-        root, and returns each Timing found.
+        root, and returns each Timing found in pre-order (each timing before
+        its children, and children in the order they were called).
         """
         timings = [self.root]
 
@@ -118,32 +274,185 @@ class Profiler(object):
             yield timing
 
             if timing.has_children:
-                for child in timing.children:
+                # reversed, so the children are popped in order
+                for child in reversed(timing.children):
                     timings.append(child)
 
+    def get_timings(self, name):
+        """
+        Gets the timings of the steps with a given name from the name index,
+        along with the ones still running, in the order they started.
+
+        :param str name: the step name
+        :rtype: list of Timing
+        """
+        name_id = names.find_id(name)
+        if name_id is None:
+            return []
+
+        self._ensure_built()
+        # the running steps are read first, so one stopping in the meantime
+        # is then found in the index
+        running = self._get_running_timings()
+        result = list(self.name_index.get(name_id, ()))
+        for timing in running:
+            if timing.name_id == name_id and timing.duration_ns is None:
+                result.append(timing)
+
+        result.sort(key=lambda x: x.id)
+        return result
+
+    def find_timings(self, pattern):
+        """
+        Gets the timings of the steps whose name matches a pattern, only
+        matching each distinct name in the name index once.
+
+        :param pattern: the compiled regular expression
+        :rtype: list of Timing
+        """
+        self._ensure_built()
+        running = self._get_running_timings()
+        result = []
+        for name_id, timings in self.name_index.items():
+            if pattern.match(names.get_name(name_id)) is not None:
+                result.extend(timings)
+
+        for timing in running:
+            if timing.duration_ns is None and \
+                    pattern.match(timing.name) is not None:
+                result.append(timing)
+
+        result.sort(key=lambda x: x.id)
+        return result
+
+    def _get_running_timings(self):
+        """
+        Gets the steps from the head up to the root, which are only added to
+        the name index as they stop.
+
+        :rtype: list of Timing
+        """
+        result = []
+        timing = self.head
+        while timing is not None:
+            result.append(timing)
+            timing = timing.parent_timing
+
+        return result
+
+    def _ensure_built(self):
+        """
+        Makes sure the hierarchy and the name index are up to date before
+        they are read; they are kept up to date as the steps run, so there is
+        nothing to do unless the session is recorded as events.
+        """
+
+    def prune_timing(self, timing):
+        """
+        Removes a timing that was too short to keep (see min_save_ms) from the
+        hierarchy, along with the timings under it. Their time still counts
+        towards the aggregates, through pruned_aggregates, towards their
+        parent's children's time, which it counted as they stopped, and
+        towards the calling context tree, through the CallPath the parent
+        merges its pruned calls into.
+
+        The timing pruned is the one stopping, which is the last child of
+        its parent unless steps ran concurrently under the parent, so it is
+        removed from the end of the lists in O(1).
+
+        :param Timing timing: the timing to prune
+        """
+        parent = timing.parent_timing
+        parent.remove_child(timing)
+        if parent.pruned is None:
+            parent.pruned = CallPath(parent.name_id)
+        record_timings(
+            parent.pruned.get_child(timing.name_id),
+            timing,
+            self.elapsed_nanoseconds,
+            self.sample_rate
+        )
+
+        # the timing itself is pruned before it is indexed, but the ones
+        # under it were indexed as they stopped
+        _add_timing(self.pruned_aggregates, timing, self.sample_rate)
+        timings = list(timing.children) if timing.has_children else []
+        while 0 < len(timings):
+            timing = timings.pop()
+            _add_timing(self.pruned_aggregates, timing, self.sample_rate)
+
+            indexed = self.name_index.get(timing.name_id, ())
+            for i in range(len(indexed) - 1, -1, -1):
+                if indexed[i] is timing:
+                    del indexed[i]
+                    break
+
+            if timing.has_children:
+                timings.extend(timing.children)
+
     def step_impl(self, name, min_save_ms=None,
-                  include_children_with_min_save=False):
+                  include_children_with_min_save=False, sample_rate=1):
         """
         Implementation for timing an individual step.
 
         :param name:
         :param min_save_ms:
         :param include_children_with_min_save:
+        :param sample_rate: the number of calls the step stands for, when
+         only 1 in sample_rate calls is timed
         """
         return Timing(
             self,
             self.head,
             name,
             min_save_ms,
-            include_children_with_min_save
+            include_children_with_min_save,
+            sample_rate
         )
 
-    def stop_impl(self):
-        """ Stops the Profiler (all Timings in the hierarchy). """
+    def suspendable_step(self, name, exclude_suspended=False, sample_rate=1):
+        """
+        Creates a step for a generator or coroutine, timed across all of its
+        resumptions.
+
+        :param name: the step name, or its id
+        :param bool exclude_suspended: whether to leave out the wall time
+         spent suspended
+        :param int sample_rate: the number of calls the step stands for, when
+         only 1 in sample_rate calls is timed
+        :rtype: SuspendableStep
+        """
+        return SuspendableStep(self, name, exclude_suspended, sample_rate)
+
+    def freeze(self):
+        """
+        Stops the session's clocks, on the thread that ran it, so that the
+        steps still running are closed at this time however late stop_impl
+        gets to them, and from whichever thread. Nothing is walked, so this
+        is O(1).
+
+        :returns: whether the session was running
+        """
         if not self.sw.is_running:
             return False
 
         self.sw.stop()
+        if self.cpu_clock is not None:
+            # other threads cannot read this thread's cpu time
+            self.cpu_clock = frozen_clock(self.cpu_clock())
+
+        return True
+
+    def stop_impl(self):
+        """
+        Stops the Profiler (all Timings in the hierarchy), at the time it was
+        frozen if it was.
+        """
+        self.freeze()
+        if self.stopped:
+            return False
+
+        self.stopped = True
         self.duration_milliseconds = self.elapsed_milliseconds
 
         for timing in self.get_timing_hierarchy():
@@ -151,6 +460,64 @@ class Profiler(object):
 
         return True
 
+    def get_call_tree(self):
+        """
+        Gets the calling context tree of this session: the Timing hierarchy
+        with the repeated calls of a step under the same call path merged
+        into a single CallPath.
+
+        :rtype: CallPath
+        """
+        return merge_timings(
+            self.root,
+            self.elapsed_nanoseconds,
+            self.sample_rate
+        )
+
+    def get_tracks(self):
+        """
+        Gets the timelines of this session for the exporters, one per thread
+        when the threads' steps are told apart.
+
+        :returns: the name of each track and the timings at its top
+        :rtype: list of (str, list of Timing)
+        """
+        return [(self.root.name, [self.root])]
+
+    def get_aggregates(self):
+        """
+        Aggregates the time spent in each step, excluding the time spent in
+        its children, by name.
+
+        Timings that exited with an exception are aggregated separately,
+        under their name followed by the exception, e.g.
+        "name [raised ValueError]".
+
+        :rtype: dict of name to Aggregate
+        """
+        if Settings.vectorized_reports:
+            from clocked import vectorized
+            result = vectorized.get_aggregates(self.root, self.sample_rate)
+        else:
+            # keyed by name id, or by (name id, exception) for errors, until
+            # the names are looked up at the end
+            aggregates = dict()
+            sample_rate = self.sample_rate
+
+            for timing in self.get_timing_hierarchy():
+                _add_timing(aggregates, timing, sample_rate)
+
+            result = _by_name(aggregates)
+
+        # the timings pruned by min_save_ms still count
+        for name, aggregate in _by_name(self.pruned_aggregates).items():
+            merged = result.get(name)
+            if merged is None:
+                merged = result[name] = Aggregate()
+            merged.merge(aggregate)
+
+        return result
+
     def get_duration_milliseconds(self, start):
         """
         Gets the amount of time that has elapsed.
@@ -158,3 +525,455 @@ class Profiler(object):
         :param float start: a millisecond offset
         """
         return self.elapsed_milliseconds - start
+
+    def get_duration_nanoseconds(self, start):
+        """
+        Gets the amount of time that has elapsed.
+
+        :param int start: a nanosecond offset
+        """
+        return self.sw.elapsed_nanoseconds - start
+
+
+class ContextProfiler(Profiler):
+    """
+    A Profiler whose head lives in a context variable, so that each thread and
+    asyncio task sharing this session keeps its own position in the
+    call-graph.
+    """
+
+    @property
+    def head(self):
+        """
+        Gets the head for the current context, falling back to root when the
+        context has not stepped into this profiler yet.
+        """
+        head = _context_head.get()
+        if head is not None and head.profiler is self:
+            return head
+
+        return getattr(self, 'root_head', None)
+
+    @head.setter
+    def head(self, head):
+        """
+        Sets the head for the current context.
+
+        :param Timing head: the timing steps should nest under
+        """
+        _context_head.set(head)
+
+
+class AggregateProfiler(Profiler):
+    """
+    A Profiler that keeps running aggregates per call path instead of a
+    Timing per step, so that its memory grows with the number of distinct
+    call paths rather than with the number of calls.
+
+    Its hierarchy is made of CallPath nodes, each merging every call of a
+    step under the same path.
+    """
+
+    def _start_root(self, name):
+        """
+        Creates the root call path and starts the frame for the session.
+
+        :param str name: the name of the session
+        """
+        self._root = CallPath(names.to_id(name))
+        self.root_timing_id = None
+        self.root_head = CallFrame(self, None, self._root)
+
+    @property
+    def root(self):
+        """
+        Gets the root call path.
+        """
+        return self._root
+
+    def step_impl(self, name, min_save_ms=None,
+                  include_children_with_min_save=False, sample_rate=1):
+        """
+        Implementation for timing an individual step; min_save_ms does not
+        apply as nothing is stored per call.
+
+        :param name:
+        :param min_save_ms:
+        :param include_children_with_min_save:
+        :param sample_rate: the number of calls the step stands for, when
+         only 1 in sample_rate calls is timed
+        """
+        head = self.head
+        name_id = names.to_id(name)
+        # CallPath.get_child, inlined for the paths that were called before
+        node = head.node.children_by_id.get(name_id)
+        if node is None:
+            node = head.node.get_child(name_id)
+
+        return CallFrame(self, head, node, sample_rate)
+
+    def get_call_tree(self):
+        """
+        Gets the calling context tree of this session, which is the hierarchy
+        itself.
+
+        :rtype: CallPath
+        """
+        return self.root
+
+    def get_timings(self, name):
+        """
+        Gets the call paths of the steps with a given name, in pre-order;
+        call paths are not indexed, as there are few of them.
+
+        :param str name: the step name
+        :rtype: list of CallPath
+        """
+        name_id = names.find_id(name)
+        return [i for i in self.get_timing_hierarchy() if i.name_id == name_id]
+
+    def find_timings(self, pattern):
+        """
+        Gets the call paths of the steps whose name matches a pattern, in
+        pre-order, only matching each distinct name once.
+
+        :param pattern: the compiled regular expression
+        :rtype: list of CallPath
+        """
+        matches = dict()
+        result = []
+        for path in self.get_timing_hierarchy():
+            matched = matches.get(path.name_id)
+            if matched is None:
+                matched = matches[path.name_id] = \
+                    pattern.match(path.name) is not None
+            if matched:
+                result.append(path)
+
+        return result
+
+    def get_tracks(self):
+        """
+        Aggregate only sessions do not keep when each call ran.
+        """
+        raise Exception('aggregate only sessions have no timeline')
+
+    def stop_impl(self):
+        """
+        Stops the Profiler (every running call up to the root), at the time
+        it was frozen if it was.
+        """
+        self.freeze()
+        if self.stopped:
+            return False
+
+        self.stopped = True
+        self.duration_milliseconds = self.elapsed_milliseconds
+
+        frame = self.head
+        while frame is not None:
+            frame.stop()
+            frame = frame.parent_timing
+
+        return True
+
+    def get_aggregates(self):
+        """
+        Aggregates the time spent in each step, excluding the time spent in
+        its children, by name, merging the aggregates of every call path.
+
+        The calls still running (those of the current context, for a
+        ContextAggregateProfiler), the session's root included, count as a
+        hit with no time of their own, as running Timings do in
+        Profiler.get_aggregates.
+
+        :rtype: dict of name to Aggregate
+        """
+        aggregates = dict()
+
+        def _merge(key, aggregate):
+            if aggregate.hits == 0:
+                return
+
+            merged = aggregates.get(key)
+            if merged is None:
+                merged = aggregates[key] = Aggregate()
+            merged.merge(aggregate)
+
+        # the running calls, by path
+        running = dict()
+        frame = self.head
+        while isinstance(frame, CallFrame):
+            if frame.duration_ns is None:
+                aggregate = running.get(frame.node)
+                if aggregate is None:
+                    aggregate = running[frame.node] = Aggregate()
+                aggregate.add(
+                    0.0,
+                    None,
+                    frame.yields,
+                    frame.sample_rate * self.sample_rate
+                )
+            frame = frame.parent_timing
+
+        for path in self.get_timing_hierarchy():
+            _merge(path.name_id, path.aggregate)
+            if path in running:
+                _merge(path.name_id, running[path])
+            if path.error_aggregates is not None:
+                for exception, aggregate in path.error_aggregates.items():
+                    _merge((path.name_id, exception), aggregate)
+
+        return _by_name(aggregates)
+
+
+class ContextAggregateProfiler(ContextProfiler, AggregateProfiler):
+    """
+    An AggregateProfiler whose head lives in a context variable.
+    """
+
+
+class WindowedProfiler(AggregateProfiler):
+    """
+    An AggregateProfiler that also keeps aggregates by name in rolling time
+    buckets (see RollingAggregates), for long-running services to report on
+    what is hot over the last few minutes rather than since they started.
+    """
+
+    def _start_root(self, name):
+        """
+        Creates the root call path and the rolling window.
+
+        :param str name: the name of the session
+        """
+        super(WindowedProfiler, self)._start_root(name)
+        self.window = RollingAggregates(
+            Settings.rolling_window_seconds,
+            Settings.rolling_bucket_seconds
+        )
+
+    def step_impl(self, name, min_save_ms=None,
+                  include_children_with_min_save=False, sample_rate=1):
+        """
+        Implementation for timing an individual step, which is added to the
+        rolling window as well as to its call path when it stops.
+
+        :param name:
+        :param min_save_ms:
+        :param include_children_with_min_save:
+        :param sample_rate: the number of calls the step stands for, when
+         only 1 in sample_rate calls is timed
+        """
+        head = self.head
+        return WindowedCallFrame(
+            self,
+            head,
+            head.node.get_child(names.to_id(name)),
+            sample_rate
+        )
+
+    def get_window_aggregates(self, seconds):
+        """
+        Aggregates the time spent in each step, excluding the time spent in
+        its children, by name, over the last seconds; its cost depends on
+        the number of buckets and names, not on the number of calls.
+
+        :param float seconds: the length of the window
+        :rtype: dict of name to Aggregate
+        """
+        return _by_name(self.window.get_aggregates(
+            self.elapsed_nanoseconds,
+            seconds
+        ))
+
+
+class ContextWindowedProfiler(ContextProfiler, WindowedProfiler):
+    """
+    A WindowedProfiler whose head lives in a context variable.
+    """
+
+
+class EventProfiler(Profiler):
+    """
+    A Profiler that records each step as a pair of compact events in a
+    buffer per thread, instead of linking a Timing per step into the
+    hierarchy.
+
+    Recording a step only appends to an array, and the Timing hierarchy is
+    rebuilt from the events, with each thread's steps under the root, only
+    when it is read (by the reports or Clocked.get). min_save_ms does not
+    apply, as steps are not kept one by one while recording.
+    """
+
+    def _start_root(self, name):
+        """
+        Creates the root of the hierarchy and the registries that the events
+        refer to by id.
+
+        :param str name: the name of the session
+        """
+        self._root = Timing(self, None, name)
+        self.root_timing_id = self._root.id
+        self.root_head = self._root
+        self.exception_types = []
+        self.exception_ids = dict()
+        self.steps = dict()
+        self._step_keys = itertools.count(1)
+        self._buffers = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._rebuilt_size = 0
+        # the steps at the top of each thread, as of the last rebuild
+        self.tracks = []
+
+    @property
+    def root(self):
+        """
+        Gets the root timing, rebuilding the hierarchy beneath it when events
+        were recorded since it was last read.
+        """
+        self._ensure_built()
+        return self._root
+
+    def _ensure_built(self):
+        """
+        Rebuilds the hierarchy and the name index from the events when any
+        were recorded since they were last rebuilt.
+        """
+        size = 0
+        for buffer in self._buffers:
+            size += len(buffer.records)
+
+        if size != self._rebuilt_size:
+            self._rebuilt_size = size
+            self.timing_ids = itertools.count(self._root.id + 1)
+            rebuild_timings(self, self._root, list(self._buffers))
+
+    def _get_running_timings(self):
+        """
+        Gets no steps, as the rebuild indexes the steps still running too.
+        """
+        return []
+
+    def get_tracks(self):
+        """
+        Gets the timelines of this session for the exporters: the steps
+        recorded by each thread once more than one thread recorded any, or
+        else the whole hierarchy.
+
+        :returns: the name of each track and the timings at its top
+        :rtype: list of (str, list of Timing)
+        """
+        root = self.root
+        if len(self.tracks) < 2:
+            return [(root.name, [root])]
+
+        return self.tracks
+
+    def get_buffer(self):
+        """
+        Gets the event buffer of the current thread, creating it on the first
+        step the thread records.
+
+        :rtype: EventBuffer
+        """
+        try:
+            return self._local.buffer
+        except AttributeError:
+            buffer = EventBuffer(self, threading.current_thread().name)
+            self._local.buffer = buffer
+            self._buffers.append(buffer)
+            return buffer
+
+    def freeze(self):
+        """
+        Stops the session's clocks, including the ones each thread's buffer
+        stamps its events with.
+
+        :returns: whether the session was running
+        """
+        if not super(EventProfiler, self).freeze():
+            return False
+
+        for buffer in list(self._buffers):
+            buffer.freeze()
+
+        return True
+
+    def get_exception_id(self, exception):
+        """
+        Gets the id that events refer to an exception type by; 0 is reserved
+        for no exception.
+
+        :param type exception: the type of the exception
+        """
+        exception_id = self.exception_ids.get(exception)
+        if exception_id is None:
+            with self._lock:
+                exception_id = self.exception_ids.get(exception)
+                if exception_id is None:
+                    self.exception_types.append(exception)
+                    exception_id = len(self.exception_types)
+                    self.exception_ids[exception] = exception_id
+
+        return exception_id
+
+    def register_step(self, step):
+        """
+        Keeps a suspendable step for the rebuild, under a key that its
+        events refer to it by.
+
+        :param EventSuspendableStep step: the step to keep
+        """
+        key = next(self._step_keys)
+        self.steps[key] = step
+        return key
+
+    def step_impl(self, name, min_save_ms=None,
+                  include_children_with_min_save=False, sample_rate=1):
+        """
+        Implementation for timing an individual step, which records its entry
+        and returns the thread's buffer to record its exit.
+
+        :param name:
+        :param min_save_ms:
+        :param include_children_with_min_save:
+        :param sample_rate: the number of calls the step stands for, when
+         only 1 in sample_rate calls is timed
+        """
+        # the same as get_buffer and EventBuffer.record, inlined
+        try:
+            buffer = self._local.buffer
+        except AttributeError:
+            buffer = self.get_buffer()
+        if name.__class__ is not int:
+            name = names.get_id(name)
+
+        buffer.depth += 1
+        cpu_clock = buffer.cpu_clock
+        buffer.write(_pack(
+            # ENTER is 0
+            sample_rate << _KIND_BITS,
+            name,
+            buffer.clock() - buffer.start_ns,
+            -1 if cpu_clock is None else cpu_clock()
+        ))
+        return buffer
+
+    def suspendable_step(self, name, exclude_suspended=False, sample_rate=1):
+        """
+        Creates a step for a generator or coroutine, recorded as events.
+
+        :param name: the step name, or its id
+        :param bool exclude_suspended: whether to leave out the wall time
+         spent suspended
+        :param int sample_rate: the number of calls the step stands for, when
+         only 1 in sample_rate calls is timed
+        :rtype: EventSuspendableStep
+        """
+        return EventSuspendableStep(
+            self,
+            name,
+            exclude_suspended,
+            sample_rate
+        )
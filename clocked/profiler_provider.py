@@ -1,5 +1,14 @@
 
 
+import threading
+
+try:
+    import contextvars
+except ImportError:
+    # python < 3.7
+    contextvars = None
+
+
 class ProfilerProvider(object):
     """
     Mostly for unit testing and single-threaded apps, only allows for one
@@ -20,8 +29,8 @@ class ProfilerProvider(object):
 
         :param str session_name: the name of the current session
         """
-        from clocked.profiler import Profiler
-        profiler = Profiler(session_name)
+        from clocked.profiler import create_profiler
+        profiler = create_profiler(session_name)
         profiler.is_active = True
         ProfilerProvider._profiler = profiler
         return profiler
@@ -31,3 +40,118 @@ class ProfilerProvider(object):
         """ Stops the current profiling session. """
         if ProfilerProvider._profiler is not None:
             ProfilerProvider._profiler.stop_impl()
+
+    @staticmethod
+    def clear():
+        """ Leaves the current session unprofiled. """
+        ProfilerProvider._profiler = None
+
+    @staticmethod
+    def set_current_profiler(profiler):
+        """
+        Makes an existing profiler (e.g. a stored session) the current one.
+
+        :param profiler: the profiler to make current
+        """
+        ProfilerProvider._profiler = profiler
+
+
+class ThreadLocalProfilerProvider(ProfilerProvider):
+    """
+    Keeps a separate Profiler (and therefore a separate head) for each thread.
+
+    Each thread starts its own session through Clocked.initialize; threads
+    that never started one are not profiled.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get_current_profiler(self):
+        """ Gets the current thread's profiler. """
+        return getattr(self._local, 'profiler', None)
+
+    def start(self, session_name=None):
+        """
+        Starts a new profiling session for the current thread.
+
+        :param str session_name: the name of the current session
+        """
+        from clocked.profiler import create_profiler
+        profiler = create_profiler(session_name)
+        profiler.is_active = True
+        self._local.profiler = profiler
+        return profiler
+
+    def stop(self):
+        """ Stops the current thread's profiling session. """
+        profiler = self.get_current_profiler()
+        if profiler is not None:
+            profiler.stop_impl()
+
+    def clear(self):
+        """ Leaves the current thread's session unprofiled. """
+        self._local.profiler = None
+
+    def set_current_profiler(self, profiler):
+        """
+        Makes an existing profiler (e.g. a stored session) the current
+        thread's.
+
+        :param profiler: the profiler to make current
+        """
+        self._local.profiler = profiler
+
+
+class ContextProfilerProvider(ProfilerProvider):
+    """
+    Keeps the current Profiler in a context variable, so every thread and
+    asyncio task sees the session started in (or inherited by) its context.
+
+    The profilers handed out keep their head in a context variable as well,
+    so tasks sharing a session still nest their steps independently.
+    """
+
+    def __init__(self):
+        if contextvars is None:
+            raise Exception('contextvars is not available (python < 3.7)')
+
+        self._current = contextvars.ContextVar(
+            'clocked_profiler',
+            default=None
+        )
+
+    def get_current_profiler(self):
+        """ Gets the profiler for the current context. """
+        return self._current.get()
+
+    def start(self, session_name=None):
+        """
+        Starts a new profiling session for the current context.
+
+        :param str session_name: the name of the current session
+        """
+        from clocked.profiler import create_profiler
+        profiler = create_profiler(session_name, context=True)
+        profiler.is_active = True
+        self._current.set(profiler)
+        return profiler
+
+    def stop(self):
+        """ Stops the current context's profiling session. """
+        profiler = self.get_current_profiler()
+        if profiler is not None:
+            profiler.stop_impl()
+
+    def clear(self):
+        """ Leaves the current context's session unprofiled. """
+        self._current.set(None)
+
+    def set_current_profiler(self, profiler):
+        """
+        Makes an existing profiler (e.g. a stored session) the current
+        context's.
+
+        :param profiler: the profiler to make current
+        """
+        self._current.set(profiler)
@@ -0,0 +1,138 @@
+"""
+A background thread reporting on sessions once they are swapped out, so that
+the threads serving requests never aggregate or export anything themselves.
+"""
+
+
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    # python 2
+    import Queue as queue
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# tells the reporter's thread to exit
+_STOP = object()
+
+
+def hotspot_handler(output_method=None, limit=None):
+    """
+    Creates a handler writing the hotspot report of each session.
+
+    :param func output_method: a method that takes a string and manages
+     where the output goes, defaulting to logging at info level
+    :param int limit: used to limit the output to the top n culprits
+    """
+    from clocked.clockit import Clocked
+    if output_method is None:
+        output_method = logger.info
+
+    def handler(profiler):
+        for line in Clocked.generate_hotspot_report(limit, profiler=profiler):
+            output_method(line)
+
+    return handler
+
+
+def export_handler(path, write):
+    """
+    Creates a handler exporting each session to a file of its own.
+
+    :param str path: the path of the files, formatted with the session's
+     name, id and start time, e.g. '/tmp/{name}-{started:%H%M%S}.json'
+    :param func write: the exporter, taking the session and a text file
+     (e.g. export.write_speedscope)
+    """
+    def handler(profiler):
+        with open(path.format(
+            name=profiler.name,
+            id=profiler.id,
+            started=profiler.started
+        ), 'w') as f:
+            write(profiler, f)
+
+    return handler
+
+
+class BackgroundReporter(object):
+    """
+    A daemon thread that stops, aggregates and exports sessions handed to it
+    by Clocked.rotate, which only freezes the session and swaps a fresh one
+    in on the caller's thread. The steps still running are closed at the
+    time the session was frozen, however long it waited in the queue.
+
+    Each session is handed to the handlers in turn, on the reporter's thread.
+    Errors raised by a handler are logged, and do not stop the reporter.
+    """
+
+    def __init__(self, *handlers):
+        """
+        :param handlers: functions taking a stopped session, defaulting to
+         hotspot_handler()
+        """
+        self.handlers = handlers or (hotspot_handler(),)
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        """
+        Gets a value indicating whether the reporter's thread is running.
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Starts the reporter's thread.
+        """
+        if self.is_running:
+            return
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name='clocked reporter'
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, profiler):
+        """
+        Queues a session to be reported on, without blocking.
+
+        :param Profiler profiler: the session, no longer current
+        """
+        self._queue.put(profiler)
+
+    def stop(self, timeout=None):
+        """
+        Reports on the sessions still queued, then stops the thread.
+
+        :param float timeout: the seconds to wait for the thread, if any
+        """
+        if not self.is_running:
+            return
+
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            profiler = self._queue.get()
+            if profiler is _STOP:
+                return
+
+            profiler.stop_impl()
+            for handler in self.handlers:
+                try:
+                    handler(profiler)
+                except Exception:
+                    logger.exception(
+                        'reporting on session %s failed',
+                        profiler.id
+                    )
@@ -1,6 +1,7 @@
 """ Various configuration properties. """
 
 
+import os
 from clocked.profiler_provider import ProfilerProvider
 from clocked.stopwatch import StopWatch
 
@@ -8,8 +9,43 @@ from clocked.stopwatch import StopWatch
 class Settings(object):
     """ Various configuration properties. """
 
+    # the provider deciding which Profiler is 'current'; swap in a
+    # ThreadLocalProfilerProvider or ContextProfilerProvider for concurrent
+    # servers
     profiler_provider = None
 
+    # the StopWatch class used to time sessions; StopWatch measures wall time,
+    # ProcessTimeStopWatch and ThreadTimeStopWatch measure cpu time
+    stopwatch_provider = StopWatch
+
+    # whether @clocked wraps what it decorates; when off, decorated functions
+    # are returned unchanged and cost nothing until Settings.enable()
+    enabled = not os.environ.get('CLOCKED_DISABLED')
+
+    # whether sessions only keep running aggregates per call path (count,
+    # total, min, max and self time) instead of a Timing per step, bounding
+    # their memory by the number of distinct call paths
+    aggregate_only = False
+
+    # when set, sessions only keep running aggregates (as with aggregate_only)
+    # and also aggregates by name over the last rolling_window_seconds, kept
+    # in buckets of rolling_bucket_seconds that are evicted as they age
+    rolling_window_seconds = None
+    rolling_bucket_seconds = 10
+
+    # whether sessions record each step as compact events in a buffer per
+    # thread, rebuilding the Timing hierarchy only when it is read; ignored
+    # when aggregate_only is set
+    event_recording = False
+
+    # whether the hotspot reports aggregate Timing hierarchies with numpy,
+    # which is much faster for hierarchies of millions of timings
+    vectorized_reports = False
+
+    # whether each step also records the cpu time of its thread, at the cost
+    # of one extra clock read when entering and exiting the step
+    capture_cpu_time = True
+
     @staticmethod
     def ensure_profiler_provider():
         """
@@ -19,10 +55,21 @@ class Settings(object):
             Settings.profiler_provider = ProfilerProvider()
 
     @staticmethod
-    def stopwatch_provider():
+    def enable():
+        """
+        Turns @clocked on, including for the functions that were decorated
+        while it was disabled.
+        """
+        from clocked import decorators
+        Settings.enabled = True
+        decorators.enable()
+
+    @staticmethod
+    def disable():
         """
-        Provides a stopwatch.
+        Turns @clocked off for functions decorated from now on, and stops
+        timing the functions that were decorated while it was disabled.
         """
-        sw = StopWatch()
-        sw.start()
-        return sw
+        from clocked import decorators
+        Settings.enabled = False
+        decorators.disable()
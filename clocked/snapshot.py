@@ -0,0 +1,272 @@
+"""
+Snapshots of profiling sessions, to be shipped between processes (e.g. from
+the workers of a process pool to their parent) and merged there.
+"""
+
+
+from clocked import cuuid, names
+from clocked.aggregate import Aggregate
+from clocked.call_tree import CallPath, merge_paths
+from clocked.profiler import AggregateProfiler
+
+
+# the version of the state snapshots are pickled as
+STATE_VERSION = 1
+
+# the types standing in for the exceptions of restored snapshots, by name
+_exception_types = dict()
+
+
+def _get_exception_type(name):
+    """
+    Gets the type standing in for an exception restored from a snapshot,
+    where only its name is kept. The same name always gives the same type,
+    so that the snapshots from several processes merge.
+
+    :param str name: the name of the exception type
+    :rtype: type
+    """
+    exception = _exception_types.get(name)
+    if exception is None:
+        exception = _exception_types.setdefault(
+            name,
+            type(str(name), (Exception,), dict())
+        )
+
+    return exception
+
+
+def _aggregate_state(aggregate):
+    return (
+        aggregate.hits,
+        aggregate.total_ms,
+        aggregate.min_ms,
+        aggregate.max_ms,
+        aggregate.cpu_ms,
+        aggregate.yields,
+        aggregate.estimated,
+        aggregate.histogram.counts
+    )
+
+
+def _restore_aggregate(state):
+    aggregate = Aggregate()
+    (aggregate.hits, aggregate.total_ms, aggregate.min_ms, aggregate.max_ms,
+     aggregate.cpu_ms, aggregate.yields, aggregate.estimated, counts) = state
+    aggregate.histogram.counts = dict(counts)
+    aggregate.histogram.count = sum(counts.values())
+    return aggregate
+
+
+def _restore(state):
+    """
+    Restores a pickled Snapshot.
+
+    :param tuple state: the state returned by Snapshot.get_state
+    :rtype: Snapshot
+    """
+    version, name, step_names, nodes = state
+    if version != STATE_VERSION:
+        raise Exception('unsupported snapshot version {}'.format(version))
+
+    name_ids = [names.get_id(i) for i in step_names]
+    paths = []
+
+    for (parent, name_index, hits, total_ns, min_ns, max_ns, estimated,
+         aggregate, errors) in nodes:
+        if parent < 0:
+            path = CallPath(name_ids[name_index])
+        else:
+            path = paths[parent].get_child(name_ids[name_index])
+
+        path.hits = hits
+        path.total_ns = total_ns
+        path.min_ns = min_ns
+        path.max_ns = max_ns
+        path.estimated = estimated
+        path.aggregate = _restore_aggregate(aggregate)
+        if errors is not None:
+            path.error_aggregates = dict(
+                (_get_exception_type(exception), _restore_aggregate(i))
+                for exception, i in errors
+            )
+
+        paths.append(path)
+
+    return Snapshot(name, paths[0])
+
+
+class Snapshot(AggregateProfiler):
+    """
+    The calling context tree of a session, detached from the session and its
+    process: every call of a step under the same call path merged into a
+    CallPath, with the hits, total, min and max time and the aggregates of
+    the time spent in the step itself.
+
+    Snapshots pickle to a compact state naming their steps and exceptions,
+    so they can be sent to another process (e.g. through a
+    multiprocessing.Queue), where merge adds the calls of one snapshot to
+    another. Merging is associative, so the snapshots of many processes can
+    be merged in any grouping, e.g. as a tree reduction.
+
+    A snapshot can be made the current session with Clocked.use, for get and
+    the reports. The exceptions of restored snapshots are stood in for by
+    types of the same name.
+    """
+
+    def __init__(self, name, root=None):
+        """
+        :param str name: the name of the session
+        :param CallPath root: the root of the calling context tree
+        """
+        self.id = cuuid.uuid1()
+        self.name = name
+        self.name_index = dict()
+        self.head = None
+        self.root_timing_id = None
+        self._root = root if root is not None else CallPath(
+            names.get_id(name)
+        )
+
+    @classmethod
+    def take(cls, profiler):
+        """
+        Takes a snapshot of a session, copying its calling context tree. The
+        steps still running are counted as if they stopped now.
+
+        :param Profiler profiler: the session
+        :rtype: Snapshot
+        """
+        tree = profiler.get_call_tree()
+        return _restore(Snapshot(tree.name, tree).get_state())
+
+    @property
+    def duration_milliseconds(self):
+        """
+        Gets the total duration of the sessions merged into this snapshot.
+        """
+        return self._root.duration_milliseconds
+
+    @property
+    def elapsed_nanoseconds(self):
+        """
+        Gets the total duration, in nanoseconds, of the sessions merged into
+        this snapshot, as it has no stopwatch of its own.
+        """
+        return self._root.total_ns
+
+    @property
+    def elapsed_milliseconds(self):
+        """
+        Gets the total duration, in milliseconds, of the sessions merged into
+        this snapshot.
+        """
+        return self._root.duration_milliseconds
+
+    def get_state(self):
+        """
+        Gets the state this snapshot pickles to: the names of its steps, and
+        its call paths in pre-order, referring to their parent and name by
+        index.
+
+        :rtype: tuple
+        """
+        step_names = []
+        name_indexes = dict()
+        nodes = []
+
+        paths = [(self._root, -1)]
+        while 0 < len(paths):
+            path, parent = paths.pop()
+
+            name_index = name_indexes.get(path.name_id)
+            if name_index is None:
+                name_index = name_indexes[path.name_id] = len(step_names)
+                step_names.append(path.name)
+
+            if path.error_aggregates is None:
+                errors = None
+            else:
+                errors = tuple(
+                    (exception.__name__, _aggregate_state(aggregate))
+                    for exception, aggregate in path.error_aggregates.items()
+                )
+
+            index = len(nodes)
+            nodes.append((
+                parent,
+                name_index,
+                path.hits,
+                path.total_ns,
+                path.min_ns,
+                path.max_ns,
+                path.estimated,
+                _aggregate_state(path.aggregate),
+                errors
+            ))
+
+            if path.has_children:
+                # reversed, so the children are popped in order
+                for child in reversed(path.children):
+                    paths.append((child, index))
+
+        return STATE_VERSION, self.name, step_names, nodes
+
+    def __reduce__(self):
+        return _restore, (self.get_state(),)
+
+    def merge(self, other):
+        """
+        Adds the calls of another snapshot to this one, path by path.
+
+        :param Snapshot other: the snapshot to merge in
+        :returns: this snapshot
+        """
+        merge_paths(self._root, other.root)
+        return self
+
+    def step_impl(self, name, min_save_ms=None,
+                  include_children_with_min_save=False, sample_rate=1):
+        """
+        Snapshots are read only.
+        """
+        raise Exception('snapshots are read only')
+
+    def suspendable_step(self, name, exclude_suspended=False, sample_rate=1):
+        """
+        Snapshots are read only.
+        """
+        raise Exception('snapshots are read only')
+
+    def freeze(self):
+        """
+        Snapshots have already stopped.
+        """
+        return False
+
+    def stop_impl(self):
+        """
+        Snapshots have already stopped.
+        """
+        return False
+
+
+def merge_snapshots(snapshots, name=None):
+    """
+    Merges snapshots into a new one, leaving them unchanged.
+
+    :param snapshots: the snapshots to merge
+    :param str name: the name of the merged snapshot, defaulting to the
+     name of the first one
+    :rtype: Snapshot
+    """
+    merged = None
+    for snapshot in snapshots:
+        if merged is None:
+            merged = Snapshot(name if name is not None else snapshot.name)
+        merged.merge(snapshot)
+
+    if merged is None:
+        merged = Snapshot(name if name is not None else '')
+
+    return merged
@@ -6,18 +6,71 @@ Altered from https://gist.github.com/sumeet/1123871
 import time
 
 
+def _nanoseconds(clock):
+    """
+    Adapts a clock returning float seconds into one returning integer
+    nanoseconds.
+
+    :param func clock: the clock to adapt
+    """
+    def _clock():
+        return int(clock() * 1000000000)
+    return _clock
+
+
+def frozen_clock(ns):
+    """
+    Creates a clock that always reads the same integer nanoseconds, e.g. the
+    time a session was frozen at.
+
+    :param int ns: the time to read
+    """
+    def _clock():
+        return ns
+    return _clock
+
+
+# wall time, unaffected by changes to the system clock
+try:
+    perf_counter_ns = time.perf_counter_ns
+except AttributeError:
+    try:
+        perf_counter_ns = _nanoseconds(time.perf_counter)
+    except AttributeError:
+        # python 2
+        perf_counter_ns = _nanoseconds(time.time)
+
+# cpu time of the whole process
+try:
+    process_time_ns = time.process_time_ns
+except AttributeError:
+    try:
+        process_time_ns = _nanoseconds(time.process_time)
+    except AttributeError:
+        # python 2
+        process_time_ns = _nanoseconds(time.clock)
+
+# cpu time of the current thread, falling back to the process' cpu time
+try:
+    thread_time_ns = time.thread_time_ns
+except AttributeError:
+    thread_time_ns = process_time_ns
+
+
 class StopWatch(object):
     """
     A stopwatch utility for timing execution that can be used as a regular
     object or as a context manager.
 
     NOTE: This should not be used an accurate benchmark of Python code, but a
-    way to check how much time has elapsed between actions. And this does not
-    account for changes or blips in the system clock.
+    way to check how much time has elapsed between actions.
+
+    Times are read from `clock`, a function returning integer nanoseconds,
+    and default to wall time. Subclasses measure process or thread cpu time.
 
     Instance attributes:
-    start_time -- timestamp when the timer started
-    stop_time -- timestamp when the timer stopped
+    start_time -- timestamp (ns) when the timer started
+    stop_time -- timestamp (ns) when the timer stopped
 
     As a regular object:
 
@@ -35,36 +88,73 @@ class StopWatch(object):
 
     >>> with StopWatch() as stopwatch:
     ...     time.sleep(.001)
-    ...     print repr(1 <= stopwatch.time_elapsed <= 2)
+    ...     print(repr(1 <= stopwatch.elapsed_milliseconds <= 2))
     ...     time.sleep(.001)
     True
     >>> 2 <= stopwatch.total_milliseconds
     True
     """
 
-    def __init__(self):
-        """Initialize a new `Stopwatch`, but do not start timing."""
+    clock = staticmethod(perf_counter_ns)
+
+    def __init__(self, clock=None):
+        """
+        Initialize a new `Stopwatch`, but do not start timing.
+
+        :param func clock: overrides the clock, a function returning integer
+         nanoseconds
+        """
+        if clock is not None:
+            self.clock = clock
+
         self.start_time = None
         self.stop_time = None
 
     def start(self):
         """Start timing."""
-        self.start_time = time.clock()
+        self.start_time = self.clock()
+        self.stop_time = None
 
     def stop(self):
         """Stop timing."""
-        self.stop_time = time.clock()
+        self.stop_time = self.clock()
 
     @property
-    def elapsed_milliseconds(self):
+    def is_running(self):
         """
-        Return the number of milliseconds that have elapsed since this
-        `Stopwatch` started timing.
+        Whether this `Stopwatch` has been started and not stopped yet.
+        """
+        return self.start_time is not None and self.stop_time is None
+
+    @property
+    def elapsed_nanoseconds(self):
+        """
+        Return the number of nanoseconds that have elapsed since this
+        `Stopwatch` started timing, up to when it stopped if it did.
 
         This is used for checking how much time has elapsed while the timer is
         still running.
         """
-        return (time.clock() - self.start_time) * 1000.0
+        if self.stop_time is not None:
+            return self.stop_time - self.start_time
+
+        return self.clock() - self.start_time
+
+    @property
+    def elapsed_milliseconds(self):
+        """
+        Return the number of milliseconds that have elapsed since this
+        `Stopwatch` started timing, up to when it stopped if it did.
+        """
+        return self.elapsed_nanoseconds / 1000000.0
+
+    @property
+    def total_nanoseconds(self):
+        """
+        Return the number of nanoseconds that elapsed from when this
+        `Stopwatch` started to when it ended.
+        """
+        return self.stop_time - self.start_time
 
     @property
     def total_milliseconds(self):
@@ -72,7 +162,7 @@ class StopWatch(object):
         Return the number of milliseconds that elapsed from when this
         `Stopwatch` started to when it ended.
         """
-        return (self.stop_time - self.start_time) * 1000.0
+        return (self.stop_time - self.start_time) / 1000000.0
 
     def __enter__(self):
         """Start timing and return this `Stopwatch` instance."""
@@ -94,3 +184,19 @@ class StopWatch(object):
         self.stop()
         if _type:
             raise
+
+
+class ProcessTimeStopWatch(StopWatch):
+    """
+    A `StopWatch` measuring the cpu time of the whole process.
+    """
+
+    clock = staticmethod(process_time_ns)
+
+
+class ThreadTimeStopWatch(StopWatch):
+    """
+    A `StopWatch` measuring the cpu time of the current thread.
+    """
+
+    clock = staticmethod(thread_time_ns)
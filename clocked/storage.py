@@ -0,0 +1,996 @@
+"""
+A compact binary format for profiling sessions: a header, a fixed-width
+record per timing in pre-order, a table of the strings the records refer to,
+and the call paths of the timings pruned by min_save_ms. Stored sessions are
+read through a memory map, so only the records and strings that are looked at
+are ever decoded.
+"""
+
+
+import mmap
+import struct
+from clocked import names
+from clocked.aggregate import Aggregate
+from clocked.call_tree import CallPath, merge_timings
+from clocked.profiler import AggregateProfiler, _error_name
+from clocked.settings import Settings
+from clocked.vectorized import MISSING, numpy
+
+
+MAGIC = b'CLKD'
+VERSION = 2
+
+# magic, version, flags, record count, records offset, strings offset, string
+# count, elapsed ns, then the string indexes of the session's name, id and
+# start time, its sample rate, and the offset and count of the pruned paths
+HEADER = struct.Struct('<4sHHqqqqqiiiIqq')
+
+# parent index, end index (one past its last descendant), start ns, duration
+# ns, cpu duration ns, children's ns, children's cpu ns and yields, then the
+# string indexes of the name and exception (-1 for none), and the sample rate
+RECORD = struct.Struct('<qqqqqqqqiiI')
+
+# the paths pruned from under the timings, each in pre-order: the index of
+# the record it was pruned from under, the index of its parent path (-1 when
+# directly under the record), the string index of its name, its hits, total,
+# min (MISSING for None) and max ns, whether it is estimated and its number
+# of aggregates, followed by its aggregates
+PATH = struct.Struct('<qqiqqqq?I')
+
+# the string index of the exception (-1 for the path's own aggregate), hits,
+# total, min, max and cpu ms (NaN for None), yields, whether it is estimated
+# and its number of histogram buckets, followed by its buckets
+AGGREGATE = struct.Struct('<iqddddq?I')
+
+# a histogram bucket's index and count
+BUCKET = struct.Struct('<qq')
+
+_LENGTH = struct.Struct('<I')
+_OFFSET = struct.Struct('<q')
+
+# the name's string index, within a record
+_NAME = struct.Struct('<i')
+_NAME_OFFSET = 8 * 8
+
+
+def _or_missing(value):
+    return MISSING if value is None else value
+
+
+def _or_none(value):
+    return None if value == MISSING else value
+
+
+def _or_nan(value):
+    return float('nan') if value is None else value
+
+
+def _nan_or_none(value):
+    # NaN is the only value that differs from itself
+    return None if value != value else value
+
+
+class _StringTable(object):
+    """
+    Collects the distinct strings referred to by a session's records.
+    """
+
+    __slots__ = ('strings', 'indexes')
+
+    def __init__(self):
+        self.strings = []
+        self.indexes = dict()
+
+    def index(self, string):
+        """
+        Gets the index of a string, adding it on first use.
+
+        :param str string: the string
+        """
+        index = self.indexes.get(string)
+        if index is None:
+            index = self.indexes[string] = len(self.strings)
+            self.strings.append(string)
+
+        return index
+
+
+def _pruned_paths(timings):
+    """
+    Gets the paths pruned from under some timings, each tree in pre-order.
+
+    :param list timings: the timings, in pre-order
+    :returns: the index of the timing each path was pruned from under, the
+     index of its parent path (-1 when directly under the timing) and the
+     path
+    """
+    nodes = []
+    for index, timing in enumerate(timings):
+        if timing.pruned is None or not timing.pruned.has_children:
+            continue
+
+        # reversed, so the children are popped in order
+        paths = [(i, -1) for i in reversed(timing.pruned.children)]
+        while 0 < len(paths):
+            path, parent = paths.pop()
+            node = len(nodes)
+            nodes.append((index, parent, path))
+
+            if path.has_children:
+                for child in reversed(path.children):
+                    paths.append((child, node))
+
+    return nodes
+
+
+def _pack_aggregate(exception, aggregate):
+    """
+    Packs an aggregate of a pruned path, along with its histogram.
+
+    :param int exception: the string index of the exception, or -1
+    :param Aggregate aggregate: the aggregate
+    :rtype: bytes
+    """
+    counts = aggregate.histogram.counts
+    return AGGREGATE.pack(
+        exception,
+        aggregate.hits,
+        aggregate.total_ms,
+        _or_nan(aggregate.min_ms),
+        aggregate.max_ms,
+        _or_nan(aggregate.cpu_ms),
+        _or_missing(aggregate.yields),
+        aggregate.estimated,
+        len(counts)
+    ) + b''.join(BUCKET.pack(i, count) for i, count in counts.items())
+
+
+def _unpack_aggregate(buffer, offset):
+    """
+    Unpacks an aggregate packed by _pack_aggregate.
+
+    :returns: the string index of the exception, the aggregate and the
+     offset past it
+    """
+    values = AGGREGATE.unpack_from(buffer, offset)
+    offset += AGGREGATE.size
+
+    aggregate = Aggregate()
+    aggregate.hits = values[1]
+    aggregate.total_ms = values[2]
+    aggregate.min_ms = _nan_or_none(values[3])
+    aggregate.max_ms = values[4]
+    aggregate.cpu_ms = _nan_or_none(values[5])
+    aggregate.yields = _or_none(values[6])
+    aggregate.estimated = values[7]
+
+    histogram = aggregate.histogram
+    for _ in range(values[8]):
+        index, count = BUCKET.unpack_from(buffer, offset)
+        offset += BUCKET.size
+        histogram.counts[index] = count
+        histogram.count += count
+
+    return values[0], aggregate, offset
+
+
+def save(profiler, path):
+    """
+    Writes a session's Timing hierarchy to a file, which StoredProfiler can
+    read back. Timings still running are written as running.
+
+    :param Profiler profiler: the session to write
+    :param str path: the file to write to
+    """
+    if isinstance(profiler, AggregateProfiler):
+        raise Exception('aggregate only sessions cannot be saved')
+
+    strings = _StringTable()
+    session = (
+        strings.index(profiler.root.name or ''),
+        strings.index(str(profiler.id)),
+        strings.index(profiler.started.isoformat())
+    )
+
+    # the timings in pre-order, with the index of their parent and of the
+    # end of their subtree
+    timings = []
+    parents = []
+    stack = [(profiler.root, -1)]
+    while 0 < len(stack):
+        timing, parent = stack.pop()
+        index = len(timings)
+        timings.append(timing)
+        parents.append(parent)
+
+        if timing.has_children:
+            # reversed, so the children are popped in order
+            for child in reversed(timing.children):
+                stack.append((child, index))
+
+    ends = list(range(1, len(timings) + 1))
+    for index in range(len(timings) - 1, 0, -1):
+        parent = parents[index]
+        if ends[parent] < ends[index]:
+            ends[parent] = ends[index]
+
+    with open(path, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+
+        for index, timing in enumerate(timings):
+            if timing.exception is None:
+                exception = -1
+            else:
+                exception = strings.index(timing.exception.__name__)
+
+            f.write(RECORD.pack(
+                parents[index],
+                ends[index],
+                timing.start_ns,
+                _or_missing(timing.duration_ns),
+                _or_missing(timing.cpu_duration_ns),
+                timing.child_ns,
+                timing.child_cpu_ns,
+                _or_missing(timing.yields),
+                strings.index(timing.name),
+                exception,
+                timing.sample_rate
+            ))
+
+        # indexed before the strings are written
+        pruned = _pruned_paths(timings)
+        for _, _, pruned_path in pruned:
+            strings.index(pruned_path.name)
+            if pruned_path.error_aggregates is not None:
+                for exception in pruned_path.error_aggregates:
+                    strings.index(exception.__name__)
+
+        # the strings, preceded by the offset of each one
+        strings_offset = HEADER.size + len(timings) * RECORD.size
+        offset = strings_offset + len(strings.strings) * _OFFSET.size
+        encoded = [i.encode('utf-8') for i in strings.strings]
+        for string in encoded:
+            f.write(_OFFSET.pack(offset))
+            offset += _LENGTH.size + len(string)
+        for string in encoded:
+            f.write(_LENGTH.pack(len(string)))
+            f.write(string)
+
+        pruned_offset = offset
+        for index, parent, pruned_path in pruned:
+            errors = pruned_path.error_aggregates or dict()
+            f.write(PATH.pack(
+                index,
+                parent,
+                strings.index(pruned_path.name),
+                pruned_path.hits,
+                pruned_path.total_ns,
+                _or_missing(pruned_path.min_ns),
+                pruned_path.max_ns,
+                pruned_path.estimated,
+                1 + len(errors)
+            ))
+            f.write(_pack_aggregate(-1, pruned_path.aggregate))
+            for exception, aggregate in errors.items():
+                f.write(_pack_aggregate(
+                    strings.index(exception.__name__),
+                    aggregate
+                ))
+
+        f.seek(0)
+        f.write(HEADER.pack(
+            MAGIC,
+            VERSION,
+            0,
+            len(timings),
+            HEADER.size,
+            strings_offset,
+            len(strings.strings),
+            profiler.elapsed_nanoseconds,
+            session[0],
+            session[1],
+            session[2],
+            profiler.sample_rate,
+            pruned_offset,
+            len(pruned)
+        ))
+
+
+class StoredProfiler(object):
+    """
+    A session read back from a file written by save, through a memory map.
+
+    It stands in for a finished Profiler: made current (see Clocked.load),
+    it can be reported on and queried with Clocked.get and the hotspot
+    methods. Timings are only decoded as they are walked, and the aggregates
+    are computed straight from the records. Stored sessions are read only, so
+    no steps can be timed while one is current.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: the file to read
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(
+            self._file.fileno(),
+            0,
+            access=mmap.ACCESS_READ
+        )
+
+        header = HEADER.unpack_from(self._map, 0)
+        if header[0] != MAGIC:
+            self.close()
+            raise Exception('{} is not a clocked session'.format(path))
+        if header[1] != VERSION:
+            self.close()
+            raise Exception('unsupported session version {}'.format(
+                header[1]
+            ))
+
+        self.record_count = header[3]
+        self._records_offset = header[4]
+        self._strings_offset = header[5]
+        self.string_count = header[6]
+        self.elapsed_nanoseconds = header[7]
+        self.sample_rate = header[11]
+        self._pruned_offset = header[12]
+        self.pruned_count = header[13]
+        self._pruned = None
+        self.duration_milliseconds = self.elapsed_nanoseconds / 1000000.0
+
+        self._strings = dict()
+        self._name_ids = dict()
+        self._exceptions = dict()
+        self._name_index = None
+
+        self.name = self.get_string(header[8])
+        self.id = self.get_string(header[9])
+        self.started = self.get_string(header[10])
+
+    def close(self):
+        """
+        Closes the memory map and the file.
+        """
+        self._map.close()
+        self._file.close()
+
+    def get_string(self, index):
+        """
+        Gets a string from the string table.
+
+        :param int index: the index of the string
+        :rtype: str
+        """
+        string = self._strings.get(index)
+        if string is None:
+            offset, = _OFFSET.unpack_from(
+                self._map,
+                self._strings_offset + index * _OFFSET.size
+            )
+            length, = _LENGTH.unpack_from(self._map, offset)
+            start = offset + _LENGTH.size
+            string = self._map[start:start + length].decode('utf-8')
+            self._strings[index] = string
+
+        return string
+
+    def get_name_id(self, index):
+        """
+        Gets the name registry id of a string from the string table.
+
+        :param int index: the index of the string
+        """
+        name_id = self._name_ids.get(index)
+        if name_id is None:
+            name_id = self._name_ids[index] = names.get_id(
+                self.get_string(index)
+            )
+
+        return name_id
+
+    def get_exception(self, index):
+        """
+        Gets an exception type standing in for the one a timing raised, as
+        only its name is stored.
+
+        :param int index: the index of the exception's name
+        :rtype: type
+        """
+        exception = self._exceptions.get(index)
+        if exception is None:
+            exception = self._exceptions[index] = type(
+                str(self.get_string(index)),
+                (Exception,),
+                dict()
+            )
+
+        return exception
+
+    def get_record(self, index):
+        """
+        Decodes the record of a timing.
+
+        :param int index: the timing's index in pre-order
+        :rtype: tuple
+        """
+        return RECORD.unpack_from(
+            self._map,
+            self._records_offset + index * RECORD.size
+        )
+
+    def get_timing(self, index):
+        """
+        Gets a timing by its index in pre-order.
+
+        :param int index: the timing's index
+        :rtype: StoredTiming
+        """
+        return StoredTiming(self, index, self.get_record(index))
+
+    @property
+    def root(self):
+        """
+        Gets the root timing.
+        """
+        return self.get_timing(0)
+
+    @property
+    def elapsed_milliseconds(self):
+        """
+        Gets the milliseconds that had elapsed when the session was saved.
+        """
+        return self.elapsed_nanoseconds / 1000000.0
+
+    def get_duration_milliseconds(self, start):
+        """
+        Gets the amount of time that had elapsed when the session was saved.
+
+        :param float start: a millisecond offset
+        """
+        return self.elapsed_milliseconds - start
+
+    def get_duration_nanoseconds(self, start):
+        """
+        Gets the amount of time that had elapsed when the session was saved.
+
+        :param int start: a nanosecond offset
+        """
+        return self.elapsed_nanoseconds - start
+
+    def get_timing_hierarchy(self):
+        """
+        Walks the stored timings in pre-order, which is the order they are
+        stored in.
+        """
+        for index in range(self.record_count):
+            yield self.get_timing(index)
+
+    def _get_name_index(self):
+        """
+        Gets the index of each record by the string index of its name, built
+        on the first query by reading only the names of the records.
+
+        :rtype: dict of int to list of int
+        """
+        if self._name_index is None:
+            index = dict()
+            unpack_from = _NAME.unpack_from
+            offset = self._records_offset + _NAME_OFFSET
+
+            for i in range(self.record_count):
+                name, = unpack_from(self._map, offset)
+                offset += RECORD.size
+
+                indexes = index.get(name)
+                if indexes is None:
+                    index[name] = [i]
+                else:
+                    indexes.append(i)
+
+            self._name_index = index
+
+        return self._name_index
+
+    def get_timings(self, name):
+        """
+        Gets the timings of the steps with a given name, in pre-order.
+
+        :param str name: the step name
+        :rtype: list of StoredTiming
+        """
+        for index, indexes in self._get_name_index().items():
+            if self.get_string(index) == name:
+                return [self.get_timing(i) for i in indexes]
+
+        return []
+
+    def find_timings(self, pattern):
+        """
+        Gets the timings of the steps whose name matches a pattern, in
+        pre-order, only matching each distinct name once.
+
+        :param pattern: the compiled regular expression
+        :rtype: list of StoredTiming
+        """
+        result = []
+        for index, indexes in self._get_name_index().items():
+            if pattern.match(self.get_string(index)) is not None:
+                result.extend(indexes)
+
+        result.sort()
+        return [self.get_timing(i) for i in result]
+
+    def _get_pruned(self):
+        """
+        Gets the calls pruned from under each timing, decoded on the first
+        query.
+
+        :returns: the CallPath standing for each timing calls were pruned
+         from under, by the timing's index
+        :rtype: dict of int to CallPath
+        """
+        if self._pruned is None:
+            pruned = dict()
+            paths = []
+            offset = self._pruned_offset
+
+            for _ in range(self.pruned_count):
+                values = PATH.unpack_from(self._map, offset)
+                offset += PATH.size
+
+                index = values[0]
+                if values[1] < 0:
+                    parent = pruned.get(index)
+                    if parent is None:
+                        parent = pruned[index] = CallPath(
+                            self.get_name_id(self.get_record(index)[8])
+                        )
+                else:
+                    parent = paths[values[1]]
+
+                path = parent.get_child(self.get_name_id(values[2]))
+                path.hits = values[3]
+                path.total_ns = values[4]
+                path.min_ns = _or_none(values[5])
+                path.max_ns = values[6]
+                path.estimated = values[7]
+                paths.append(path)
+
+                for _ in range(values[8]):
+                    exception, aggregate, offset = _unpack_aggregate(
+                        self._map,
+                        offset
+                    )
+                    if exception < 0:
+                        path.aggregate = aggregate
+                    else:
+                        if path.error_aggregates is None:
+                            path.error_aggregates = dict()
+                        path.error_aggregates[
+                            self.get_exception(exception)
+                        ] = aggregate
+
+            self._pruned = pruned
+
+        return self._pruned
+
+    def _add_pruned_aggregates(self, result):
+        """
+        Adds the aggregates of the calls pruned from under the timings to the
+        aggregates of the timings.
+
+        :param dict result: the aggregates, by name
+        """
+        paths = list(self._get_pruned().values())
+        while 0 < len(paths):
+            path = paths.pop()
+            if not path.has_children:
+                continue
+
+            for child in path.children:
+                paths.append(child)
+
+                aggregates = [(child.name, child.aggregate)]
+                if child.error_aggregates is not None:
+                    for exception, aggregate in child.error_aggregates.items():
+                        aggregates.append((
+                            _error_name(child.name, exception),
+                            aggregate
+                        ))
+
+                for name, aggregate in aggregates:
+                    if aggregate.hits == 0:
+                        continue
+
+                    merged = result.get(name)
+                    if merged is None:
+                        merged = result[name] = Aggregate()
+                    merged.merge(aggregate)
+
+    def get_call_tree(self):
+        """
+        Gets the calling context tree of this session.
+
+        :rtype: CallPath
+        """
+        return merge_timings(
+            self.root,
+            self.elapsed_nanoseconds,
+            self.sample_rate
+        )
+
+    def get_tracks(self):
+        """
+        Gets the timeline of this session for the exporters; threads are not
+        told apart in stored sessions.
+
+        :rtype: list of (str, list of StoredTiming)
+        """
+        root = self.root
+        return [(root.name, [root])]
+
+    def get_aggregates(self):
+        """
+        Aggregates the time spent in each step, excluding the time spent in
+        its children, by name, straight from the records; the same way
+        Profiler.get_aggregates does for the live session. The calls pruned
+        by min_save_ms are included.
+
+        :rtype: dict of name to Aggregate
+        """
+        if Settings.vectorized_reports:
+            result = self._get_vectorized_aggregates()
+            self._add_pruned_aggregates(result)
+            return result
+
+        aggregates = dict()
+        sample_rate = self.sample_rate
+        unpack_from = RECORD.unpack_from
+        offset = self._records_offset
+
+        for _ in range(self.record_count):
+            record = unpack_from(self._map, offset)
+            offset += RECORD.size
+
+            duration = record[3]
+            if duration == MISSING:
+                duration = 0
+            dm = max((duration - record[5]) / 1000000.0, 0.0)
+
+            if record[4] == MISSING:
+                cm = None
+            else:
+                cm = max((record[4] - record[6]) / 1000000.0, 0.0)
+
+            key = (record[8], record[9])
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregate = aggregates[key] = Aggregate()
+
+            aggregate.add(
+                dm,
+                cm,
+                _or_none(record[7]),
+                record[10] * sample_rate
+            )
+
+        result = dict()
+        for (name, exception), aggregate in aggregates.items():
+            if exception < 0:
+                result[self.get_string(name)] = aggregate
+            else:
+                result[_error_name(
+                    self.get_string(name),
+                    self.get_exception(exception)
+                )] = aggregate
+
+        self._add_pruned_aggregates(result)
+        return result
+
+    def _get_vectorized_aggregates(self):
+        from clocked import vectorized
+        if numpy is None:
+            raise Exception('numpy is not available')
+
+        records = numpy.frombuffer(
+            self._map,
+            dtype=numpy.dtype([
+                ('parent', '<i8'),
+                ('end', '<i8'),
+                ('start', '<i8'),
+                ('duration', '<i8'),
+                ('cpu_duration', '<i8'),
+                ('child', '<i8'),
+                ('child_cpu', '<i8'),
+                ('yields', '<i8'),
+                ('name', '<i4'),
+                ('exception', '<i4'),
+                ('sample_rate', '<u4')
+            ]),
+            count=self.record_count,
+            offset=self._records_offset
+        )
+
+        columns = vectorized.Columns()
+        columns.name_ids = records['name'].astype(numpy.int64)
+        columns.parents = records['parent']
+        columns.durations = records['duration']
+        columns.cpu_durations = records['cpu_duration']
+        columns.child_durations = records['child']
+        columns.child_cpu_durations = records['child_cpu']
+        columns.exception_ids = records['exception'].astype(numpy.int64) + 1
+        columns.yields = records['yields']
+        columns.sample_rates = records['sample_rate'].astype(numpy.int64)
+        columns.exceptions = _StoredExceptions(self)
+
+        return vectorized.aggregate_columns(
+            columns,
+            self.get_string,
+            self.sample_rate
+        )
+
+    def step_impl(self, name, min_save_ms=None,
+                  include_children_with_min_save=False, sample_rate=1):
+        """
+        Stored sessions are read only.
+        """
+        raise Exception('stored sessions are read only')
+
+    def suspendable_step(self, name, exclude_suspended=False, sample_rate=1):
+        """
+        Stored sessions are read only.
+        """
+        raise Exception('stored sessions are read only')
+
+    def freeze(self):
+        """
+        Stored sessions have already stopped.
+        """
+        return False
+
+    def stop_impl(self):
+        """
+        Stored sessions have already stopped.
+        """
+        return False
+
+
+class _StoredExceptions(object):
+    """
+    The exception types of a stored session, by string index, as a sequence.
+    """
+
+    __slots__ = ('profiler',)
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __len__(self):
+        return self.profiler.string_count
+
+    def __getitem__(self, index):
+        return self.profiler.get_exception(index)
+
+
+class StoredTiming(object):
+    """
+    A timing of a stored session, decoded from its record.
+    """
+
+    __slots__ = ('profiler', 'id', '_record')
+
+    def __init__(self, profiler, index, record):
+        """
+        :param StoredProfiler profiler: the stored session
+        :param int index: the timing's index in pre-order
+        :param tuple record: the timing's decoded record
+        """
+        self.profiler = profiler
+        self.id = index
+        self._record = record
+
+    @property
+    def parent_timing(self):
+        """
+        Gets the timing this one was called from; None for the root.
+        """
+        parent = self._record[0]
+        if parent < 0:
+            return None
+
+        return self.profiler.get_timing(parent)
+
+    @property
+    def name(self):
+        """
+        Gets the name of this step.
+        """
+        return self.profiler.get_string(self._record[8])
+
+    @property
+    def pruned(self):
+        """
+        Gets the calls pruned from under this step, merged by call path under
+        a CallPath standing for this step; None when none were.
+        """
+        return self.profiler._get_pruned().get(self.id)
+
+    @property
+    def name_id(self):
+        """
+        Gets the name registry id of this step's name.
+        """
+        return self.profiler.get_name_id(self._record[8])
+
+    @property
+    def start_ns(self):
+        """
+        Gets the offset, in nanoseconds, from the start of the session to the
+        start of this step.
+        """
+        return self._record[2]
+
+    @property
+    def start_milliseconds(self):
+        """
+        Gets the offset, in milliseconds, from the start of the session to
+        the start of this step.
+        """
+        return self._record[2] / 1000000.0
+
+    start = start_milliseconds
+
+    @property
+    def duration_ns(self):
+        """
+        Gets the duration of this step in nanoseconds; None if it was still
+        running.
+        """
+        return _or_none(self._record[3])
+
+    @property
+    def duration_milliseconds(self):
+        """
+        Gets the duration of this step in milliseconds; None if it was still
+        running.
+        """
+        if self._record[3] == MISSING:
+            return None
+
+        return self._record[3] / 1000000.0
+
+    @property
+    def cpu_duration_ns(self):
+        """
+        Gets the cpu time spent by this step in nanoseconds; None if it was
+        still running or cpu time was not captured.
+        """
+        return _or_none(self._record[4])
+
+    @property
+    def cpu_duration_milliseconds(self):
+        """
+        Gets the cpu time spent by this step in milliseconds; None if it was
+        still running or cpu time was not captured.
+        """
+        if self._record[4] == MISSING:
+            return None
+
+        return self._record[4] / 1000000.0
+
+    @property
+    def exception(self):
+        """
+        Gets a type standing in for the exception this step exited with, if
+        any.
+        """
+        if self._record[9] < 0:
+            return None
+
+        return self.profiler.get_exception(self._record[9])
+
+    @property
+    def yields(self):
+        """
+        Gets the number of items this step produced, for generators.
+        """
+        return _or_none(self._record[7])
+
+    @property
+    def sample_rate(self):
+        """
+        Gets the number of calls this step stands for, when sampled.
+        """
+        return self._record[10]
+
+    @property
+    def has_children(self):
+        """
+        Gets a value indicating whether this timing has inner timing steps.
+        """
+        return self.id + 1 < self._record[1]
+
+    @property
+    def children(self):
+        """
+        Gets the inner timing steps, decoding them; None when there are none.
+        """
+        if not self.has_children:
+            return None
+
+        children = []
+        index = self.id + 1
+        end = self._record[1]
+        while index < end:
+            child = self.profiler.get_timing(index)
+            children.append(child)
+            index = child._record[1]
+
+        return children
+
+    @property
+    def child_ns(self):
+        """
+        Gets the time of the children that stopped, pruned ones included.
+        """
+        return self._record[5]
+
+    @property
+    def child_cpu_ns(self):
+        """
+        Gets the cpu time of the children that stopped.
+        """
+        return self._record[6]
+
+    @property
+    def is_root(self):
+        """
+        Gets a value indicating whether this timing is the session's root.
+        """
+        return self.id == 0
+
+    def duration_without_children_milliseconds(self):
+        """
+        Gets the elapsed milliseconds in this step without any children's
+        durations.
+        """
+        result = self._record[3]
+        if result == MISSING:
+            result = 0
+
+        return (result - self._record[5]) / 1000000.0
+
+    def cpu_without_children_milliseconds(self):
+        """
+        Gets the cpu milliseconds spent in this step without any children's
+        cpu time; None when cpu time was not captured.
+        """
+        if self._record[4] == MISSING:
+            return None
+
+        return (self._record[4] - self._record[6]) / 1000000.0
+
+    def depth(self):
+        """
+        Gets a value indicating how far away this timing is from the root.
+        """
+        result = 0
+        parent = self._record[0]
+
+        while 0 <= parent:
+            parent = self.profiler.get_record(parent)[0]
+            result += 1
+
+        return result
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, StoredTiming) and
+            self.id == other.id and
+            self.profiler is other.profiler
+        )
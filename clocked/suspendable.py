@@ -0,0 +1,237 @@
+"""
+Timing for code that suspends and resumes, such as generators and coroutines.
+"""
+
+
+import sys
+
+
+class SuspendableStep(object):
+    """
+    A single profiling step spanning every resumption of a generator or
+    coroutine.
+
+    While suspended the step is not the profiler's head, so whatever runs in
+    between (other tasks, the generator's consumer) does not nest under it.
+    The thread's cpu time spent while suspended is never counted, and the wall
+    time is left out too when exclude_suspended is set.
+    """
+
+    __slots__ = ('profiler', 'name', 'exclude_suspended', 'sample_rate',
+                 'timing', '_suspended_ns', '_suspended_cpu_ns')
+
+    def __init__(self, profiler, name, exclude_suspended=False,
+                 sample_rate=1):
+        """
+        :param Profiler profiler: the profiler to record the step in
+        :param name: the step name, or its id
+        :param bool exclude_suspended: whether to leave out the wall time
+         spent suspended
+        :param int sample_rate: the number of calls the step stands for, when
+         only 1 in sample_rate calls is timed
+        """
+        self.profiler = profiler
+        self.name = name
+        self.exclude_suspended = exclude_suspended
+        self.sample_rate = sample_rate
+        self.timing = None
+        self._suspended_ns = None
+        self._suspended_cpu_ns = None
+
+    @property
+    def is_started(self):
+        """
+        Gets a value indicating whether this step was resumed at least once.
+        """
+        return self.timing is not None
+
+    @property
+    def is_stopped(self):
+        """
+        Gets a value indicating whether this step has completed.
+        """
+        return self.timing is not None and self.timing.duration_ns is not None
+
+    def count_yield(self):
+        """
+        Counts an item produced by this step.
+        """
+        timing = self.timing
+        if timing.yields is None:
+            timing.yields = 1
+        else:
+            timing.yields += 1
+
+    def resume(self):
+        """
+        Makes this step the profiler's head, starting its timing on the first
+        resumption.
+
+        :returns: the previous head, to restore when suspending or stopping
+        """
+        profiler = self.profiler
+        saved = profiler.head
+        timing = self.timing
+
+        if timing is None:
+            self.timing = profiler.step_impl(
+                self.name,
+                sample_rate=self.sample_rate
+            )
+            return saved
+
+        profiler.head = timing
+
+        # shift the start forward so the suspension is not counted
+        if timing.cpu_start_ns is not None:
+            timing.cpu_start_ns += \
+                profiler.cpu_clock() - self._suspended_cpu_ns
+        if self.exclude_suspended:
+            timing.start_ns += \
+                profiler.elapsed_nanoseconds - self._suspended_ns
+
+        return saved
+
+    def suspend(self, saved):
+        """
+        Suspends this step, restoring the head that was current before it was
+        resumed.
+
+        :param Timing saved: the head returned by resume
+        """
+        profiler = self.profiler
+        if self.exclude_suspended:
+            self._suspended_ns = profiler.elapsed_nanoseconds
+        if self.timing.cpu_start_ns is not None:
+            self._suspended_cpu_ns = profiler.cpu_clock()
+
+        profiler.head = saved
+
+    def stop(self, saved, exception=None):
+        """
+        Completes this step, restoring the head that was current before it was
+        resumed.
+
+        :param Timing saved: the head returned by resume
+        :param type exception: the type of the exception the step exited
+         with, if any
+        """
+        self.timing.stop(exception)
+        self.profiler.head = saved
+
+
+class TimedResumptions(object):
+    """
+    Drives a generator-like object (anything with send, throw and close),
+    timing each of its resumptions as part of a SuspendableStep.
+
+    The step completes when the object raises `finished`. Any other
+    StopIteration (an async generator producing an item) only suspends the
+    step, and any other exception completes it tagged with that exception.
+    Items produced are counted in the timing's yields.
+    """
+
+    __slots__ = ('_step', '_target', '_finished', '_yields_on_return')
+
+    def __init__(self, step, target, finished=StopIteration,
+                 yields_on_return=False):
+        """
+        :param SuspendableStep step: the step to time the resumptions in
+        :param target: the generator-like object to drive
+        :param type finished: the exception signalling that target completed
+        :param bool yields_on_return: whether the values returned by target
+         are items produced (generators) rather than awaited futures
+         (coroutines)
+        """
+        self._step = step
+        self._target = target
+        self._finished = finished
+        self._yields_on_return = yields_on_return
+
+    def __iter__(self):
+        return self
+
+    def __await__(self):
+        return self
+
+    def __next__(self):
+        return self._resume(self._target.send, None)
+
+    next = __next__
+
+    def send(self, value):
+        """
+        Resumes the target, sending it a value.
+
+        :param value: the value to send
+        """
+        return self._resume(self._target.send, value)
+
+    def throw(self, *args):
+        """
+        Resumes the target, raising an exception inside of it.
+        """
+        return self._resume(self._target.throw, *args)
+
+    def close(self):
+        """
+        Closes the target, completing the step if it was started.
+        """
+        step = self._step
+        if not step.is_started or step.is_stopped:
+            return self._target.close()
+
+        saved = step.resume()
+        try:
+            ret = self._target.close()
+        except BaseException:
+            step.stop(saved, sys.exc_info()[0])
+            raise
+
+        step.stop(saved)
+        return ret
+
+    def _resume(self, method, *args):
+        step = self._step
+        saved = step.resume()
+        try:
+            ret = method(*args)
+        except BaseException:
+            _type = sys.exc_info()[0]
+            if issubclass(_type, self._finished):
+                step.stop(saved)
+            elif issubclass(_type, StopIteration):
+                step.count_yield()
+                step.suspend(saved)
+            else:
+                step.stop(saved, _type)
+            raise
+
+        if self._yields_on_return:
+            step.count_yield()
+        step.suspend(saved)
+        return ret
+
+
+class TimedGenerator(TimedResumptions):
+    """
+    Drives a generator, timing all of its resumptions as one step and
+    counting the items it produces.
+
+    A generator abandoned before it is exhausted (e.g. by breaking out of a
+    loop) is closed when it is garbage collected, which completes its step.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, step, generator):
+        super(TimedGenerator, self).__init__(
+            step,
+            generator,
+            yields_on_return=True
+        )
+
+    def __del__(self):
+        step = self._step
+        if step.is_started and not step.is_stopped:
+            self.close()
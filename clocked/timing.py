@@ -3,20 +3,21 @@ An individual profiling step that can contain child steps.
 """
 
 
-import cuuid
+from clocked import names
 
 
 class Timing(object):
     """ An individual profiling step that can contain child steps. """
 
-    __slots__ = ('id', 'parent_timing', 'profiler', 'parent', 'name', 'start',
+    __slots__ = ('id', 'parent_timing', 'profiler', 'parent', 'name_id',
                  'min_save_ms', 'include', 'include_children_with_min_save',
-                 'start_milliseconds', 'children', 'custom_timings',
-                 'duration_milliseconds')
+                 'start_ns', 'children', 'custom_timings', 'duration_ns',
+                 'cpu_start_ns', 'cpu_duration_ns', 'exception', 'yields',
+                 'sample_rate', 'child_ns', 'child_cpu_ns', 'pruned')
 
     def __init__(self, profiler, parent, name, min_save_ms=None,
-                 include_children_with_min_save=False):
-        self.id = cuuid.uuid1()
+                 include_children_with_min_save=False, sample_rate=1):
+        self.id = next(profiler.timing_ids)
         self.parent_timing = None
         self.profiler = profiler
         self.profiler.head = self
@@ -25,14 +26,68 @@ class Timing(object):
             # root will have no parent
             parent.add_child(self)
 
-        self.name = name
-        self.start = profiler.elapsed_milliseconds
+        self.name_id = names.to_id(name)
         self.min_save_ms = min_save_ms
         self.include_children_with_min_save = include_children_with_min_save
-        self.start_milliseconds = self.start
         self.children = None
         self.custom_timings = None
-        self.duration_milliseconds = None
+        self.duration_ns = None
+        self.cpu_duration_ns = None
+        self.exception = None
+        self.yields = None
+        # the number of calls this step stands for, when sampled
+        self.sample_rate = sample_rate
+        # the time of the children that stopped (pruned ones included), kept
+        # up to date as they stop
+        self.child_ns = 0
+        self.child_cpu_ns = 0
+        # the calls pruned from under this step (see min_save_ms), merged by
+        # call path under a CallPath standing for this step
+        self.pruned = None
+
+        cpu_clock = profiler.cpu_clock
+        self.cpu_start_ns = None if cpu_clock is None else cpu_clock()
+        self.start_ns = profiler.elapsed_nanoseconds
+
+    @property
+    def name(self):
+        """
+        Gets the name of this step.
+        """
+        return names.get_name(self.name_id)
+
+    @property
+    def start_milliseconds(self):
+        """
+        Gets the offset, in milliseconds, from the start of the session to
+        the start of this step.
+        """
+        return self.start_ns / 1000000.0
+
+    start = start_milliseconds
+
+    @property
+    def duration_milliseconds(self):
+        """
+        Gets the duration of this step in milliseconds; None while it is
+        still running.
+        """
+        if self.duration_ns is None:
+            return None
+
+        return self.duration_ns / 1000000.0
+
+    @property
+    def cpu_duration_milliseconds(self):
+        """
+        Gets the cpu time spent by the thread running this step in
+        milliseconds; None while it is still running or when cpu time is not
+        being captured.
+        """
+        if self.cpu_duration_ns is None:
+            return None
+
+        return self.cpu_duration_ns / 1000000.0
 
     def has_custom_timings(self):
         """
@@ -65,22 +120,25 @@ class Timing(object):
 
     def duration_without_children_milliseconds(self):
         """
-        Gets the elapsed milliseconds in this step without any children's
-        durations.
+        Gets the elapsed milliseconds in this step without the durations of
+        the children that stopped, unrounded.
         """
-        result = self.duration_milliseconds
+        result = self.duration_ns
         if result is None:
-            result = 0.0
+            result = 0
 
-        if self.has_children:
-            for child in self.children:
-                cm = child.duration_milliseconds
-                if cm is None:
-                    cm = 0.0
+        return (result - self.child_ns) / 1000000.0
 
-                result -= cm
+    def cpu_without_children_milliseconds(self):
+        """
+        Gets the cpu milliseconds spent in this step without the cpu time of
+        the children that stopped, unrounded; None when cpu time is not being
+        captured.
+        """
+        if self.cpu_duration_ns is None:
+            return None
 
-        return round(result, 1)
+        return (self.cpu_duration_ns - self.child_cpu_ns) / 1000000.0
 
     def depth(self):
         """
@@ -100,30 +158,60 @@ class Timing(object):
         return self.name
 
     def __eq__(self, other):
-        return isinstance(other, Timing) and self.id == other.id
+        return (
+            isinstance(other, Timing) and
+            self.id == other.id and
+            self.profiler is other.profiler
+        )
 
-    def stop(self):
+    def stop(self, exception=None):
         """
         Completes this Timing's duration and sets the head up one level.
+
+        :param type exception: the type of the exception the step exited
+         with, if any
         """
-        if self.duration_milliseconds is not None:
+        # stopped exactly once, whether by its own thread or by stop_impl,
+        # and added to the parent's totals under the same lock, as children
+        # of the same parent may stop on several threads at once
+        lock = self.profiler.stop_lock
+        lock.acquire()
+        if self.duration_ns is not None:
+            lock.release()
             return
 
-        self.duration_milliseconds = self.profiler.get_duration_milliseconds(
-            self.start_milliseconds
+        self.duration_ns = self.profiler.get_duration_nanoseconds(
+            self.start_ns
         )
+        if self.cpu_start_ns is not None:
+            self.cpu_duration_ns = self.profiler.cpu_clock() - \
+                self.cpu_start_ns
 
-        self.profiler.head = self.parent_timing
-
-        has_msm = self.min_save_ms is not None and self.min_save_ms > 0
-        if has_msm and self.parent_timing is not None:
-            if self.include_children_with_min_save:
-                compare_ms = self.duration_milliseconds
-            else:
-                compare_ms = self.duration_without_children_milliseconds()
+        parent = self.parent_timing
+        if parent is not None:
+            parent.child_ns += self.duration_ns
+            if self.cpu_duration_ns is not None:
+                parent.child_cpu_ns += self.cpu_duration_ns
+        lock.release()
 
-            if compare_ms < self.min_save_ms:
-                self.parent_timing.remove_child(self)
+        self.exception = exception
+        self.profiler.head = parent
+        if parent is not None:
+            has_msm = self.min_save_ms is not None and self.min_save_ms > 0
+            if has_msm:
+                if self.include_children_with_min_save:
+                    compare_ms = self.duration_ns / 1000000.0
+                else:
+                    compare_ms = self.duration_without_children_milliseconds()
+
+                if compare_ms < self.min_save_ms:
+                    self.profiler.prune_timing(self)
+                    return
+
+        # indexed by name once it stopped and is kept, for Clocked.get, which
+        # finds the steps still running through the head; setdefault is a
+        # single call, so a step stopping on another thread is never lost
+        self.profiler.name_index.setdefault(self.name_id, []).append(self)
 
     def add_child(self, timing):
         """
@@ -143,8 +231,15 @@ class Timing(object):
 
         :param Timing timing: the timing to remove
         """
-        if self.children is not None:
-            self.children.remove(timing)
+        children = self.children
+        if children is None:
+            return
+
+        # the timing removed is usually the one added last, popped in O(1)
+        for i in range(len(children) - 1, -1, -1):
+            if children[i] is timing:
+                del children[i]
+                return
 
     def add_custom_timing(self, category, custom_timing):
         """
@@ -0,0 +1,286 @@
+"""
+A report engine for very large Timing hierarchies, which flattens the
+hierarchy into columns and aggregates them with NumPy.
+
+Requires numpy, and is only used when Settings.vectorized_reports is on.
+"""
+
+
+from array import array
+from clocked import names
+from clocked.aggregate import Aggregate
+from clocked.events import _TYPECODE
+from clocked.histogram import _SUB_BUCKET_COUNT, _SUB_BUCKET_HALF, \
+    SUB_BUCKET_BITS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# marks the values that are None in a column
+MISSING = -(1 << 63)
+
+
+class Columns(object):
+    """
+    A Timing hierarchy flattened into columns, one row per timing in
+    pre-order (the order the hierarchy is walked in by the reports).
+    """
+
+    __slots__ = ('name_ids', 'parents', 'durations', 'cpu_durations',
+                 'child_durations', 'child_cpu_durations', 'exception_ids',
+                 'yields', 'sample_rates', 'exceptions')
+
+    def __init__(self):
+        self.name_ids = array(_TYPECODE)
+        self.parents = array(_TYPECODE)
+        self.durations = array(_TYPECODE)
+        self.cpu_durations = array(_TYPECODE)
+        # the time of each timing's children that stopped
+        self.child_durations = array(_TYPECODE)
+        self.child_cpu_durations = array(_TYPECODE)
+        self.exception_ids = array(_TYPECODE)
+        self.yields = array(_TYPECODE)
+        self.sample_rates = array(_TYPECODE)
+        # the exception types, where an exception id of i refers to
+        # exceptions[i - 1]
+        self.exceptions = []
+
+
+def flatten(root):
+    """
+    Flattens a Timing hierarchy into columns, without recursing.
+
+    :param Timing root: the root of the hierarchy
+    :rtype: Columns
+    """
+    columns = Columns()
+    exception_ids = {None: 0}
+
+    name_ids = columns.name_ids.append
+    parents = columns.parents.append
+    durations = columns.durations.append
+    cpu_durations = columns.cpu_durations.append
+    child_durations = columns.child_durations.append
+    child_cpu_durations = columns.child_cpu_durations.append
+    exceptions = columns.exception_ids.append
+    yields = columns.yields.append
+    sample_rates = columns.sample_rates.append
+
+    index = 0
+    timings = [(root, -1)]
+    pop = timings.pop
+    while timings:
+        timing, parent = pop()
+
+        name_ids(timing.name_id)
+        parents(parent)
+        duration = timing.duration_ns
+        durations(MISSING if duration is None else duration)
+        cpu_duration = timing.cpu_duration_ns
+        cpu_durations(MISSING if cpu_duration is None else cpu_duration)
+        count = timing.yields
+        yields(MISSING if count is None else count)
+        sample_rates(timing.sample_rate)
+
+        exception_id = exception_ids.get(timing.exception)
+        if exception_id is None:
+            columns.exceptions.append(timing.exception)
+            exception_id = len(columns.exceptions)
+            exception_ids[timing.exception] = exception_id
+        exceptions(exception_id)
+
+        child_durations(timing.child_ns)
+        child_cpu_durations(timing.child_cpu_ns)
+
+        children = timing.children
+        if children:
+            # reversed, so the children are popped in order
+            timings.extend([(i, index) for i in reversed(children)])
+
+        index += 1
+
+    return columns
+
+
+def _self_time(column, children):
+    """
+    Gets each timing's value minus its children's, in milliseconds, the way
+    Timing.duration_without_children_milliseconds computes it, clamped at 0
+    the way the reports do.
+
+    :param numpy.ndarray column: the timings' values, with MISSING for None
+    :param numpy.ndarray children: the sum of each timing's children's values
+    :returns: the self times (taking None values as 0) and whether each
+     value is present
+    """
+    present = column != MISSING
+    values = numpy.where(present, column, 0)
+
+    ms = (values - children) / 1000000.0
+    return numpy.where(ms < 0, 0.0, ms), present
+
+
+def get_aggregates(root, sample_rate=1):
+    """
+    Aggregates the time spent in each step, excluding the time spent in its
+    children, by name, giving the same Aggregates (in the same order) as
+    Profiler.get_aggregates.
+
+    :param Timing root: the root of the hierarchy
+    :param int sample_rate: the number of sessions the hierarchy stands for
+    :rtype: dict of name to Aggregate
+    """
+    if numpy is None:
+        raise Exception('numpy is not available')
+
+    return aggregate_columns(flatten(root), names.get_name, sample_rate)
+
+
+def aggregate_columns(columns, get_name, sample_rate=1):
+    """
+    Aggregates the time spent in each step, excluding the time spent in its
+    children, by name, from a hierarchy flattened in pre-order.
+
+    :param columns: the Columns, or any object with the same attributes
+     holding sequences or arrays
+    :param func get_name: gets the name of a step from its name id
+    :param int sample_rate: the number of sessions the hierarchy stands for
+    :rtype: dict of name to Aggregate
+    """
+    if numpy is None:
+        raise Exception('numpy is not available')
+
+    count = len(columns.name_ids)
+    name_ids = numpy.asarray(columns.name_ids, dtype=numpy.int64)
+    durations = numpy.asarray(columns.durations, dtype=numpy.int64)
+    cpu_durations = numpy.asarray(columns.cpu_durations, dtype=numpy.int64)
+    child_durations = numpy.asarray(
+        columns.child_durations,
+        dtype=numpy.int64
+    )
+    child_cpu_durations = numpy.asarray(
+        columns.child_cpu_durations,
+        dtype=numpy.int64
+    )
+    exception_ids = numpy.asarray(columns.exception_ids, dtype=numpy.int64)
+    yields = numpy.asarray(columns.yields, dtype=numpy.int64)
+    rates = numpy.asarray(columns.sample_rates, dtype=numpy.int64) * \
+        sample_rate
+
+    ms, _ = _self_time(durations, child_durations)
+    cpu_ms, has_cpu = _self_time(cpu_durations, child_cpu_durations)
+
+    # group by name, and by exception for the timings that raised, with the
+    # groups in the order they first appear
+    keys = name_ids * (len(columns.exceptions) + 1) + exception_ids
+    _, first, inverse = numpy.unique(
+        keys,
+        return_index=True,
+        return_inverse=True
+    )
+    inverse = inverse.reshape(-1)
+    order = numpy.argsort(first, kind='stable')
+    groups = len(first)
+
+    hits = numpy.zeros(groups, dtype=numpy.int64)
+    numpy.add.at(hits, inverse, rates)
+
+    # numpy.add.at adds in row order, as the reports do
+    totals = numpy.zeros(groups)
+    numpy.add.at(totals, inverse, ms * rates)
+
+    # the min is the first timing with the lowest value (-0.0 and 0.0 being
+    # equal), while the max starts at 0.0
+    lowest = numpy.full(groups, numpy.inf)
+    numpy.minimum.at(lowest, inverse, ms)
+    rows = numpy.arange(count)
+    is_lowest = ms == lowest[inverse]
+    first_lowest = numpy.full(groups, count)
+    numpy.minimum.at(first_lowest, inverse[is_lowest], rows[is_lowest])
+    mins = ms[first_lowest]
+
+    highest = numpy.zeros(groups)
+    numpy.maximum.at(highest, inverse, ms)
+    maxes = numpy.where(0 < highest, highest, 0.0)
+
+    # -0.0 is the identity of addition, so the sums keep the sign of a lone
+    # -0.0 the way starting from the first value does
+    cpu_totals = numpy.full(groups, -0.0)
+    numpy.add.at(cpu_totals, inverse[has_cpu], (cpu_ms * rates)[has_cpu])
+    cpu_counts = numpy.bincount(inverse[has_cpu], minlength=groups)
+
+    has_yields = yields != MISSING
+    yield_totals = numpy.zeros(groups, dtype=numpy.int64)
+    numpy.add.at(
+        yield_totals,
+        inverse[has_yields],
+        (yields * rates)[has_yields]
+    )
+    yield_counts = numpy.bincount(inverse[has_yields], minlength=groups)
+
+    estimated = numpy.bincount(inverse[rates != 1], minlength=groups)
+
+    histograms = _histogram_counts(ms, rates, inverse, groups)
+
+    aggregates = dict()
+    for group in order:
+        row = first[group]
+        name = get_name(int(name_ids[row]))
+        exception_id = int(exception_ids[row])
+        if exception_id != 0:
+            name = '{} [raised {}]'.format(
+                name,
+                columns.exceptions[exception_id - 1].__name__
+            )
+
+        aggregate = Aggregate()
+        aggregate.hits = int(hits[group])
+        aggregate.total_ms = float(totals[group])
+        aggregate.min_ms = float(mins[group])
+        aggregate.max_ms = float(maxes[group])
+        if cpu_counts[group]:
+            aggregate.cpu_ms = float(cpu_totals[group])
+        if yield_counts[group]:
+            aggregate.yields = int(yield_totals[group])
+        aggregate.estimated = bool(estimated[group])
+
+        histogram = aggregate.histogram
+        histogram.counts = histograms[group]
+        histogram.count = aggregate.hits
+        aggregates[name] = aggregate
+
+    return aggregates
+
+
+def _histogram_counts(ms, rates, inverse, groups):
+    """
+    Counts each timing into the Histogram bucket it is recorded in.
+
+    :returns: the counts by bucket index of each group
+    :rtype: list of dict
+    """
+    values = (ms * 1000000.0).astype(numpy.int64)
+
+    # the bit length of values below 2 ** 53, which floats hold exactly
+    bit_lengths = numpy.frexp(values.astype(numpy.float64))[1]
+    shifts = numpy.maximum(bit_lengths - SUB_BUCKET_BITS, 0)
+    buckets = numpy.where(
+        values < _SUB_BUCKET_COUNT,
+        values,
+        shifts * _SUB_BUCKET_HALF + (values >> shifts)
+    )
+
+    width = int(buckets.max()) + 1
+    keys = inverse * width + buckets
+    unique, positions = numpy.unique(keys, return_inverse=True)
+    counts = numpy.zeros(len(unique), dtype=numpy.int64)
+    numpy.add.at(counts, positions.reshape(-1), rates)
+
+    result = [dict() for _ in range(groups)]
+    for key, bucket_count in zip(unique.tolist(), counts.tolist()):
+        result[key // width][key % width] = bucket_count
+
+    return result
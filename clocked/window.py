@@ -0,0 +1,125 @@
+"""
+Rolling-window aggregates, answering what is hot right now in a session that
+runs for as long as the service does.
+"""
+
+
+import math
+from clocked.aggregate import Aggregate
+from clocked.call_tree import CallFrame
+
+
+class RollingAggregates(object):
+    """
+    Aggregates by name kept in a ring of time buckets, e.g. 90 buckets of 10
+    seconds for the last 15 minutes.
+
+    Each bucket aggregates the steps that stopped during its interval. A
+    bucket is reused once the ring comes back around to it, evicting what it
+    held, so memory is bounded by the number of buckets and distinct names
+    whatever the number of calls. Windows are made of whole buckets, the
+    current (partial) one included.
+    """
+
+    __slots__ = ('bucket_ns', 'epochs', 'buckets')
+
+    def __init__(self, window_seconds, bucket_seconds):
+        """
+        :param float window_seconds: the longest window that can be asked for
+        :param float bucket_seconds: the interval of each bucket
+        """
+        count = int(math.ceil(window_seconds / float(bucket_seconds)))
+        self.bucket_ns = int(bucket_seconds * 1000000000)
+        # the interval each bucket holds, counted in buckets since the start
+        self.epochs = [None] * count
+        self.buckets = [None] * count
+
+    def add(self, now_ns, key, ms, cpu_ms=None, yields=None, sample_rate=1):
+        """
+        Adds a timing to the current bucket, evicting the bucket's previous
+        interval when the ring came back around to it.
+
+        :param int now_ns: the session's elapsed nanoseconds
+        :param key: the name id, or (name id, exception) for errors
+        :param float ms: the time spent in the step itself
+        :param float cpu_ms: the cpu time spent in the step itself, if
+         captured
+        :param int yields: the number of items produced, for generators
+        :param int sample_rate: the number of calls the timing stands for
+        """
+        epoch = now_ns // self.bucket_ns
+        slot = epoch % len(self.buckets)
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            self.buckets[slot] = dict()
+
+        bucket = self.buckets[slot]
+        aggregate = bucket.get(key)
+        if aggregate is None:
+            aggregate = bucket[key] = Aggregate()
+
+        aggregate.add(ms, cpu_ms, yields, sample_rate)
+
+    def get_aggregates(self, now_ns, seconds):
+        """
+        Merges the buckets of the last seconds.
+
+        :param int now_ns: the session's elapsed nanoseconds
+        :param float seconds: the length of the window, up to the window the
+         ring was made for
+        :rtype: dict of key to Aggregate
+        """
+        epoch = now_ns // self.bucket_ns
+        count = int(math.ceil(seconds * 1000000000 / self.bucket_ns))
+        count = max(min(count, len(self.buckets)), 1)
+
+        aggregates = dict()
+        for i in range(epoch - count + 1, epoch + 1):
+            slot = i % len(self.buckets)
+            if self.epochs[slot] != i:
+                continue
+
+            for key, aggregate in self.buckets[slot].items():
+                merged = aggregates.get(key)
+                if merged is None:
+                    merged = aggregates[key] = Aggregate()
+                merged.merge(aggregate)
+
+        return aggregates
+
+
+class WindowedCallFrame(CallFrame):
+    """
+    A CallFrame that also adds its call to the profiler's rolling window when
+    it stops.
+    """
+
+    __slots__ = ()
+
+    def stop(self, exception=None):
+        """
+        Completes this call, records it into its path and into the current
+        bucket of the rolling window, and sets the head up one level.
+
+        :param type exception: the type of the exception the step exited
+         with, if any
+        """
+        if not super(WindowedCallFrame, self).stop(exception):
+            return
+
+        if self.cpu_duration_ns is None:
+            cpu_ms = None
+        else:
+            cpu_ms = max(self.cpu_duration_ns - self.child_cpu_ns, 0) / \
+                1000000.0
+
+        profiler = self.profiler
+        name_id = self.node.name_id
+        profiler.window.add(
+            self.start_ns + self.duration_ns,
+            name_id if exception is None else (name_id, exception),
+            max(self.duration_ns - self.child_ns, 0) / 1000000.0,
+            cpu_ms,
+            self.yields,
+            self.sample_rate * profiler.sample_rate
+        )
@@ -0,0 +1,177 @@
+""" Tests for clocked's asyncio support. """
+
+
+import asyncio
+import inspect
+import unittest
+from clocked.clockit import Clocked
+from clocked.decorators import clocked
+from clocked.profiler import Profiler
+from clocked.profiler_provider import ContextProfilerProvider
+from clocked.settings import Settings
+
+
+# noinspection PyDocstring
+class TestAsync(unittest.TestCase):
+
+    def _assert(self, mini, val, maxi):
+        self.assertTrue(
+            mini <= val <= maxi,
+            '{} <= {} <= {} is not true'.format(
+                mini,
+                val,
+                maxi
+            )
+        )
+
+    def test_coroutine(self):
+        @clocked
+        async def delay():
+            await asyncio.sleep(.02)
+            return 'done'
+
+        Clocked.initialize('test coroutine')
+        self.assertEqual('done', asyncio.run(delay()))
+
+        t = [i for i in Clocked.get('.*delay.*')]
+        self.assertEqual(1, len(t))
+        self._assert(20-2, t[0].duration_milliseconds, 20+5)
+        self.assertTrue(Profiler.current().head.is_root)
+
+    def test_exclude_suspended(self):
+        @clocked(exclude_suspended=True)
+        async def delay():
+            await asyncio.sleep(.02)
+
+        Clocked.initialize('test exclude suspended')
+        asyncio.run(delay())
+
+        t = [i for i in Clocked.get('.*delay.*')][0]
+        self._assert(0, t.duration_milliseconds, 5)
+
+    def test_interleaved_tasks(self):
+        @clocked
+        def inner():
+            pass
+
+        @clocked
+        async def outer(delay):
+            await asyncio.sleep(delay)
+            inner()
+            await asyncio.sleep(delay)
+            inner()
+
+        async def main():
+            await asyncio.gather(outer(.01), outer(.015))
+
+        Clocked.initialize('test interleaved tasks')
+        asyncio.run(main())
+
+        root = Profiler.current().root
+        self.assertEqual(2, len(root.children))
+        for timing in root.children:
+            self.assertTrue(timing.name.split(':')[0].endswith('outer'))
+            self.assertEqual(2, len(timing.children))
+            for child in timing.children:
+                self.assertTrue(child.name.split(':')[0].endswith('inner'))
+
+    def test_raise(self):
+        @clocked
+        async def raises():
+            await asyncio.sleep(0)
+            raise ValueError('some value error')
+
+        Clocked.initialize('test raise')
+        self.assertRaises(ValueError, asyncio.run, raises())
+
+        t = [i for i in Clocked.get('.*raises.*')][0]
+        self.assertIs(ValueError, t.exception)
+        self.assertTrue(Profiler.current().head.is_root)
+
+    def test_async_generator(self):
+        @clocked
+        async def produce():
+            for i in range(3):
+                await asyncio.sleep(.01)
+                yield i
+
+        async def consume():
+            items = []
+            async for item in produce():
+                with Clocked('consume'):
+                    items.append(item)
+            return items
+
+        Clocked.initialize('test async generator')
+        self.assertEqual([0, 1, 2], asyncio.run(consume()))
+
+        root = Profiler.current().root
+        self.assertEqual(
+            ['produce', 'consume', 'consume', 'consume'],
+            [i.name.split(':')[0].split('.')[-1] for i in root.children]
+        )
+        self._assert(30-2, root.children[0].duration_milliseconds, 30+10)
+
+    def test_enabled(self):
+        Settings.enabled = False
+        try:
+            async def delay():
+                await asyncio.sleep(.01)
+                return 'done'
+
+            async def items():
+                for i in range(3):
+                    await asyncio.sleep(0)
+                    yield i
+
+            clocked(delay)
+            clocked(items)
+
+            async def consume():
+                return [i async for i in items()]
+
+            Clocked.initialize('test enabled')
+            Settings.enable()
+            self.assertTrue(asyncio.iscoroutinefunction(delay))
+            self.assertTrue(inspect.iscoroutinefunction(delay))
+            self.assertTrue(inspect.isasyncgenfunction(items))
+            self.assertEqual('done', asyncio.run(delay()))
+            self.assertEqual([0, 1, 2], asyncio.run(consume()))
+        finally:
+            Settings.disable()
+            Settings.enabled = True
+
+        timings = Profiler.current().root.children
+        self.assertEqual(2, len(timings))
+        self.assertTrue('.delay:' in timings[0].name)
+        self.assertTrue('.items:' in timings[1].name)
+        self.assertEqual(3, timings[1].yields)
+
+    def test_async_with(self):
+        provider = Settings.profiler_provider
+        Settings.profiler_provider = ContextProfilerProvider()
+        try:
+            async def task(name):
+                async with Clocked(name):
+                    await asyncio.sleep(.01)
+                    with Clocked(name + ' child'):
+                        pass
+
+            async def main():
+                Clocked.initialize('test async with')
+                await asyncio.gather(task('a'), task('b'))
+                return Profiler.current()
+
+            profiler = asyncio.run(main())
+        finally:
+            Settings.profiler_provider = provider
+
+        self.assertEqual(
+            ['a', 'b'],
+            [i.name for i in profiler.root.children]
+        )
+        for timing in profiler.root.children:
+            self.assertEqual(
+                [timing.name + ' child'],
+                [i.name for i in timing.children]
+            )
@@ -2,12 +2,32 @@
 
 
 from time import sleep
+import inspect
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import threading
 import unittest
 
 
 # noinspection PyDocstring
 from clocked.clockit import Clocked
 from clocked.decorators import clocked
+from clocked import decorators, export, names
+from clocked.histogram import Histogram
+from clocked.profiler import Profiler
+from clocked.reporter import BackgroundReporter, export_handler, \
+    hotspot_handler
+from clocked.snapshot import merge_snapshots
+from clocked.profiler_provider import contextvars, \
+    ContextProfilerProvider, ThreadLocalProfilerProvider
+from clocked.settings import Settings
+from clocked.stopwatch import ProcessTimeStopWatch, StopWatch, \
+    thread_time_ns
+from clocked.vectorized import numpy
 
 
 class TestClocked(unittest.TestCase):
@@ -182,3 +202,1808 @@ class TestDecorators(unittest.TestCase):
         @staticmethod
         def delay_method():
             sleep(.02)
+
+
+# noinspection PyDocstring
+class TestProfilerProviders(unittest.TestCase):
+
+    def setUp(self):
+        self._provider = Settings.profiler_provider
+
+    def tearDown(self):
+        Settings.profiler_provider = self._provider
+
+    def test_thread_local(self):
+        Settings.profiler_provider = ThreadLocalProfilerProvider()
+        results = dict()
+
+        def work(name):
+            Clocked.initialize(name)
+            for _ in range(50):
+                with Clocked(name + ' outer'):
+                    with Clocked(name + ' inner'):
+                        pass
+            results[name] = Profiler.current()
+
+        threads = [
+            threading.Thread(target=work, args=('t{}'.format(i),))
+            for i in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(4, len(set(id(p) for p in results.values())))
+        for name, profiler in results.items():
+            self.assertEqual(name, profiler.root.name)
+            self.assertEqual(50, len(profiler.root.children))
+            for outer in profiler.root.children:
+                self.assertEqual(name + ' outer', outer.name)
+                self.assertEqual(
+                    [name + ' inner'],
+                    [c.name for c in outer.children]
+                )
+
+        self.assertIsNone(Profiler.current())
+
+    @unittest.skipIf(contextvars is None, 'requires contextvars')
+    def test_context(self):
+        Settings.profiler_provider = ContextProfilerProvider()
+        Clocked.initialize('context')
+        profiler = Profiler.current()
+
+        with Clocked('shared parent'):
+            def task(name):
+                with Clocked(name):
+                    with Clocked(name + ' child'):
+                        pass
+
+            # each context steps independently within the same session
+            a = contextvars.copy_context()
+            b = contextvars.copy_context()
+            a.run(Clocked('a').__enter__)
+            b.run(Clocked('b').__enter__)
+            a.run(task, 'a task')
+            b.run(task, 'b task')
+            a.run(lambda: profiler.head.stop())
+            b.run(lambda: profiler.head.stop())
+
+        parent = profiler.root.children[0]
+        self.assertEqual('shared parent', parent.name)
+        self.assertEqual(['a', 'b'], [c.name for c in parent.children])
+        self.assertEqual(
+            ['a task'],
+            [c.name for c in parent.children[0].children]
+        )
+        self.assertEqual(
+            ['b task'],
+            [c.name for c in parent.children[1].children]
+        )
+        self.assertTrue(profiler.head.is_root)
+
+
+# noinspection PyDocstring
+class TestIds(unittest.TestCase):
+
+    def test_timing_ids(self):
+        Clocked.initialize('ids a')
+        a = Profiler.current()
+        with Clocked('x'):
+            pass
+        Clocked.initialize('ids b')
+        b = Profiler.current()
+        with Clocked('x'):
+            pass
+
+        self.assertNotEqual(a, b)
+        self.assertEqual(a.root.children[0].id, b.root.children[0].id)
+        self.assertNotEqual(a.root.children[0], b.root.children[0])
+        self.assertEqual(a.root.children[0], a.root.children[0])
+        self.assertEqual(
+            [0, 1],
+            sorted(t.id for t in a.get_timing_hierarchy())
+        )
+
+
+# noinspection PyDocstring
+class TestStopWatch(unittest.TestCase):
+
+    def test_clocks(self):
+        wall = StopWatch()
+        cpu = ProcessTimeStopWatch()
+        wall.start()
+        cpu.start()
+        sleep(.02)
+        cpu.stop()
+        wall.stop()
+
+        self.assertTrue(isinstance(wall.total_nanoseconds, int))
+        self.assertTrue(18 <= wall.total_milliseconds)
+        self.assertTrue(cpu.total_milliseconds < 10)
+        self.assertFalse(wall.is_running)
+
+    def test_stopwatch_provider(self):
+        provider = Settings.stopwatch_provider
+        Settings.stopwatch_provider = ProcessTimeStopWatch
+        try:
+            Clocked.initialize('cpu session')
+            with Clocked('sleep'):
+                sleep(.02)
+        finally:
+            Settings.stopwatch_provider = provider
+
+        t = [i for i in Clocked.get('sleep')][0]
+        self.assertTrue(t.duration_milliseconds < 10)
+
+
+# noinspection PyDocstring
+class TestCpuTime(unittest.TestCase):
+
+    def test_off_cpu(self):
+        Clocked.initialize('test off cpu')
+
+        with Clocked('sleeping'):
+            sleep(.02)
+        with Clocked('spinning'):
+            sw = StopWatch()
+            sw.start()
+            while sw.elapsed_milliseconds < 20:
+                pass
+
+        sleeping = [i for i in Clocked.get('sleeping')][0]
+        self.assertTrue(sleeping.cpu_duration_milliseconds < 10)
+
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertTrue(90 < aggregates['sleeping'].off_cpu_percent)
+        self.assertTrue(
+            aggregates['spinning'].off_cpu_percent <
+            aggregates['sleeping'].off_cpu_percent
+        )
+
+        lines = []
+        Clocked.hotspot_report(lines.append)
+        self.assertTrue(any('% off-cpu' in line for line in lines))
+
+    def test_capture_disabled(self):
+        Settings.capture_cpu_time = False
+        try:
+            Clocked.initialize('test capture disabled')
+            with Clocked('a'):
+                pass
+        finally:
+            Settings.capture_cpu_time = True
+
+        self.assertIsNone(
+            [i for i in Clocked.get('a')][0].cpu_duration_milliseconds
+        )
+        lines = []
+        Clocked.hotspot_report(lines.append)
+        line = [i for i in lines if i.startswith('a (')][0]
+        self.assertTrue(' 1 hits, ' in line)
+        self.assertFalse('cpu' in line)
+
+
+# noinspection PyDocstring
+class TestExceptions(unittest.TestCase):
+
+    def test_decorated_raise(self):
+        Clocked.initialize('test decorated raise')
+
+        @clocked
+        def raises():
+            raise ValueError('some value error')
+
+        self.assertRaises(ValueError, raises)
+        with Clocked('after'):
+            pass
+
+        profiler = Profiler.current()
+        self.assertTrue(profiler.head.is_root)
+        self.assertEqual(2, len(profiler.root.children))
+        failed, after = profiler.root.children
+        self.assertIs(ValueError, failed.exception)
+        self.assertIsNotNone(failed.duration_ns)
+        self.assertIsNone(after.exception)
+
+        names = [name for name, _ in Clocked.generate_aggregates()]
+        self.assertIn(failed.name + ' [raised ValueError]', names)
+        self.assertNotIn(failed.name, names)
+
+    def test_with_raise(self):
+        Clocked.initialize('test with raise')
+
+        def raises():
+            with Clocked('outer'):
+                Profiler.current().step_impl('left open')
+                raise KeyError('a')
+
+        self.assertRaises(KeyError, raises)
+
+        profiler = Profiler.current()
+        self.assertTrue(profiler.head.is_root)
+        outer = [i for i in Clocked.get('outer')][0]
+        self.assertIs(KeyError, outer.exception)
+
+        lines = []
+        Clocked.verbose_report(lines.append)
+        self.assertIn(' outer (0.0 ms, raised KeyError)', lines)
+
+
+# noinspection PyDocstring
+class TestDisabled(unittest.TestCase):
+
+    def tearDown(self):
+        Settings.enabled = True
+
+    def test_disabled_then_enabled(self):
+        Settings.enabled = False
+        offset = 10
+
+        def add(a, b=1):
+            return a + b + offset
+
+        code = add.__code__
+        self.assertIs(add, clocked(add))
+
+        class Obj(object):
+            def method(self, x):
+                return x * 2
+
+            @staticmethod
+            def static(x):
+                return x * 3
+
+        self.assertIs(Obj, clocked(Obj))
+
+        Clocked.initialize('test disabled')
+        self.assertEqual(12, add(1))
+        self.assertEqual(4, Obj().method(2))
+        self.assertFalse(Profiler.current().root.has_children)
+
+        Settings.enable()
+        self.assertIsNot(code, add.__code__)
+        self.assertEqual(13, add(1, b=2))
+        self.assertEqual(4, Obj().method(2))
+        self.assertEqual(6, Obj.static(2))
+        names = [t.name for t in Profiler.current().root.children]
+        self.assertEqual(3, len(names))
+        self.assertTrue(names[0].endswith('.add:{}'.format(
+            code.co_firstlineno
+        )))
+        self.assertTrue('.Obj.method:' in names[1])
+        self.assertTrue('.Obj.static:' in names[2])
+
+        Settings.disable()
+        self.assertIs(code, add.__code__)
+        self.assertEqual(12, add(1))
+        self.assertEqual(3, len(Profiler.current().root.children))
+        self.assertNotIn('__clocked_trampolines__', globals())
+
+    def test_subclass_enabled(self):
+        Settings.enabled = False
+
+        @clocked
+        class Base(object):
+            def m(self):
+                return 'base'
+
+            def n(self):
+                return 'n'
+
+        @clocked
+        class Sub(Base):
+            def n(self):
+                return 'sub ' + super(Sub, self).n()
+
+        Clocked.initialize('test disabled subclass')
+        Settings.enable()
+        try:
+            self.assertEqual('base', Base().m())
+            self.assertEqual('base', Sub().m())
+            self.assertEqual('sub n', Sub().n())
+        finally:
+            Settings.disable()
+
+        root = Profiler.current().root
+        self.assertEqual(3, len(root.children))
+        self.assertTrue('.Base.m:' in root.children[0].name)
+        self.assertTrue('.Base.m:' in root.children[1].name)
+        self.assertTrue('.Sub.n:' in root.children[2].name)
+        self.assertEqual(
+            ['.Base.n:' in i.name for i in root.children[2].children],
+            [True]
+        )
+
+    def test_generator_enabled(self):
+        Settings.enabled = False
+
+        def items(count):
+            for i in range(count):
+                received = yield i
+                if received is not None:
+                    yield received
+
+        self.assertIs(items, clocked(items))
+
+        Clocked.initialize('test disabled generator')
+        Settings.enable()
+        self.assertTrue(inspect.isgeneratorfunction(items))
+        self.assertEqual([0, 1, 2], list(items(3)))
+        if sys.version_info >= (3, 3):
+            generator = items(2)
+            next(generator)
+            self.assertEqual('sent', generator.send('sent'))
+
+        timings = Profiler.current().root.children
+        self.assertEqual(1 if sys.version_info < (3, 3) else 2, len(timings))
+        self.assertEqual(3, timings[0].yields)
+
+    def test_clashing_names(self):
+        Settings.enabled = False
+        _clocked_args = 1
+
+        def clashing():
+            return _clocked_args
+
+        code = clashing.__code__
+        clocked(clashing)
+
+        class Handler(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.messages = []
+
+            def emit(self, record):
+                self.messages.append(record.getMessage())
+
+        handler = Handler()
+        decorators.logger.addHandler(handler)
+        try:
+            Settings.enable()
+        finally:
+            decorators.logger.removeHandler(handler)
+
+        self.assertIs(code, clashing.__code__)
+        self.assertEqual(1, clashing())
+        self.assertEqual(1, len(handler.messages))
+        self.assertIn('.clashing:', handler.messages[0])
+
+
+# noinspection PyDocstring
+class TestGenerators(unittest.TestCase):
+
+    def _assert(self, mini, val, maxi):
+        self.assertTrue(
+            mini <= val <= maxi,
+            '{} <= {} <= {} is not true'.format(
+                mini,
+                val,
+                maxi
+            )
+        )
+
+    def test_generator(self):
+        @clocked
+        def produce(n):
+            for i in range(n):
+                sleep(.01)
+                with Clocked('inside'):
+                    pass
+                yield i
+
+        Clocked.initialize('test generator')
+
+        items = []
+        for item in produce(3):
+            with Clocked('consume'):
+                sleep(.01)
+                items.append(item)
+
+        self.assertEqual([0, 1, 2], items)
+
+        root = Profiler.current().root
+        self.assertEqual(
+            ['produce', 'consume', 'consume', 'consume'],
+            [i.name.split(':')[0].split('.')[-1] for i in root.children]
+        )
+        timing = root.children[0]
+        self.assertEqual(3, timing.yields)
+        self.assertEqual(3, len(timing.children))
+        self._assert(30-2, timing.duration_milliseconds, 30+8)
+
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertEqual(3, aggregates[timing.name].yields)
+
+        lines = []
+        Clocked.hotspot_report(lines.append)
+        self.assertTrue(any('3 yields' in line for line in lines))
+
+    def test_send_and_abandon(self):
+        @clocked
+        def echo():
+            received = yield
+            while True:
+                received = yield received * 2
+
+        Clocked.initialize('test send and abandon')
+
+        gen = echo()
+        next(gen)
+        self.assertEqual(4, gen.send(2))
+        self.assertEqual(6, gen.send(3))
+        timing = Profiler.current().root.children[0]
+        self.assertIsNone(timing.duration_ns)
+
+        del gen
+        self.assertIsNotNone(timing.duration_ns)
+        self.assertEqual(3, timing.yields)
+        self.assertTrue(Profiler.current().head.is_root)
+
+    def test_raise(self):
+        @clocked
+        def raises():
+            yield 1
+            raise ValueError('some value error')
+
+        Clocked.initialize('test generator raise')
+        self.assertRaises(ValueError, list, raises())
+
+        timing = Profiler.current().root.children[0]
+        self.assertIs(ValueError, timing.exception)
+        self.assertEqual(1, timing.yields)
+
+
+# noinspection PyDocstring
+class TestAggregateOnly(unittest.TestCase):
+
+    def setUp(self):
+        Settings.aggregate_only = True
+
+    def tearDown(self):
+        Settings.aggregate_only = False
+
+    def test_constant_memory(self):
+        @clocked
+        def leaf():
+            pass
+
+        Clocked.initialize('test aggregate only')
+        profiler = Profiler.current()
+
+        for _ in range(1000):
+            with Clocked('outer'):
+                leaf()
+                leaf()
+
+        paths = [i for i in profiler.get_timing_hierarchy()]
+        self.assertEqual(3, len(paths))
+
+        outer = [i for i in Clocked.get('outer')][0]
+        self.assertEqual(1000, outer.hits)
+        self.assertEqual(1, len(outer.children))
+        self.assertEqual(2000, outer.children[0].hits)
+        self.assertTrue(
+            outer.children[0].total_ns <= outer.total_ns
+        )
+
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertEqual(1000, aggregates['outer'].hits)
+        self.assertEqual(2000, aggregates[outer.children[0].name].hits)
+        self.assertTrue(
+            aggregates['outer'].min_ms <= aggregates['outer'].max_ms
+        )
+
+    def test_self_time(self):
+        Clocked.initialize('test aggregate self time')
+
+        for _ in range(2):
+            with Clocked('parent'):
+                with Clocked('child'):
+                    sleep(.01)
+
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertTrue(aggregates['parent'].total_ms < 5)
+        self.assertTrue(18 <= aggregates['child'].total_ms)
+        self.assertEqual(
+            ['child', 'parent'],
+            [name for name, _ in Clocked.generate_aggregates(limit=2)]
+        )
+
+    def test_paths_and_errors(self):
+        @clocked
+        def maybe_raise(should):
+            if should:
+                raise ValueError('some value error')
+
+        Clocked.initialize('test aggregate paths')
+
+        with Clocked('a'):
+            maybe_raise(False)
+        with Clocked('b'):
+            maybe_raise(False)
+            self.assertRaises(ValueError, maybe_raise, True)
+
+        # the same step under two paths
+        self.assertEqual(2, len([i for i in Clocked.get('.*maybe_raise.*')]))
+
+        aggregates = dict(Clocked.generate_aggregates())
+        name = [i for i in aggregates if i.endswith('[raised ValueError]')]
+        self.assertEqual(1, len(name))
+        self.assertEqual(1, aggregates[name[0]].hits)
+        self.assertEqual(
+            2,
+            aggregates[name[0][:-len(' [raised ValueError]')]].hits
+        )
+        self.assertTrue(Profiler.current().head.node is
+                        Profiler.current().root)
+
+    def test_same_hotspots(self):
+        now = [0]
+
+        class ManualStopWatch(StopWatch):
+            clock = staticmethod(lambda: now[0])
+
+        def report():
+            Clocked.initialize('test aggregate hotspots')
+            with Clocked('running'):
+                for i in range(3):
+                    try:
+                        with Clocked('child'):
+                            now[0] += 1000000 * (i + 1)
+                            if i == 2:
+                                raise ValueError()
+                    except ValueError:
+                        pass
+                return list(Clocked.generate_hotspot_report())
+
+        Settings.stopwatch_provider = ManualStopWatch
+        Settings.capture_cpu_time = False
+        try:
+            aggregate = report()
+            Settings.aggregate_only = False
+            tree = report()
+        finally:
+            Settings.stopwatch_provider = StopWatch
+            Settings.capture_cpu_time = True
+
+        self.assertEqual(tree, aggregate)
+        self.assertIn(
+            'test aggregate hotspots (0.0 ms [0.0, 0.0], 1 hits',
+            '\n'.join(aggregate)
+        )
+
+
+# noinspection PyDocstring
+class TestCallTree(unittest.TestCase):
+
+    def tearDown(self):
+        Settings.aggregate_only = False
+
+    def _loops(self):
+        with Clocked('loop 1'):
+            for i in range(4):
+                with Clocked('loop 2'):
+                    for j in range(3):
+                        with Clocked('loop 3'):
+                            pass
+
+    def test_merged_report(self):
+        Clocked.initialize('test merged report')
+        self._loops()
+
+        lines = []
+        Clocked.verbose_report(lines.append)
+        self.assertEqual(7, len(lines))
+        self.assertTrue(lines[3].startswith('test merged report ('))
+        self.assertTrue(lines[4].startswith(' loop 1 ('))
+        self.assertTrue(lines[5].startswith('  loop 2 ('))
+        self.assertTrue(' 4 hits [' in lines[5])
+        self.assertTrue(' 12 hits [' in lines[6])
+
+        tree = Profiler.current().get_call_tree()
+        loop_3 = tree.children[0].children[0].children[0]
+        self.assertEqual('loop 3', loop_3.name)
+        self.assertEqual(12, loop_3.hits)
+        self.assertTrue(loop_3.min_ns <= loop_3.max_ns)
+
+    def test_raw_report(self):
+        Clocked.initialize('test raw report')
+        self._loops()
+
+        lines = []
+        Clocked.verbose_report(lines.append, raw=True)
+        self.assertEqual(3 + 1 + 1 + 4 + 12, len(lines))
+        self.assertEqual(12, len([i for i in lines if 'loop 3' in i]))
+
+    def test_aggregate_only_report(self):
+        Settings.aggregate_only = True
+        Clocked.initialize('test aggregate only report')
+        self._loops()
+
+        lines = []
+        Clocked.verbose_report(lines.append, raw=True)
+        self.assertEqual(
+            'test aggregate only report (running)',
+            lines[3]
+        )
+        self.assertTrue(lines[6].startswith('   loop 3 ('))
+        self.assertTrue(' 12 hits [' in lines[6])
+
+
+# noinspection PyDocstring
+class TestPercentiles(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for i in range(1, 10001):
+            histogram.record(i * 1000)
+
+        for q in (0.5, 0.95, 0.99, 0.999):
+            expected = q * 10000 * 1000
+            self.assertTrue(
+                abs(histogram.quantile(q) - expected) <= expected / 64
+            )
+
+        # memory is bounded by the range of the values
+        self.assertTrue(len(histogram.counts) < 1000)
+
+        other = Histogram()
+        other.record(5, count=3)
+        histogram.merge(other)
+        self.assertEqual(10003, histogram.count)
+        self.assertEqual(5, histogram.quantile(0))
+
+    def test_hotspot_percentiles(self):
+        Clocked.initialize('test hotspot percentiles')
+        for i in range(20):
+            with Clocked('step'):
+                if i == 19:
+                    sleep(.02)
+
+        aggregate = dict(Clocked.generate_aggregates())['step']
+        self.assertTrue(aggregate.percentile_ms(50) < 1)
+        self.assertTrue(aggregate.percentile_ms(95) < 1)
+        self.assertTrue(18 <= aggregate.percentile_ms(99.9))
+        self.assertTrue(
+            abs(aggregate.max_ms - aggregate.percentile_ms(100)) <=
+            aggregate.max_ms / 64
+        )
+
+        lines = []
+        Clocked.hotspot_report(lines.append)
+        line = [i for i in lines if i.startswith('step (')][0]
+        self.assertTrue(', p50 ' in line)
+        self.assertTrue(', p99.9 ' in line)
+
+
+# noinspection PyDocstring
+class TestSampling(unittest.TestCase):
+
+    def test_sampled_calls(self):
+        @clocked(sample_rate=4)
+        def hot(i):
+            return i
+
+        Clocked.initialize('test sampled calls')
+        profiler = Profiler.current()
+
+        self.assertEqual(list(range(20)), [hot(i) for i in range(20)])
+
+        timings = [i for i in profiler.get_timing_hierarchy()]
+        self.assertEqual(6, len(timings))
+
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertEqual(20, aggregates[timings[-1].name].hits)
+        self.assertTrue(aggregates[timings[-1].name].estimated)
+        self.assertFalse(aggregates['test sampled calls'].estimated)
+
+        lines = []
+        Clocked.hotspot_report(lines.append)
+        line = [i for i in lines if i.startswith(timings[-1].name)][0]
+        self.assertTrue(line.endswith(', estimated)'))
+
+    def test_sampled_calls_aggregate_only(self):
+        Settings.aggregate_only = True
+        try:
+            @clocked(sample_rate=3)
+            def hot():
+                pass
+
+            Clocked.initialize('test sampled calls aggregate only')
+            for _ in range(9):
+                hot()
+
+            path = Profiler.current().root.children[0]
+            self.assertEqual(9, path.hits)
+            self.assertTrue(path.estimated)
+        finally:
+            Settings.aggregate_only = False
+
+    def test_sampled_sessions(self):
+        sampled = []
+        for _ in range(6):
+            Clocked.initialize('test sampled sessions', sample_rate=3)
+
+            with Clocked('step'):
+                pass
+
+            lines = []
+            Clocked.hotspot_report(lines.append)
+            Clocked.verbose_report(lines.append)
+            if Profiler.current() is None:
+                # unsampled sessions only report the headers
+                self.assertEqual(6, len(lines))
+                continue
+
+            aggregates = dict(Clocked.generate_aggregates())
+            self.assertEqual(3, aggregates['step'].hits)
+            self.assertTrue(aggregates['step'].estimated)
+            sampled.append(lines)
+
+        self.assertEqual(2, len(sampled))
+
+
+# noinspection PyDocstring
+class TestEventRecording(unittest.TestCase):
+
+    def setUp(self):
+        Settings.event_recording = True
+
+    def tearDown(self):
+        Settings.event_recording = False
+
+    def test_rebuilt_hierarchy(self):
+        @clocked
+        def leaf():
+            sleep(.001)
+
+        @clocked
+        def items():
+            for i in range(3):
+                leaf()
+                yield i
+
+        Clocked.initialize('test event recording')
+        profiler = Profiler.current()
+
+        for _ in range(3):
+            with Clocked('outer'):
+                leaf()
+                leaf()
+        self.assertEqual([0, 1, 2], list(items()))
+        try:
+            with Clocked('raise'):
+                raise ValueError()
+        except ValueError:
+            pass
+
+        # nothing is rebuilt until the hierarchy is read
+        self.assertEqual(None, profiler._root.children)
+
+        outer = [i for i in Clocked.get('outer')]
+        self.assertEqual(3, len(outer))
+        for timing in outer:
+            self.assertEqual(2, len(timing.children))
+            self.assertTrue(1 <= timing.duration_milliseconds)
+
+        generator = profiler.root.children[3]
+        self.assertEqual(3, generator.yields)
+        self.assertEqual(3, len(generator.children))
+        self.assertEqual(ValueError, profiler.root.children[4].exception)
+
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertEqual(9, aggregates[generator.children[0].name].hits)
+        self.assertEqual(1, aggregates['raise [raised ValueError]'].hits)
+
+        # reading again without new events keeps the same timings
+        self.assertTrue(outer[0] is [i for i in Clocked.get('outer')][0])
+
+    def test_frozen(self):
+        Clocked.initialize('test event recording frozen')
+        profiler = Profiler.current()
+        Clocked('running').__enter__()
+        profiler.freeze()
+        sleep(0.01)
+        with Clocked('late'):
+            pass
+        profiler.stop_impl()
+
+        end = profiler.elapsed_nanoseconds
+        running = list(Clocked.get('running'))[0]
+        late = list(Clocked.get('late'))[0]
+        self.assertEqual(end, running.start_ns + running.duration_ns)
+        self.assertEqual((end, 0), (late.start_ns, late.duration_ns))
+
+    @unittest.skipIf(contextvars is None, 'requires contextvars')
+    def test_context_provider(self):
+        provider = Settings.profiler_provider
+        Settings.profiler_provider = ContextProfilerProvider()
+        try:
+            with self.assertRaises(Exception):
+                Clocked.initialize('test event recording context')
+        finally:
+            Settings.profiler_provider = provider
+
+    def test_threads(self):
+        Clocked.initialize('test event recording threads')
+
+        def work():
+            for _ in range(10):
+                with Clocked('thread parent'):
+                    with Clocked('thread child'):
+                        pass
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        parents = [i for i in Clocked.get('thread parent')]
+        self.assertEqual(40, len(parents))
+        for parent in parents:
+            self.assertEqual(1, len(parent.children))
+            self.assertEqual('thread child', parent.children[0].name)
+
+
+# noinspection PyDocstring
+class TestNames(unittest.TestCase):
+
+    def test_registry(self):
+        name_id = names.get_id('test registry')
+        self.assertEqual(name_id, names.get_id('test registry'))
+        self.assertEqual(name_id, names.to_id(name_id))
+        self.assertEqual('test registry', names.get_name(name_id))
+        self.assertNotEqual(name_id, names.get_id('test registry other'))
+
+    def test_decorated_ids(self):
+        @clocked
+        def decorated():
+            pass
+
+        Clocked.initialize('test decorated ids')
+        decorated()
+        decorated()
+
+        timings = Profiler.current().root.children
+        self.assertEqual(timings[0].name_id, timings[1].name_id)
+        self.assertTrue('.decorated:' in timings[0].name)
+        self.assertEqual(timings[0].name_id, names.get_id(timings[0].name))
+
+
+# noinspection PyDocstring
+class TestNameIndex(unittest.TestCase):
+
+    def test_get(self):
+        Clocked.initialize('test name index')
+        with Clocked('running'):
+            for _ in range(3):
+                with Clocked('a.b'):
+                    pass
+                with Clocked('axb'):
+                    pass
+
+            self.assertEqual(1, len(list(Clocked.get('running'))))
+            self.assertEqual(3, len(list(Clocked.get('axb'))))
+            self.assertEqual(6, len(list(Clocked.get('a.b'))))
+            self.assertEqual(
+                ['a.b', 'axb'] * 3,
+                [i.name for i in Clocked.get('a.b')]
+            )
+            self.assertEqual([], list(Clocked.get('never seen name')))
+            self.assertEqual([], list(Clocked.get('a')))
+            self.assertEqual(3, len(list(Clocked.get('a.b', exact=True))))
+
+    def test_exact(self):
+        @clocked
+        def decorated():
+            pass
+
+        Clocked.initialize('test name index exact')
+        profiler = Profiler.current()
+        decorated()
+        decorated()
+        name = profiler.root.children[0].name
+
+        found = []
+        profiler.find_timings = found.append
+        self.assertEqual(2, len(list(Clocked.get(name, exact=True))))
+        self.assertEqual([], found)
+
+    def test_recursive(self):
+        Clocked.initialize('test name index recursive')
+        with Clocked('step') as outer:
+            with Clocked('step') as inner:
+                self.assertEqual([outer, inner], list(Clocked.get('step')))
+            self.assertEqual([outer, inner], list(Clocked.get('s.ep')))
+            self.assertEqual([outer, inner], list(Clocked.get('step')))
+
+        self.assertEqual([outer, inner], list(Clocked.get('step')))
+
+    def test_pruned(self):
+        Clocked.initialize('test name index pruned')
+        profiler = Profiler.current()
+        for _ in range(3):
+            timing = profiler.step_impl('kept', min_save_ms=1000)
+            profiler.step_impl('child').stop()
+            timing.stop()
+        profiler.step_impl('kept').stop()
+
+        self.assertEqual(1, len(list(Clocked.get('kept'))))
+        self.assertEqual([], list(Clocked.get('child')))
+
+    def test_aggregate_only(self):
+        Settings.aggregate_only = True
+        try:
+            Clocked.initialize('test name index aggregate only')
+            for _ in range(3):
+                with Clocked('a'):
+                    with Clocked('ab'):
+                        pass
+        finally:
+            Settings.aggregate_only = False
+
+        self.assertEqual(3, list(Clocked.get('a'))[0].hits)
+        self.assertEqual(2, len(list(Clocked.get('ab?'))))
+
+
+# noinspection PyDocstring
+@unittest.skipIf(numpy is None, 'numpy is not available')
+class TestVectorizedReports(unittest.TestCase):
+
+    def tearDown(self):
+        Settings.vectorized_reports = False
+
+    @staticmethod
+    def _aggregates():
+        return [
+            (
+                name,
+                i.hits,
+                repr(i.total_ms),
+                repr(i.min_ms),
+                repr(i.max_ms),
+                repr(i.cpu_ms),
+                i.yields,
+                i.estimated,
+                sorted(i.histogram.counts.items())
+            )
+            for name, i in Clocked.generate_aggregates()
+        ]
+
+    def test_same_aggregates(self):
+        @clocked(sample_rate=2)
+        def sampled():
+            pass
+
+        @clocked
+        def items():
+            for i in range(3):
+                sampled()
+                yield i
+
+        Clocked.initialize('test vectorized reports')
+        for i in range(50):
+            with Clocked('outer'):
+                list(items())
+                try:
+                    with Clocked('inner'):
+                        if i % 7 == 0:
+                            raise ValueError()
+                except ValueError:
+                    pass
+
+        expected = self._aggregates()
+        Settings.vectorized_reports = True
+        self.assertEqual(expected, self._aggregates())
+
+    def test_deep_hierarchy(self):
+        Clocked.initialize('test vectorized deep hierarchy')
+        profiler = Profiler.current()
+        for _ in range(5000):
+            profiler.step_impl('deep')
+
+        Settings.vectorized_reports = True
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertEqual(5000, aggregates['deep'].hits)
+
+
+# noinspection PyDocstring
+class TestDeepHierarchy(unittest.TestCase):
+
+    def test_reports_do_not_recurse(self):
+        Clocked.initialize('test deep hierarchy')
+        profiler = Profiler.current()
+        depth = sys.getrecursionlimit() * 2
+        for _ in range(depth):
+            profiler.step_impl('deep')
+
+        for raw in (False, True):
+            lines = Clocked.generate_verbose_report(raw)
+            self.assertEqual('', next(lines))
+            self.assertEqual(3 + depth + 1, 1 + len(list(lines)))
+
+        lines = list(Clocked.generate_hotspot_report())
+        self.assertEqual(5, len(lines))
+        self.assertTrue(lines[3].startswith('deep (') or
+                        lines[4].startswith('deep ('))
+
+        self.assertEqual(depth, len([i for i in Clocked.get('deep')]))
+
+    def test_pre_order(self):
+        Clocked.initialize('test pre-order')
+        for name in ('a', 'b'):
+            with Clocked(name):
+                with Clocked(name + '1'):
+                    pass
+                with Clocked(name + '2'):
+                    pass
+
+        self.assertEqual(
+            ['test pre-order', 'a', 'a1', 'a2', 'b', 'b1', 'b2'],
+            [i.name for i in Profiler.current().get_timing_hierarchy()]
+        )
+
+
+# noinspection PyDocstring
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.stored = None
+
+    def tearDown(self):
+        Settings.vectorized_reports = False
+        if self.stored is not None:
+            self.stored.close()
+        os.remove(self.path)
+
+    @staticmethod
+    def _session():
+        @clocked
+        def items():
+            for i in range(3):
+                yield i
+
+        Clocked.initialize('test storage')
+        for i in range(20):
+            with Clocked('outer'):
+                list(items())
+                try:
+                    with Clocked('inner'):
+                        if i % 7 == 0:
+                            raise ValueError()
+                except ValueError:
+                    pass
+
+    def test_round_trip(self):
+        self._session()
+        Profiler.current().stop_impl()
+        # sorted, as names tied on their total may come in any order
+        aggregates = sorted(TestVectorizedReports._aggregates())
+        verbose = list(Clocked.generate_verbose_report())
+        raw = list(Clocked.generate_verbose_report(True))
+        hierarchy = [
+            (i.name, i.duration_ns, i.cpu_duration_ns, i.yields,
+             getattr(i.exception, '__name__', None))
+            for i in Profiler.current().get_timing_hierarchy()
+        ]
+
+        Clocked.save(self.path)
+        self.stored = Clocked.load(self.path)
+
+        self.assertIs(self.stored, Profiler.current())
+        self.assertEqual('test storage', self.stored.name)
+        self.assertEqual(
+            aggregates,
+            sorted(TestVectorizedReports._aggregates())
+        )
+        self.assertEqual(verbose, list(Clocked.generate_verbose_report()))
+        self.assertEqual(raw, list(Clocked.generate_verbose_report(True)))
+        self.assertEqual(hierarchy, [
+            (i.name, i.duration_ns, i.cpu_duration_ns, i.yields,
+             getattr(i.exception, '__name__', None))
+            for i in self.stored.get_timing_hierarchy()
+        ])
+
+        if numpy is not None:
+            Settings.vectorized_reports = True
+            self.assertEqual(
+                aggregates,
+                sorted(TestVectorizedReports._aggregates())
+            )
+
+    def test_get(self):
+        self._session()
+        Clocked.save(self.path)
+        self.stored = Clocked.load(self.path)
+
+        inner = list(Clocked.get('inner'))
+        self.assertEqual(20, len(inner))
+        self.assertEqual('ValueError', inner[0].exception.__name__)
+        self.assertIsNone(inner[1].exception)
+        self.assertEqual('outer', inner[0].parent_timing.name)
+        self.assertEqual(2, inner[0].depth())
+        self.assertEqual(
+            ['.items:' in i.name for i in inner[0].parent_timing.children],
+            [True, False]
+        )
+
+    def test_read_only(self):
+        self._session()
+        Clocked.save(self.path)
+        self.stored = Clocked.load(self.path)
+
+        with self.assertRaises(Exception):
+            with Clocked('more'):
+                pass
+
+
+# noinspection PyDocstring
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        Settings.event_recording = False
+        Settings.aggregate_only = False
+        os.remove(self.path)
+
+    def _load(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _session():
+        Clocked.initialize('test export')
+        for _ in range(3):
+            with Clocked('outer'):
+                with Clocked('inner'):
+                    pass
+                try:
+                    with Clocked('failing'):
+                        raise ValueError()
+                except ValueError:
+                    pass
+
+    def test_chrome_trace(self):
+        self._session()
+        Clocked.export_chrome_trace(self.path)
+
+        events = [i for i in self._load()['traceEvents'] if i['ph'] == 'X']
+        self.assertEqual(
+            ['test export'] + ['outer', 'inner', 'failing'] * 3,
+            [i['name'] for i in events]
+        )
+        self.assertEqual(
+            [{'raised': 'ValueError'}] * 3,
+            [i['args'] for i in events if 'args' in i]
+        )
+        outer, inner = events[1], events[2]
+        self.assertTrue(outer['ts'] <= inner['ts'])
+        self.assertTrue(
+            inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+        )
+
+    def test_speedscope(self):
+        self._session()
+        Clocked.export_speedscope(self.path)
+
+        trace = self._load()
+        frames = [i['name'] for i in trace['shared']['frames']]
+        self.assertEqual(
+            ['test export', 'outer', 'inner', 'failing'],
+            frames
+        )
+
+        profile, = trace['profiles']
+        depth = 0
+        last = 0
+        opened = []
+        for event in profile['events']:
+            self.assertTrue(last <= event['at'])
+            last = event['at']
+            if event['type'] == 'O':
+                opened.append(frames[event['frame']])
+                depth += 1
+            else:
+                self.assertEqual(opened.pop(), frames[event['frame']])
+                depth -= 1
+        self.assertEqual(0, depth)
+        self.assertEqual(20, len(profile['events']))
+        self.assertEqual(last, profile['endValue'])
+
+    def test_track_per_thread(self):
+        Settings.event_recording = True
+        Clocked.initialize('test export threads')
+        profiler = Profiler.current()
+
+        def run():
+            profiler.step_impl('worker').stop()
+
+        with Clocked('main'):
+            pass
+        thread = threading.Thread(target=run, name='worker thread')
+        thread.start()
+        thread.join()
+
+        Clocked.export_chrome_trace(self.path)
+        events = self._load()['traceEvents']
+        threads = dict(
+            (i['tid'], i['args']['name'])
+            for i in events if i['name'] == 'thread_name'
+        )
+        self.assertEqual(2, len(threads))
+        self.assertEqual(
+            [(threading.current_thread().name, 'main'),
+             ('worker thread', 'worker')],
+            [(threads[i['tid']], i['name']) for i in events if i['ph'] == 'X']
+        )
+
+        Clocked.export_speedscope(self.path)
+        self.assertEqual(
+            [threading.current_thread().name, 'worker thread'],
+            [i['name'] for i in self._load()['profiles']]
+        )
+
+    def test_aggregate_only(self):
+        Settings.aggregate_only = True
+        Clocked.initialize('test export aggregate only')
+        with self.assertRaises(Exception):
+            Clocked.export_chrome_trace(self.path)
+
+    def test_collapsed(self):
+        Clocked.initialize('test;collapsed')
+        for _ in range(3):
+            with Clocked('outer'):
+                sleep(0.005)
+                with Clocked('inner'):
+                    sleep(0.001)
+                try:
+                    with Clocked('failing'):
+                        raise ValueError()
+                except ValueError:
+                    pass
+
+        for aggregate_only in (False, True):
+            Settings.aggregate_only = aggregate_only
+            if aggregate_only:
+                Clocked.initialize('test;collapsed')
+                for _ in range(3):
+                    with Clocked('outer'):
+                        sleep(0.005)
+                        with Clocked('inner'):
+                            sleep(0.001)
+                Profiler.current().stop_impl()
+
+            Clocked.export_collapsed(self.path)
+            with open(self.path) as f:
+                lines = dict(i.rsplit(' ', 1) for i in f.read().splitlines())
+
+            # the steps taking no time of their own may be left out
+            self.assertTrue(set(lines) <= set([
+                'test:collapsed',
+                'test:collapsed;outer',
+                'test:collapsed;outer;inner',
+                'test:collapsed;outer;failing'
+            ]))
+            self.assertTrue(15000 <= int(lines['test:collapsed;outer']))
+            self.assertTrue(3000 <= int(lines['test:collapsed;outer;inner']))
+
+
+# noinspection PyDocstring
+class TestSnapshots(unittest.TestCase):
+
+    @staticmethod
+    def _snapshot(session_name, count):
+        @clocked
+        def items():
+            for i in range(2):
+                yield i
+
+        Clocked.initialize(session_name)
+        for i in range(count):
+            with Clocked('outer'):
+                list(items())
+                try:
+                    with Clocked('inner'):
+                        if i % 2 == 0:
+                            raise ValueError()
+                except ValueError:
+                    pass
+
+        return pickle.loads(pickle.dumps(Clocked.snapshot(), 2))
+
+    @staticmethod
+    def _hotspots():
+        return dict(
+            (name, (i.hits, i.min_ms, i.max_ms, i.yields))
+            for name, i in Clocked.generate_aggregates()
+        )
+
+    def test_round_trip(self):
+        Clocked.initialize('test snapshot')
+        for _ in range(3):
+            with Clocked('outer'):
+                try:
+                    with Clocked('inner'):
+                        raise ValueError()
+                except ValueError:
+                    pass
+        profiler = Profiler.current()
+        tree = profiler.get_call_tree()
+        verbose = list(Clocked.generate_verbose_report())
+
+        snapshot = pickle.loads(pickle.dumps(Clocked.snapshot()))
+        Clocked.use(snapshot)
+        self.assertEqual(
+            3,
+            dict(Clocked.generate_aggregates())[
+                'inner [raised ValueError]'
+            ].hits
+        )
+        self.assertEqual(tree.hits, snapshot.root.hits)
+        self.assertEqual(
+            [i.split(' (')[0] for i in verbose],
+            [i.split(' (')[0] for i in Clocked.generate_verbose_report()]
+        )
+        self.assertEqual(3, list(Clocked.get('outer'))[0].hits)
+
+    def test_elapsed(self):
+        Clocked.initialize('test snapshot elapsed')
+        with Clocked('step'):
+            sleep(0.001)
+
+        snapshot = Clocked.snapshot()
+        self.assertEqual(snapshot.root.total_ns, snapshot.elapsed_nanoseconds)
+        self.assertEqual(
+            snapshot.duration_milliseconds,
+            snapshot.elapsed_milliseconds
+        )
+        self.assertTrue(1 <= snapshot.elapsed_milliseconds)
+
+    def test_merge(self):
+        a = self._snapshot('test merge', 2)
+        b = self._snapshot('test merge', 3)
+        c = self._snapshot('test merge', 4)
+
+        Clocked.use(merge_snapshots([merge_snapshots([a, b]), c]))
+        left = self._hotspots()
+        Clocked.use(merge_snapshots([a, merge_snapshots([b, c])]))
+        self.assertEqual(left, self._hotspots())
+
+        self.assertEqual(9, left['outer'][0])
+        self.assertEqual(5, left['inner [raised ValueError]'][0])
+        self.assertEqual(4, left['inner'][0])
+        self.assertEqual(18, [
+            i for name, i in left.items() if '.items:' in name
+        ][0][3])
+        self.assertEqual(
+            min(i.root.children[0].min_ns for i in (a, b, c)),
+            Profiler.current().root.children[0].min_ns
+        )
+
+        with self.assertRaises(Exception):
+            with Clocked('more'):
+                pass
+
+
+# noinspection PyDocstring
+class TestRollingWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.now = now = [0]
+
+        class ManualStopWatch(StopWatch):
+            clock = staticmethod(lambda: now[0])
+
+        Settings.rolling_window_seconds = 60
+        Settings.stopwatch_provider = ManualStopWatch
+
+    def tearDown(self):
+        Settings.rolling_window_seconds = None
+        Settings.stopwatch_provider = StopWatch
+
+    def _step(self, name, seconds):
+        self.now[0] = seconds * 1000000000
+        with Clocked(name):
+            self.now[0] += 1000000
+
+    @staticmethod
+    def _names(window=None):
+        return sorted(
+            (name, i.hits) for name, i in Clocked.generate_aggregates(
+                window=window
+            )
+        )
+
+    def test_window(self):
+        Clocked.initialize('test rolling window')
+        self._step('a', 0)
+        self._step('a', 1)
+        self._step('b', 30)
+        self._step('c', 65)
+
+        self.assertEqual([('c', 1)], self._names(10))
+        self.assertEqual([('c', 1)], self._names(30))
+        self.assertEqual([('b', 1), ('c', 1)], self._names(40))
+        # the bucket of a was reused by c
+        self.assertEqual([('b', 1), ('c', 1)], self._names(600))
+        # the running session counts, as it does with a Timing per step
+        self.assertEqual(
+            [('a', 2), ('b', 1), ('c', 1), ('test rolling window', 1)],
+            self._names()
+        )
+
+        lines = list(Clocked.generate_hotspot_report(window=10))
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[3].startswith('c (1.0 ms [1.0, 1.0], 1 hits'))
+
+    def test_nested(self):
+        Clocked.initialize('test rolling window nested')
+        with Clocked('outer'):
+            self.now[0] += 3000000
+            try:
+                with Clocked('inner'):
+                    self.now[0] += 1000000
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        aggregates = dict(Clocked.generate_aggregates(window=60))
+        self.assertEqual(3.0, aggregates['outer'].total_ms)
+        self.assertEqual(1.0, aggregates['inner [raised ValueError]'].total_ms)
+
+    def test_not_windowed(self):
+        Settings.rolling_window_seconds = None
+        Clocked.initialize('test not windowed')
+        with self.assertRaises(Exception):
+            list(Clocked.generate_aggregates(window=60))
+
+
+# noinspection PyDocstring
+class TestBackgroundReporter(unittest.TestCase):
+
+    def test_rotate(self):
+        lines = []
+        reported = []
+
+        def failing(profiler):
+            raise ValueError()
+
+        reporter = BackgroundReporter(
+            failing,
+            hotspot_handler(lines.append),
+            reported.append
+        )
+        reporter.start()
+
+        Clocked.initialize('test rotate')
+        first = Profiler.current()
+        for i in range(3):
+            with Clocked('step {}'.format(i)):
+                pass
+            self.assertIs(Profiler.current(), Clocked.rotate(reporter))
+        reporter.stop()
+
+        self.assertFalse(reporter.is_running)
+        self.assertIs(first, reported[0])
+        self.assertEqual(3, len(reported))
+        self.assertEqual('test rotate', Profiler.current().name)
+        self.assertNotIn(Profiler.current(), reported)
+        self.assertFalse(any(i.sw.is_running for i in reported))
+        self.assertEqual(
+            ['step 0', 'step 1', 'step 2'],
+            [i[:6] for i in lines if i.startswith('step')]
+        )
+
+    def test_slow_handler(self):
+        reported = []
+
+        def slow(profiler):
+            sleep(0.05)
+            reported.append(profiler)
+
+        reporter = BackgroundReporter(slow)
+        reporter.start()
+
+        Clocked.initialize('test slow handler')
+        for _ in range(3):
+            # spins the cpu for 10 ms
+            end = thread_time_ns() + 10000000
+            while thread_time_ns() < end:
+                pass
+            Clocked.rotate(reporter)
+        reporter.stop()
+
+        self.assertEqual(3, len(reported))
+        for profiler in reported:
+            root = profiler.root
+            self.assertTrue(root.duration_ns < 40000000, root.duration_ns)
+            self.assertTrue(
+                8000000 <= root.cpu_duration_ns,
+                root.cpu_duration_ns
+            )
+            self.assertEqual(
+                root.start_ns + root.duration_ns,
+                profiler.elapsed_nanoseconds
+            )
+
+    def test_running_on_other_thread(self):
+        reported = []
+        started = threading.Event()
+        rotated = threading.Event()
+
+        def work():
+            profiler = Profiler.current()
+            timing = profiler.step_impl('running')
+            profiler.step_impl('child').stop()
+            started.set()
+            rotated.wait()
+            # the reporter stopped it already
+            timing.stop()
+
+        reporter = BackgroundReporter(reported.append)
+        reporter.start()
+
+        Clocked.initialize('test running on other thread')
+        worker = threading.Thread(target=work)
+        worker.start()
+        started.wait()
+        Clocked.rotate(reporter)
+        reporter.stop()
+        rotated.set()
+        worker.join()
+
+        root = reported[0].root
+        running = root.children[0]
+        self.assertEqual(running.duration_ns, root.child_ns)
+        self.assertEqual(
+            running.children[0].duration_ns,
+            running.child_ns
+        )
+
+    def test_concurrent_stops(self):
+        Clocked.initialize('test concurrent stops')
+        profiler = Profiler.current()
+        timings = []
+        for _ in range(2000):
+            timings.append(profiler.step_impl('step'))
+            profiler.head = profiler.root
+
+        def stop_all():
+            for timing in timings:
+                timing.stop()
+
+        # switches threads as often as possible, for the stops to interleave
+        interval = getattr(sys, 'getswitchinterval', lambda: None)()
+        if interval is not None:
+            sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=stop_all) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if interval is not None:
+                sys.setswitchinterval(interval)
+
+        self.assertEqual(
+            sum(i.duration_ns for i in timings),
+            profiler.root.child_ns
+        )
+
+    def test_export(self):
+        directory = tempfile.mkdtemp()
+        reporter = BackgroundReporter(export_handler(
+            os.path.join(directory, '{name}-{id}.txt'),
+            export.write_collapsed
+        ))
+        reporter.start()
+
+        Clocked.initialize('test export')
+        profiler = Profiler.current()
+        with Clocked('step'):
+            sleep(0.001)
+        Clocked.rotate(reporter)
+        reporter.stop()
+
+        path = os.path.join(directory, 'test export-{}.txt'.format(
+            profiler.id
+        ))
+        with open(path) as f:
+            self.assertIn('test export;step ', f.read())
+        os.remove(path)
+        os.rmdir(directory)
+
+
+# noinspection PyDocstring
+class TestPruning(unittest.TestCase):
+
+    def setUp(self):
+        self.now = now = [0]
+
+        class ManualStopWatch(StopWatch):
+            clock = staticmethod(lambda: now[0])
+
+        Settings.stopwatch_provider = ManualStopWatch
+
+    def tearDown(self):
+        Settings.stopwatch_provider = StopWatch
+        Settings.vectorized_reports = False
+
+    def _session(self):
+        Clocked.initialize('test pruning')
+        with Clocked('parent'):
+            self.now[0] += 1000000
+            for _ in range(10000):
+                with Clocked('child', min_save_ms=1):
+                    self.now[0] += 100000
+            with Clocked('slow', min_save_ms=1):
+                self.now[0] += 2000000
+
+    def _check(self):
+        parent = list(Clocked.get('parent'))[0]
+        self.assertEqual(['slow'], [i.name for i in parent.children])
+        self.assertEqual([], list(Clocked.get('child')))
+        self.assertEqual(1.0, parent.duration_without_children_milliseconds())
+
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertEqual(10000, aggregates['child'].hits)
+        self.assertAlmostEqual(1000.0, aggregates['child'].total_ms)
+        self.assertAlmostEqual(1.0, aggregates['parent'].total_ms)
+        self.assertEqual(1, aggregates['slow'].hits)
+
+    def test_many_children(self):
+        self._session()
+        self._check()
+
+    @unittest.skipIf(numpy is None, 'numpy is not available')
+    def test_vectorized(self):
+        Settings.vectorized_reports = True
+        self._session()
+        self._check()
+
+    def _check_call_tree(self):
+        parent = Profiler.current().get_call_tree().children[0]
+        self.assertEqual(
+            ['slow', 'child'],
+            [i.name for i in parent.children]
+        )
+        self.assertAlmostEqual(1.0, parent.aggregate.total_ms)
+        self.assertEqual(10000, parent.children[1].hits)
+        self.assertEqual(100000, parent.children[1].max_ns)
+        self.assertAlmostEqual(1000.0, parent.children[1].aggregate.total_ms)
+
+    def test_call_tree(self):
+        self._session()
+        self._check_call_tree()
+
+        lines = '\n'.join(Clocked.generate_verbose_report())
+        self.assertIn('  child (1000.0 ms, 10000 hits [0.1, 0.1])', lines)
+
+    def test_snapshot(self):
+        self._session()
+        Clocked.use(Clocked.snapshot().merge(Clocked.snapshot()))
+
+        parent = Profiler.current().get_call_tree().children[0]
+        self.assertEqual(20000, parent.children[1].hits)
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertEqual(20000, aggregates['child'].hits)
+
+    def test_save(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            self._session()
+            # nested pruning, with an exception, under a pruned call
+            with Clocked('parent'):
+                for _ in range(3):
+                    try:
+                        with Clocked('child', min_save_ms=1):
+                            with Clocked('grandchild'):
+                                self.now[0] += 1000
+                                raise ValueError()
+                    except ValueError:
+                        pass
+
+            aggregates = dict(Clocked.generate_aggregates())
+            tree = self._flatten()
+            Clocked.save(path)
+            stored = Clocked.load(path)
+            try:
+                self.assertEqual(tree, self._flatten())
+                self.assertIn(
+                    ('grandchild', 3, 3000, ['ValueError']),
+                    tree
+                )
+
+                for vectorized_reports in (False, True):
+                    if vectorized_reports and numpy is None:
+                        continue
+                    Settings.vectorized_reports = vectorized_reports
+                    loaded = dict(Clocked.generate_aggregates())
+                    self.assertEqual(sorted(aggregates), sorted(loaded))
+                    for name, aggregate in aggregates.items():
+                        self.assertEqual(aggregate.hits, loaded[name].hits)
+                        self.assertAlmostEqual(
+                            aggregate.total_ms,
+                            loaded[name].total_ms
+                        )
+                        self.assertEqual(
+                            aggregate.histogram.counts,
+                            loaded[name].histogram.counts
+                        )
+            finally:
+                stored.close()
+        finally:
+            os.remove(path)
+
+    @staticmethod
+    def _flatten():
+        result = []
+        paths = [Profiler.current().get_call_tree()]
+        while 0 < len(paths):
+            path = paths.pop()
+            result.append(
+                (path.name, path.hits, path.total_ns, path.exception_names)
+            )
+            if path.has_children:
+                paths.extend(reversed(path.children))
+
+        return result
+
+    def test_collapsed(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            self._session()
+            Clocked.export_collapsed(path)
+            with open(path) as f:
+                lines = dict(i.rsplit(' ', 1) for i in f.read().splitlines())
+        finally:
+            os.remove(path)
+
+        self.assertEqual('1000000', lines['test pruning;parent;child'])
+
+    def test_full_precision(self):
+        Clocked.initialize('test pruning precision')
+        for _ in range(1000):
+            with Clocked('tiny'):
+                self.now[0] += 40000
+
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertAlmostEqual(40.0, aggregates['tiny'].total_ms)
+        self.assertEqual(0.04, aggregates['tiny'].max_ms)
+        self.assertIn(
+            'tiny (40.0 ms [0.0, 0.0], 1000 hits',
+            '\n'.join(Clocked.generate_hotspot_report())
+        )
+
+    def test_decorator(self):
+        @clocked(min_save_ms=1)
+        def fast():
+            self.now[0] += 100000
+
+        @clocked(min_save_ms=1, sample_rate=2)
+        def sampled():
+            self.now[0] += 100000
+
+        Clocked.initialize('test pruning decorator')
+        for _ in range(10):
+            fast()
+            sampled()
+
+        self.assertFalse(Profiler.current().root.children)
+        aggregates = dict(Clocked.generate_aggregates())
+        self.assertEqual(10, aggregates[[
+            i for i in aggregates if '.fast:' in i
+        ][0]].hits)
+        self.assertEqual(10, aggregates[[
+            i for i in aggregates if '.sampled:' in i
+        ][0]].hits)
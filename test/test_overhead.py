@@ -50,6 +50,42 @@ class TestClocked(unittest.TestCase):
     #     self._compare()
     #     print('')
 
+    def test_comparison_event_recording(self):
+        # a benchmark rather than an assertion, as the relative speed of two
+        # wall clock measurements is too noisy to fail on
+        @clocked
+        def _test():
+            pass
+
+        def _time():
+            Clocked.initialize('template')
+            return min(timeit.repeat(_test, number=ITERATIONS, repeat=3))
+
+        with_timings = _time()
+        Settings.event_recording = True
+        try:
+            with_events = _time()
+        finally:
+            Settings.event_recording = False
+
+        print('with_timings: {} ms, with_events: {} ms'.format(
+            round(with_timings * 1000.0, 2),
+            round(with_events * 1000.0, 2)
+        ))
+
+    def test_disabled_call_overhead(self):
+        def _test():
+            pass
+
+        Settings.enabled = False
+        try:
+            disabled = clocked(_test)
+        finally:
+            Settings.enabled = True
+
+        # returned unchanged, so there is no overhead to time
+        self.assertIs(_test, disabled)
+
     def _compare(self):
         without = self.get_without()
         with_off = self.get_with_off()
@@ -78,21 +114,15 @@ class TestClocked(unittest.TestCase):
 
     def get_without(self):
         t = timeit.Timer(self._without)
-        t.timeit(ITERATIONS)
-        elapsed = t.timer()
-        return elapsed
+        return t.timeit(ITERATIONS)
 
     def get_with_off(self):
         Settings._profiler_provider = None
         ProfilerProvider._profiler = None
         t = timeit.Timer(self._with)
-        t.timeit(ITERATIONS)
-        elapsed = t.timer()
-        return elapsed
+        return t.timeit(ITERATIONS)
 
     def get_with_on(self):
         Clocked.initialize('template')
         t = timeit.Timer(self._with)
-        t.timeit(ITERATIONS)
-        elapsed = t.timer()
-        return elapsed
+        return t.timeit(ITERATIONS)